@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Content policy micro-benchmark: substring scan per term vs compiled matcher
+
+- legacy:   lowercase the prompt, then `term in prompt` for every term
+            (stops at the first hit, reports one term)
+- compiled: ContentPolicyMatcher, one regex pass reporting every hit
+- bulk:     ContentPolicyMatcher.find_all_many over the whole prompt list
+
+Runs with 10 and 1000 terms (the built-in list padded with synthetic
+Latin and Cyrillic words) over clean prompts from the style catalog.
+
+Usage:
+    python benchmarks/content_policy.py --terms 10 1000 --prompts 25 --rounds 200
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from worker.content_policy import DEFAULT_FORBIDDEN_TERMS, ContentPolicyMatcher
+from worker.prompts import PromptGenerator
+
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+CYRILLIC = "абвгдежзиклмнопрстуфхцчшэюя"
+
+
+def make_terms(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    terms = [term.rstrip("*") for term in DEFAULT_FORBIDDEN_TERMS][:count]
+    while len(terms) < count:
+        alphabet = LATIN if rng.random() < 0.5 else CYRILLIC
+        terms.append("".join(rng.choice(alphabet) for _ in range(rng.randint(5, 12))))
+    return terms
+
+
+def legacy_validate(prompt: str, terms) -> bool:
+    prompt_lower = prompt.lower()
+    for word in terms:
+        if word in prompt_lower:
+            return False
+    return True
+
+
+def measure(name: str, func, rounds: int, calls_per_round: int):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"  {name:10s} {elapsed / (rounds * calls_per_round) * 1e6:8.2f} us/prompt")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--terms", type=int, nargs="+", default=[10, 1000])
+    parser.add_argument("--prompts", type=int, default=25, help="prompts per list (premium session)")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    
+    prompts = PromptGenerator().generate_prompts({
+        "style": "CEO-05", "background": "modern glass office with city view", "purpose": "career",
+        "package_type": "premium"
+    })[:args.prompts]
+    
+    for count in args.terms:
+        terms = make_terms(count)
+        started = time.perf_counter()
+        matcher = ContentPolicyMatcher(terms)
+        print(f"{count} terms (compiled in {(time.perf_counter() - started) * 1000:.1f} ms):")
+        
+        measure("legacy", lambda: [legacy_validate(prompt, terms) for prompt in prompts], args.rounds, len(prompts))
+        measure("compiled", lambda: [matcher.find_all(prompt) for prompt in prompts], args.rounds, len(prompts))
+        measure("bulk", lambda: matcher.find_all_many(prompts), args.rounds, len(prompts))
+        
+        assert [legacy_validate(prompt, terms) for prompt in prompts] == \
+            [not hits for hits in matcher.find_all_many(prompts)]
+
+
+if __name__ == "__main__":
+    main()
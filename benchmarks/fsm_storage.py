@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+FSM storage benchmark: update_data at high rates
+
+Simulates many users updating their session data concurrently (the photo
+upload flow does one update_data per photo) and reports throughput,
+update latency and how many backend writes the batching saved.
+
+Backends:
+- memory: aiogram MemoryStorage (baseline, not persistent)
+- sqlite: SQLiteFSMStorage on a temporary file (WAL)
+- redis: RedisFSMStorage against --redis-url, or in-process fakeredis
+
+Usage:
+    python benchmarks/fsm_storage.py --users 500 --updates 20
+    python benchmarks/fsm_storage.py --backend redis --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# Dummy settings so bot modules can be imported without a real .env
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ASSISTANT_ID", "test")
+os.environ.setdefault("TEMP_DIR", "/tmp/photobot-bench")
+os.environ.setdefault("LOGS_DIR", "/tmp/photobot-bench/logs")
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from bot.storage import BatchedFSMStorage, RedisFSMStorage, SQLiteFSMStorage
+
+BOT_ID = 123456
+TTL = 30 * 60
+
+
+def create_storage(name: str, args, tmp_dir: str):
+    if name == "memory":
+        return MemoryStorage()
+    
+    if name == "sqlite":
+        return SQLiteFSMStorage(os.path.join(tmp_dir, "fsm.sqlite3"), ttl=TTL,
+                                flush_interval=args.flush_ms / 1000)
+    
+    storage = RedisFSMStorage(args.redis_url or "redis://localhost:6379/15", ttl=TTL,
+                              flush_interval=args.flush_ms / 1000)
+    if not args.redis_url:
+        # No server given: in-process fakeredis speaks the same protocol
+        import fakeredis
+        storage.redis = fakeredis.FakeAsyncRedis(max_connections=args.users * 2)
+    return storage
+
+
+async def user_session(storage, user_id: int, updates: int, latencies: List[float]):
+    key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+    await storage.set_state(key, "PhotoSessionStates:waiting_photos")
+    
+    for i in range(updates):
+        started = time.perf_counter()
+        data = await storage.get_data(key)
+        photos = data.get("photos", []) + [f"/tmp/{user_id}_{i}.jpg"]
+        await storage.update_data(key, {"photos": photos, "photo_scores": {p: 50.0 for p in photos}})
+        latencies.append(time.perf_counter() - started)
+        # Let other users interleave like real concurrent updates
+        await asyncio.sleep(0)
+
+
+async def run_backend(name: str, args) -> str:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = create_storage(name, args, tmp_dir)
+        latencies: List[float] = []
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            user_session(storage, 1000 + u, args.updates, latencies) for u in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        
+        if isinstance(storage, BatchedFSMStorage):
+            await storage.flush()
+            flush_started = time.perf_counter()
+            await storage.close()
+            close_time = time.perf_counter() - flush_started
+            writes = f"flushes={storage.flush_count} keys_written={storage.flushed_keys} close={close_time * 1000:.1f}ms"
+        else:
+            await storage.close()
+            writes = "flushes=n/a"
+        
+        total = len(latencies)
+        lat = sorted(latencies)
+        p = lambda q: lat[min(total - 1, int(q * total))] * 1_000_000
+        return (f"{name:7s} updates={total} elapsed={elapsed:.2f}s "
+                f"rate={total / elapsed:,.0f}/s p50={p(0.5):.0f}us p99={p(0.99):.0f}us {writes}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["memory", "sqlite", "redis", "all"], default="all")
+    parser.add_argument("--users", type=int, default=500, help="concurrent users")
+    parser.add_argument("--updates", type=int, default=20, help="update_data calls per user")
+    parser.add_argument("--flush-ms", type=float, default=50, help="write-behind flush interval")
+    parser.add_argument("--redis-url", help="Redis server (default: in-process fakeredis)")
+    args = parser.parse_args()
+    
+    backends = ["memory", "sqlite", "redis"] if args.backend == "all" else [args.backend]
+    for name in backends:
+        print(await run_backend(name, args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
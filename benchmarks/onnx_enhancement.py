@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+ONNX enhancement backend: placeholder resize vs tiled, batched ONNX upscale
+
+A tiny bilinear Resize model stands in for a Real-ESRGAN class model, so
+the numbers show tiling and batching overhead rather than model cost.
+Building it needs the `onnx` package, which the worker image does not ship:
+    
+    pip install onnx
+
+Usage:
+    python benchmarks/onnx_enhancement.py --images 8 --size 1024 --batch 1 4 8
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# Dummy settings so worker modules can be imported without a real .env
+for name in ("YC_MQ_URL", "PIAPI_KEY", "YC_ACCESS_KEY", "YC_SECRET_KEY", "BOT_TOKEN"):
+    os.environ.setdefault(name, "bench")
+
+import numpy as np
+
+try:
+    import onnx
+    from onnx import helper, TensorProto
+except ImportError:
+    sys.exit("This benchmark needs the onnx package: pip install onnx")
+
+from worker.post_processor import OnnxEnhancementBackend, PlaceholderEnhancementBackend
+
+
+def build_test_onnx_model(model_path: str, scale: int = 2) -> str:
+    """
+    Build a tiny ONNX model (bilinear Resize, NCHW float32, dynamic batch)
+    Stands in for CodeFormer (scale=1) or Real-ESRGAN (scale=2/4)
+    """
+    
+    x = helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", 3, "H", "W"])
+    y = helper.make_tensor_value_info("output", TensorProto.FLOAT, ["N", 3, "OH", "OW"])
+    scales = helper.make_tensor("scales", TensorProto.FLOAT, [4], [1.0, 1.0, float(scale), float(scale)])
+    
+    node = helper.make_node("Resize", ["input", "", "scales"], ["output"], mode="linear")
+    graph = helper.make_graph([node], "tiny_enhancer", [x], [y], initializer=[scales])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    
+    onnx.save(model, model_path)
+    return model_path
+
+
+async def run(backend, images, target: int) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(backend.upscale(img, target, target) for img in images))
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=8, help="images upscaled concurrently")
+    parser.add_argument("--size", type=int, default=1024, help="source image side, px")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4, 8], help="ONNX batch sizes")
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(1)
+    images = [rng.integers(0, 255, (args.size, args.size, 3), dtype=np.uint8) for _ in range(args.images)]
+    target = args.size * 2
+    
+    elapsed = await run(PlaceholderEnhancementBackend(), images, target)
+    print(f"placeholder      {elapsed / args.images * 1000:8.1f} ms/image")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = build_test_onnx_model(os.path.join(tmp, "upscale_x2.onnx"), scale=2)
+        for batch_size in args.batch:
+            backend = OnnxEnhancementBackend(upscale_model_path=model_path, batch_size=batch_size)
+            elapsed = await run(backend, images, target)
+            print(f"onnx batch={batch_size:<3d}  {elapsed / args.images * 1000:8.1f} ms/image")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+PromptGenerator micro-benchmark: per-instance catalog vs shared StyleCatalog
+
+- legacy: what every PromptGenerator() used to do - rebuild the catalog
+          dicts, then format each prompt in a loop
+- catalog cold: first generate_prompts() for a (style, background, purpose)
+- catalog warm: repeated generate_prompts() (cached lookup plus list copy)
+  after every brief was planned once
+
+Usage:
+    python benchmarks/prompt_catalog.py --iterations 20000
+"""
+
+import argparse
+import copy
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from worker.prompts import (BUILTIN_BACKGROUNDS, BUILTIN_MOODS, BUILTIN_PURPOSES, BUILTIN_STYLES,
+                            PromptGenerator, StyleCatalog)
+
+BRIEFS = [
+    {"style": style, "background": background, "purpose": purpose, "package_type": package}
+    for style in ("RL-01", "CP-03", "CEO-05")
+    for background in ("studio", "urban", "sunny beach with palms")
+    for purpose in ("insta", "career")
+    for package in ("trial", "premium")
+]
+
+
+def legacy_generate(brief):
+    """Old behavior: catalog rebuilt per instance, prompts formatted one by one"""
+    
+    styles = copy.deepcopy(BUILTIN_STYLES)
+    backgrounds = dict(BUILTIN_BACKGROUNDS)
+    moods = dict(BUILTIN_MOODS)
+    
+    template = styles.get(brief["style"], styles["RL-01"])
+    background = brief["background"]
+    if background.lower() in backgrounds:
+        background_desc = backgrounds[background.lower()]
+    elif len(background) > 5:
+        background_desc = f"background: {background}"
+    else:
+        background_desc = backgrounds["studio"]
+    
+    count = {"trial": 2, "basic": 5, "standard": 12, "premium": 25}[brief["package_type"]]
+    prompts = []
+    for i in range(count):
+        base_prompt = template["base"].format(background=background_desc)
+        if i < len(template["variations"]):
+            prompt = f"{base_prompt}, {template['variations'][i]}"
+        else:
+            prompt = f"{base_prompt}, {list(moods.values())[i % len(moods)]}"
+        if brief["purpose"] in BUILTIN_PURPOSES:
+            prompt += f", {BUILTIN_PURPOSES[brief['purpose']]}"
+        if template.get("lora_type"):
+            prompt += f" <lora_type:\"{template['lora_type']}\", lora_strength:{template.get('lora_strength', 0.7)}>"
+        prompts.append(prompt)
+    return prompts
+
+
+def measure(name, func, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(BRIEFS[i % len(BRIEFS)])
+    elapsed = time.perf_counter() - started
+    print(f"{name:16s} {elapsed / iterations * 1e6:8.2f} us/call  ({iterations} calls)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    
+    legacy = measure("legacy", legacy_generate, args.iterations)
+    
+    def cold(brief):
+        # Fresh catalog each call: build + format, nothing cached
+        catalog = StyleCatalog(BUILTIN_STYLES, BUILTIN_BACKGROUNDS, BUILTIN_MOODS, BUILTIN_PURPOSES)
+        return catalog.prompts(brief["style"], brief["background"], brief["purpose"], 25)
+    
+    measure("catalog cold", cold, max(args.iterations // 10, 1))
+    
+    # Plan every brief once, so only cached lookups are timed
+    for brief in BRIEFS:
+        PromptGenerator().generate_prompts(brief)
+    warm = measure("catalog warm", lambda brief: PromptGenerator().generate_prompts(brief), args.iterations)
+    print(f"speedup (warm vs legacy): {legacy / warm:.1f}x")
+    
+    # The plan differs from the legacy list since prompts are picked for diversity
+    # (benchmarks/prompt_diversity.py), but cached and fresh plans must agree
+    catalog = StyleCatalog(BUILTIN_STYLES, BUILTIN_BACKGROUNDS, BUILTIN_MOODS, BUILTIN_PURPOSES)
+    generator = PromptGenerator()
+    assert all(
+        list(catalog.prompts(brief["style"], brief["background"], brief["purpose"], len(legacy_generate(brief)),
+                             generator.CROSS_STYLE_PACKAGES.get(brief["package_type"], 0)))
+        == generator.generate_prompts(brief)
+        for brief in BRIEFS
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Prompt diversity: legacy variation/mood cycling vs the diversity planner
+
+For every brief of benchmarks/prompt_catalog.py reports how many prompts of
+the package are exact repeats, and the smallest and mean pairwise token
+Jaccard distance (0 = identical prompts). Also times a cold plan.
+
+Usage:
+    python benchmarks/prompt_diversity.py --package premium standard
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from prompt_catalog import BRIEFS, legacy_generate
+from worker.prompt_planner import jaccard_distance, prompt_tokens
+from worker.prompts import (BUILTIN_BACKGROUNDS, BUILTIN_MOODS, BUILTIN_PURPOSES, BUILTIN_STYLES,
+                            PromptGenerator, StyleCatalog)
+
+
+def diversity(prompts):
+    tokens = [prompt_tokens(prompt) for prompt in prompts]
+    distances = [jaccard_distance(a, b) for i, a in enumerate(tokens) for b in tokens[i + 1:]]
+    return len(prompts) - len(set(prompts)), min(distances), statistics.mean(distances)
+
+
+def report(name, results):
+    repeats = sum(result[0] for result in results)
+    print(f"  {name:8s} repeated={repeats:4d}  min distance={min(r[1] for r in results):.3f}  "
+          f"mean distance={statistics.mean(r[2] for r in results):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--package", nargs="+", default=["premium", "standard", "basic"])
+    args = parser.parse_args()
+    
+    generator = PromptGenerator()
+    for package in args.package:
+        briefs = [dict(brief, package_type=package) for brief in BRIEFS if brief["package_type"] == "trial"]
+        print(f"{package} ({len(briefs)} briefs, {len(legacy_generate(briefs[0]))} prompts each):")
+        report("legacy", [diversity(legacy_generate(brief)) for brief in briefs])
+        report("planned", [diversity(generator.generate_prompts(brief)) for brief in briefs])
+        
+        started = time.perf_counter()
+        for brief in briefs:
+            catalog = StyleCatalog(BUILTIN_STYLES, BUILTIN_BACKGROUNDS, BUILTIN_MOODS, BUILTIN_PURPOSES)
+            catalog.prompts(brief["style"], brief["background"], brief["purpose"], len(legacy_generate(brief)),
+                            generator.CROSS_STYLE_PACKAGES.get(package, 0))
+        print(f"  cold plan {(time.perf_counter() - started) / len(briefs) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
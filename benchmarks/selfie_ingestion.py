@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Selfie ingestion throughput: TEMP_DIR download vs direct object storage upload
+
+Runs against local stand-ins: a fake Bot API server (getFile + file download)
+and a fake S3 endpoint that accepts PutObject, both with configurable latency.
+
+- local:  save_photo into TEMP_DIR, one photo at a time (old behavior,
+          the worker still could not read these files)
+- object: SelfieUploader.ingest, whole session concurrently
+
+Usage:
+    python benchmarks/selfie_ingestion.py --photos 15 --sessions 4
+    python benchmarks/selfie_ingestion.py --concurrency 1 4 8 16 --max-side 1536
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# Dummy settings so bot modules can be imported without a real .env
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ASSISTANT_ID", "test")
+os.environ.setdefault("TEMP_DIR", tempfile.mkdtemp(prefix="photobot-bench-"))
+os.environ.setdefault("LOGS_DIR", "/tmp/photobot-bench/logs")
+os.environ.setdefault("YC_ACCESS_KEY", "bench")
+os.environ.setdefault("YC_SECRET_KEY", "bench")
+
+import numpy as np
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import PhotoSize
+from PIL import Image
+
+from bot.uploads import SelfieUploader
+from bot.utils import save_photo
+
+TOKEN = os.environ["BOT_TOKEN"]
+
+
+def make_jpeg(size: int, seed: int) -> bytes:
+    """Noisy photo-sized JPEG (noise keeps it close to real file sizes)"""
+    
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, "JPEG", quality=85)
+    return output.getvalue()
+
+
+class StandIns:
+    """Fake Bot API file endpoints and S3 PutObject on one aiohttp server"""
+    
+    def __init__(self, image: bytes, latency_ms: float):
+        self.image = image
+        self.latency = latency_ms / 1000
+        self.stored_bytes = 0
+        self.put_count = 0
+    
+    async def bot_api(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        if request.match_info["method"] == "getFile":
+            params = dict(request.query)
+            if request.can_read_body:
+                params.update(await request.post())
+            return web.json_response({"ok": True, "result": {
+                "file_id": params["file_id"], "file_unique_id": params["file_id"],
+                "file_size": len(self.image), "file_path": f"photos/{params['file_id']}.jpg"
+            }})
+        return web.json_response({"ok": True, "result": True})
+    
+    async def file(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.Response(body=self.image, content_type="image/jpeg")
+    
+    async def put_object(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        await asyncio.sleep(self.latency)
+        self.stored_bytes += len(body)
+        self.put_count += 1
+        return web.Response(status=200, headers={"ETag": '"bench"'})
+    
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.bot_api)
+        app.router.add_get("/file/bot{token}/{path:.*}", self.file)
+        app.router.add_put("/{bucket}/{key:.*}", self.put_object)
+        return app
+
+
+def photos_for(session: int, count: int):
+    return [
+        PhotoSize(file_id=f"s{session}p{i}", file_unique_id=f"s{session}p{i}", width=2048, height=2048)
+        for i in range(count)
+    ]
+
+
+async def run_local(bot: Bot, sessions: int, count: int) -> float:
+    started = time.perf_counter()
+    
+    async def session(s: int):
+        session_id = f"bench_{s}"
+        (Path(os.environ["TEMP_DIR"]) / session_id).mkdir(parents=True, exist_ok=True)
+        for photo in photos_for(s, count):
+            await save_photo(photo, session_id, bot)
+    
+    await asyncio.gather(*(session(s) for s in range(sessions)))
+    return time.perf_counter() - started
+
+
+async def run_object(bot: Bot, base_url: str, sessions: int, count: int,
+                     concurrency: int, max_side: int) -> float:
+    uploader = SelfieUploader(max_concurrency=concurrency, max_side=max_side,
+                              endpoint_url=base_url, bucket_name="bench")
+    started = time.perf_counter()
+    
+    await asyncio.gather(*(
+        uploader.ingest(bot, photo, f"bench_{s}")
+        for s in range(sessions) for photo in photos_for(s, count)
+    ))
+    
+    elapsed = time.perf_counter() - started
+    uploader.shutdown()
+    return elapsed
+
+
+def report(name: str, total: int, elapsed: float, extra: str = ""):
+    print(f"{name:22s} photos={total} elapsed={elapsed:.2f}s "
+          f"throughput={total / elapsed:.1f} photos/s {extra}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=15, help="photos per session")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--size", type=int, default=2048, help="test photo side, px")
+    parser.add_argument("--latency-ms", type=float, default=40, help="stand-in request latency")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--max-side", type=int, default=0, help="downscale before upload (0 = off)")
+    parser.add_argument("--port", type=int, default=18090)
+    args = parser.parse_args()
+    
+    stand_ins = StandIns(make_jpeg(args.size, seed=1), args.latency_ms)
+    runner = web.AppRunner(stand_ins.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    total = args.photos * args.sessions
+    print(f"photo size {len(stand_ins.image) // 1024} KB, latency {args.latency_ms:.0f}ms per request")
+    
+    report("local (no upload)", total, await run_local(bot, args.sessions, args.photos))
+    
+    for concurrency in args.concurrency:
+        stand_ins.stored_bytes = stand_ins.put_count = 0
+        elapsed = await run_object(bot, base_url, args.sessions, args.photos, concurrency, args.max_side)
+        report(f"object c={concurrency}", total, elapsed,
+               f"uploaded={stand_ins.put_count} avg={stand_ins.stored_bytes // max(stand_ins.put_count, 1) // 1024} KB")
+    
+    await bot.session.close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
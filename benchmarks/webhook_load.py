@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Local load test: webhook vs polling update delivery
+
+Replays recorded updates (JSONL, one Telegram Update per line) or synthetic
+text messages into the bot dispatcher and reports time-to-handler latency:
+
+- webhook: updates are POSTed to the bot's aiohttp webhook app
+- polling: updates are served by a fake Bot API getUpdates endpoint
+
+Usage:
+    python benchmarks/webhook_load.py --updates 2000 --rate 500 --work-ms 20
+    python benchmarks/webhook_load.py --recorded updates.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# Dummy settings so bot modules can be imported without a real .env
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ASSISTANT_ID", "test")
+os.environ.setdefault("TEMP_DIR", "/tmp/photobot-bench")
+os.environ.setdefault("LOGS_DIR", "/tmp/photobot-bench/logs")
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+
+from bot.webhook import create_webhook_app
+
+TOKEN = os.environ["BOT_TOKEN"]
+SECRET = "bench-secret"
+
+
+def synthetic_updates(count: int) -> List[Dict[str, Any]]:
+    """Text message updates from a few hundred users"""
+    
+    updates = []
+    for i in range(count):
+        user_id = 1000 + i % 300
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+                "text": f"message {i}"
+            }
+        })
+    return updates
+
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    """Recorded updates, renumbered so update_id is unique and increasing"""
+    
+    updates = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                update = json.loads(line)
+                update["update_id"] = i + 1
+                updates.append(update)
+    return updates
+
+
+def create_dispatcher(latencies: List[float], sent_at: Dict[int, float],
+                      done: asyncio.Event, total: int, work_ms: float) -> Dispatcher:
+    dp = Dispatcher()
+    
+    @dp.update.outer_middleware()
+    async def measure(handler, event, data):
+        latencies.append(time.perf_counter() - sent_at[event.update_id])
+        try:
+            return await handler(event, data)
+        finally:
+            if len(latencies) >= total:
+                done.set()
+    
+    @dp.message(F.text)
+    async def handle(message: Message):
+        # Simulated handler work (FSM access, API calls)
+        await asyncio.sleep(work_ms / 1000)
+    
+    return dp
+
+
+class FakeBotAPI:
+    """Minimal Bot API server: long-polling getUpdates over a queue"""
+    
+    def __init__(self):
+        self.updates: List[Dict[str, Any]] = []
+        self.new_updates = asyncio.Condition()
+    
+    async def push(self, update: Dict[str, Any]):
+        async with self.new_updates:
+            self.updates.append(update)
+            self.new_updates.notify_all()
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.can_read_body:
+            params.update(await request.post())
+        
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"
+            }})
+        
+        if method == "getUpdates":
+            offset = int(params.get("offset", 0) or 0)
+            limit = int(params.get("limit", 100) or 100)
+            timeout = float(params.get("timeout", 0) or 0)
+            
+            async with self.new_updates:
+                ready = [u for u in self.updates if u["update_id"] >= offset]
+                if not ready and timeout:
+                    try:
+                        await asyncio.wait_for(self.new_updates.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    ready = [u for u in self.updates if u["update_id"] >= offset]
+                # Drop confirmed updates
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            
+            return web.json_response({"ok": True, "result": ready[:limit]})
+        
+        return web.json_response({"ok": True, "result": True})
+
+
+async def replay(updates: List[Dict[str, Any]], rate: float, send, sent_at: Dict[int, float]):
+    """Send updates at fixed rate"""
+    
+    interval = 1.0 / rate if rate > 0 else 0
+    start = time.perf_counter()
+    
+    for i, update in enumerate(updates):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sent_at[update["update_id"]] = time.perf_counter()
+        await send(update)
+
+
+async def run_webhook(updates, rate, work_ms, port) -> Dict[str, Any]:
+    latencies, sent_at, done = [], {}, asyncio.Event()
+    dp = create_dispatcher(latencies, sent_at, done, len(updates), work_ms)
+    bot = Bot(token=TOKEN)
+    
+    app = create_webhook_app(bot, dp, secret_token=SECRET, path="/webhook")
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    
+    ack_times = []
+    connector = aiohttp.TCPConnector(limit=40)  # Telegram's default max_connections
+    
+    async with aiohttp.ClientSession(connector=connector) as session:
+        pending = set()
+        
+        async def post(update):
+            started = time.perf_counter()
+            async with session.post(
+                f"http://127.0.0.1:{port}/webhook",
+                json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            ) as response:
+                assert response.status == 200, response.status
+            ack_times.append(time.perf_counter() - started)
+        
+        async def send(update):
+            task = asyncio.create_task(post(update))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        
+        started = time.perf_counter()
+        await replay(updates, rate, send, sent_at)
+        await asyncio.wait_for(done.wait(), timeout=120)
+        elapsed = time.perf_counter() - started
+        if pending:
+            await asyncio.gather(*pending)
+    
+    await runner.cleanup()
+    return {"latencies": latencies, "ack": ack_times, "elapsed": elapsed}
+
+
+async def run_polling(updates, rate, work_ms, port) -> Dict[str, Any]:
+    latencies, sent_at, done = [], {}, asyncio.Event()
+    dp = create_dispatcher(latencies, sent_at, done, len(updates), work_ms)
+    
+    api = FakeBotAPI()
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+    bot = Bot(token=TOKEN, session=session)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    await asyncio.sleep(0.2)
+    
+    started = time.perf_counter()
+    await replay(updates, rate, api.push, sent_at)
+    await asyncio.wait_for(done.wait(), timeout=120)
+    elapsed = time.perf_counter() - started
+    
+    await dp.stop_polling()
+    await polling
+    await runner.cleanup()
+    return {"latencies": latencies, "ack": [], "elapsed": elapsed}
+
+
+def summarize(name: str, result: Dict[str, Any], total: int):
+    lat = sorted(result["latencies"])
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+    print(f"{name:8s} updates={total} elapsed={result['elapsed']:.2f}s "
+          f"throughput={total / result['elapsed']:.0f}/s "
+          f"latency p50={p(0.5):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms max={lat[-1] * 1000:.1f}ms")
+    if result["ack"]:
+        print(f"{'':8s} webhook 200 ack mean={statistics.mean(result['ack']) * 1000:.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recorded", help="JSONL file with recorded updates")
+    parser.add_argument("--updates", type=int, default=1000, help="synthetic updates count")
+    parser.add_argument("--rate", type=float, default=200, help="updates per second")
+    parser.add_argument("--work-ms", type=float, default=20, help="simulated handler time")
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+    
+    updates = load_updates(args.recorded) if args.recorded else synthetic_updates(args.updates)
+    
+    webhook = await run_webhook(updates, args.rate, args.work_ms, args.port)
+    summarize("webhook", webhook, len(updates))
+    
+    polling = await run_polling(updates, args.rate, args.work_ms, args.port + 1)
+    summarize("polling", polling, len(updates))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
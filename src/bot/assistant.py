@@ -5,17 +5,27 @@ OpenAI Assistant integration
 import asyncio
 import json
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Tuple
 from openai import AsyncOpenAI
 from aiogram.fsm.context import FSMContext
 
+from .config import Config
+from .producer import get_job_producer
+from .storage import create_thread_store
+from .threads import ThreadRegistry
+
 logger = logging.getLogger(__name__)
 
 
 class OpenAIAssistant:
     """Класс для работы с OpenAI Assistant"""
     
-    def __init__(self, api_key: str, assistant_id: str, base_url: str = None):
+    ACTIVE_RUN_STATUSES = ("queued", "in_progress", "cancelling")
+    
+    def __init__(self, api_key: str, assistant_id: str, base_url: str = None,
+                 threads: Optional[ThreadRegistry] = None, streaming: bool = True,
+                 poll_initial_delay: float = 0.25, poll_max_delay: float = 2.0,
+                 max_concurrent_runs: int = 20):
         """Initialize OpenAI Assistant"""
         
         self.assistant_id = assistant_id
@@ -24,52 +34,133 @@ class OpenAIAssistant:
             base_url=base_url
         )
         
-        # Store user threads
-        self.user_threads: Dict[int, str] = {}
+        # Bounded user -> thread registry
+        self.threads = threads or ThreadRegistry()
+        
+        # Streaming runs, polling with backoff as fallback
+        self.streaming = streaming
+        self.poll_initial_delay = poll_initial_delay
+        self.poll_max_delay = poll_max_delay
+        
+        # Per-user turn queues: user_id -> [(message, state, on_text, future)]
+        # One run per thread at a time, bounded number of runs overall
+        self._pending_turns: Dict[int, List[Tuple[str, FSMContext, Any, asyncio.Future]]] = {}
+        self._turn_workers: Dict[int, asyncio.Task] = {}
+        self._run_semaphore = asyncio.Semaphore(max_concurrent_runs)
+        self.max_concurrent_runs = max_concurrent_runs
+        self.active_runs = 0
+        self.turns_count = 0
+        self.coalesced_messages = 0
         
         logger.info(f"OpenAI Assistant initialized with ID: {assistant_id}")
     
     async def get_or_create_thread(self, user_id: int) -> str:
         """Get or create thread for user"""
         
-        if user_id not in self.user_threads:
+        thread_id = await self.threads.get(user_id)
+        
+        if thread_id is None:
             try:
-                thread = await self.client.threads.create()
-                self.user_threads[user_id] = thread.id
-                logger.info(f"Created new thread for user {user_id}: {thread.id}")
+                thread = await self.client.beta.threads.create()
+                thread_id = thread.id
+                self.threads.set(user_id, thread_id)
+                logger.info(f"Created new thread for user {user_id}: {thread_id}")
             except Exception as e:
                 logger.error(f"Error creating thread: {e}")
                 raise
         
-        return self.user_threads[user_id]
+        return thread_id
+    
+    async def handle_message(self, user_id: int, message: str, state: FSMContext,
+                             on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """
+        Handle message from user
+        Messages that arrive while the user's run is in flight are merged
+        into the next turn; only the last of them gets the reply, the
+        others resolve to None.
+        
+        Args:
+            on_text: called with the accumulated reply while it streams
+        """
+        
+        future = asyncio.get_event_loop().create_future()
+        self._pending_turns.setdefault(user_id, []).append((message, state, on_text, future))
+        
+        worker = self._turn_workers.get(user_id)
+        if worker is None or worker.done():
+            self._turn_workers[user_id] = asyncio.ensure_future(self._drain_turns(user_id))
+        
+        return await future
+    
+    async def _drain_turns(self, user_id: int):
+        """Run queued turns of one user sequentially"""
+        
+        try:
+            while self._pending_turns.get(user_id):
+                async with self._run_semaphore:
+                    # Take everything queued so far, including messages sent while waiting
+                    turns = self._pending_turns.pop(user_id, [])
+                    if not turns:
+                        break
+                    
+                    message = "\n\n".join(turn[0] for turn in turns)
+                    _, state, on_text, future = turns[-1]
+                    
+                    self.turns_count += 1
+                    self.coalesced_messages += len(turns) - 1
+                    if len(turns) > 1:
+                        logger.info(f"Merged {len(turns)} messages of user {user_id} into one turn")
+                    
+                    for _, _, _, earlier in turns[:-1]:
+                        if not earlier.done():
+                            earlier.set_result(None)
+                    
+                    self.active_runs += 1
+                    try:
+                        response = await self._run_turn(user_id, message, state, on_text)
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(response)
+                    finally:
+                        self.active_runs -= 1
+        finally:
+            self._turn_workers.pop(user_id, None)
+            # Fail whatever is left if the worker was cancelled
+            for *_, future in self._pending_turns.pop(user_id, []):
+                if not future.done():
+                    future.cancel()
     
-    async def handle_message(self, user_id: int, message: str, state: FSMContext) -> Optional[str]:
-        """Handle message from user"""
+    async def _run_turn(self, user_id: int, message: str, state: FSMContext,
+                        on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """Send message to user's thread and run assistant on it"""
         
         try:
             # Get or create thread
             thread_id = await self.get_or_create_thread(user_id)
             
             # Add user message to thread
-            await self.client.threads.messages.create(
+            await self.client.beta.threads.messages.create(
                 thread_id=thread_id,
                 role="user",
                 content=message
             )
             
-            # Create and run assistant
-            run = await self.client.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id
-            )
+            run, text, complete = None, "", False
+            if self.streaming:
+                try:
+                    run, text, complete = await self._stream_run(thread_id, on_text)
+                except Exception as e:
+                    logger.warning(f"Streaming run unavailable, falling back to polling: {e}")
             
-            # Wait for completion
-            while run.status in ["queued", "in_progress"]:
-                await asyncio.sleep(1)
-                run = await self.client.threads.runs.retrieve(
+            if run is None:
+                run = await self.client.beta.threads.runs.create(
                     thread_id=thread_id,
-                    run_id=run.id
+                    assistant_id=self.assistant_id
                 )
+                run = await self._poll_run(thread_id, run.id)
             
             # Handle tool calls
             if run.status == "requires_action":
@@ -84,7 +175,7 @@ class OpenAIAssistant:
                         await state.update_data(brief=brief_data)
                         
                         # Submit tool output
-                        await self.client.threads.runs.submit_tool_outputs(
+                        await self.client.beta.threads.runs.submit_tool_outputs(
                             thread_id=thread_id,
                             run_id=run.id,
                             tool_outputs=[{
@@ -100,7 +191,11 @@ class OpenAIAssistant:
             
             # Get assistant response
             elif run.status == "completed":
-                messages = await self.client.threads.messages.list(
+                # A broken stream leaves only part of the reply, read the final message then
+                if text and complete:
+                    return text
+                
+                messages = await self.client.beta.threads.messages.list(
                     thread_id=thread_id,
                     order="desc",
                     limit=1
@@ -119,13 +214,67 @@ class OpenAIAssistant:
             logger.error(f"Error handling message: {e}")
             return "❌ Произошла ошибка. Попробуй еще раз."
     
+    async def _stream_run(self, thread_id: str,
+                          on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> Tuple[Any, str, bool]:
+        """
+        Run assistant with event streaming
+        Returns the last run object, the streamed reply text and whether the
+        stream ended normally (otherwise the text may be cut short). Stops at
+        requires_action so the caller can handle tool calls.
+        """
+        
+        run, text, complete = None, "", True
+        
+        try:
+            async with self.client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=self.assistant_id
+            ) as stream:
+                async for event in stream:
+                    if event.event == "thread.message.delta":
+                        for part in event.data.delta.content or []:
+                            if part.type == "text" and part.text and part.text.value:
+                                text += part.text.value
+                        if on_text and text:
+                            await on_text(text)
+                    
+                    elif event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step"):
+                        run = event.data
+                        if run.status == "requires_action":
+                            break
+        
+        except Exception as e:
+            if run is None:
+                raise
+            # Run exists already, finish it by polling
+            logger.warning(f"Run stream {run.id} interrupted, polling: {e}")
+            complete = False
+        
+        if run is not None and run.status in self.ACTIVE_RUN_STATUSES:
+            run = await self._poll_run(thread_id, run.id)
+            complete = False
+        
+        return run, text, complete
+    
+    async def _poll_run(self, thread_id: str, run_id: str) -> Any:
+        """Wait for run to leave active statuses, polling with backoff"""
+        
+        delay = self.poll_initial_delay
+        while True:
+            run = await self.client.beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run_id
+            )
+            if run.status not in self.ACTIVE_RUN_STATUSES:
+                return run
+            
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, self.poll_max_delay)
+    
     async def _start_image_generation(self, user_id: int, brief_data: Dict[str, Any], state: FSMContext):
         """Start image generation process"""
         
         try:
-            # Import here to avoid circular imports
-            from .tasks import generate_images_task
-            
             # Get session data
             data = await state.get_data()
             session_id = data.get("session_id")
@@ -139,8 +288,8 @@ class OpenAIAssistant:
                 "photos": photos
             }
             
-            # Send to task queue
-            generate_images_task.delay(task_data)
+            # Store in outbox, sent to the queue in background
+            await get_job_producer().enqueue_generation(task_data)
             
             logger.info(f"Started image generation for user {user_id}, session {session_id}")
             
@@ -151,15 +300,14 @@ class OpenAIAssistant:
     async def reset_thread(self, user_id: int):
         """Reset thread for user"""
         
-        if user_id in self.user_threads:
-            del self.user_threads[user_id]
-            logger.info(f"Reset thread for user {user_id}")
+        self.threads.delete(user_id)
+        logger.info(f"Reset thread for user {user_id}")
     
     async def get_assistant_info(self) -> Dict[str, Any]:
         """Get assistant information"""
         
         try:
-            assistant = await self.client.assistants.retrieve(self.assistant_id)
+            assistant = await self.client.beta.assistants.retrieve(self.assistant_id)
             return {
                 "id": assistant.id,
                 "name": assistant.name,
@@ -169,4 +317,50 @@ class OpenAIAssistant:
             }
         except Exception as e:
             logger.error(f"Error getting assistant info: {e}")
-            raise 
\ No newline at end of file
+            raise
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Thread registry and run metrics"""
+        
+        return {
+            "threads": self.threads.get_stats(),
+            "runs": {
+                "active": self.active_runs,
+                "max_concurrent": self.max_concurrent_runs,
+                "queued_users": len(self._pending_turns),
+                "turns": self.turns_count,
+                "coalesced_messages": self.coalesced_messages
+            }
+        }
+    
+    async def close(self):
+        """Flush thread registry and close API client"""
+        
+        await self.threads.close()
+        await self.client.close()
+
+
+# Глобальный экземпляр
+openai_assistant = None
+
+
+def get_openai_assistant() -> OpenAIAssistant:
+    """Получение общего экземпляра ассистента"""
+    global openai_assistant
+    
+    if openai_assistant is None:
+        config = Config()
+        openai_assistant = OpenAIAssistant(
+            api_key=config.OPENAI_API_KEY,
+            assistant_id=config.ASSISTANT_ID,
+            streaming=config.ASSISTANT_STREAMING,
+            max_concurrent_runs=config.ASSISTANT_MAX_CONCURRENT_RUNS,
+            threads=ThreadRegistry(
+                store=create_thread_store(),
+                max_size=config.THREAD_REGISTRY_SIZE,
+                ttl=config.THREAD_TTL_HOURS * 3600,
+                flush_interval=config.THREAD_FLUSH_INTERVAL_SECONDS
+            )
+        )
+    
+    return openai_assistant
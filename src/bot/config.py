@@ -32,9 +32,41 @@ class Config:
     YC_REGION: str = os.getenv("YC_REGION", "ru-central1")
     YC_ENDPOINT: str = os.getenv("YC_ENDPOINT", "https://storage.yandexcloud.net")
     
+    # User photos: object (upload to YC), local (TEMP_DIR), auto (object if YC keys are set)
+    PHOTO_INGESTION: str = os.getenv("PHOTO_INGESTION", "auto")
+    PHOTO_UPLOAD_CONCURRENCY: int = int(os.getenv("PHOTO_UPLOAD_CONCURRENCY", "8"))
+    PHOTO_UPLOAD_MAX_SIDE: int = int(os.getenv("PHOTO_UPLOAD_MAX_SIDE", "0"))
+    
+    # Webhook (polling is used when WEBHOOK_URL is empty)
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBAPP_HOST: str = os.getenv("WEBAPP_HOST", "0.0.0.0")
+    WEBAPP_PORT: int = int(os.getenv("WEBAPP_PORT", "8080"))
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    WEBHOOK_MAX_CONCURRENT_UPDATES: int = int(os.getenv("WEBHOOK_MAX_CONCURRENT_UPDATES", "100"))
+    
+    # FSM storage (memory, sqlite, redis)
+    FSM_STORAGE: str = os.getenv("FSM_STORAGE", "memory")
+    FSM_SQLITE_PATH: str = os.getenv("FSM_SQLITE_PATH", "/app/data/fsm.sqlite3")
+    FSM_REDIS_URL: str = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+    FSM_FLUSH_INTERVAL_MS: int = int(os.getenv("FSM_FLUSH_INTERVAL_MS", "50"))
+    
+    # Assistant thread registry
+    THREAD_REGISTRY_SIZE: int = int(os.getenv("THREAD_REGISTRY_SIZE", "10000"))
+    THREAD_TTL_HOURS: int = int(os.getenv("THREAD_TTL_HOURS", "168"))
+    THREAD_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("THREAD_FLUSH_INTERVAL_SECONDS", "1"))
+    
+    # Assistant replies
+    ASSISTANT_STREAMING: bool = os.getenv("ASSISTANT_STREAMING", "True").lower() == "true"
+    STREAM_EDIT_INTERVAL_SECONDS: float = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1"))
+    ASSISTANT_MAX_CONCURRENT_RUNS: int = int(os.getenv("ASSISTANT_MAX_CONCURRENT_RUNS", "20"))
+    
     # Yandex Message Queue
     YC_MQ_URL: str = os.getenv("YC_MQ_URL", "")
     YC_MQ_QUEUE_NAME: str = os.getenv("YC_MQ_QUEUE_NAME", "jobs")
+    JOB_OUTBOX_PATH: str = os.getenv("JOB_OUTBOX_PATH", "/app/data/outbox.sqlite3")
+    JOB_PRODUCER_LINGER_MS: int = int(os.getenv("JOB_PRODUCER_LINGER_MS", "50"))
     
     # App settings
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
@@ -49,6 +81,13 @@ class Config:
     MAX_PHOTOS_PER_SESSION: int = int(os.getenv("MAX_PHOTOS_PER_SESSION", "15"))
     MAX_FILE_SIZE_MB: int = int(os.getenv("MAX_FILE_SIZE_MB", "10"))
     SESSION_TIMEOUT_MINUTES: int = int(os.getenv("SESSION_TIMEOUT_MINUTES", "30"))
+    MEDIA_GROUP_LATENCY_MS: int = int(os.getenv("MEDIA_GROUP_LATENCY_MS", "600"))
+    
+    # Photo quality analysis
+    QUALITY_ANALYSIS_WORKERS: int = int(os.getenv("QUALITY_ANALYSIS_WORKERS", "2"))
+    QUALITY_ANALYSIS_MAX_SIDE: int = int(os.getenv("QUALITY_ANALYSIS_MAX_SIDE", "1024"))
+    DUPLICATE_PHASH_DISTANCE: int = int(os.getenv("DUPLICATE_PHASH_DISTANCE", "8"))
+    DUPLICATE_DHASH_DISTANCE: int = int(os.getenv("DUPLICATE_DHASH_DISTANCE", "10"))
     
     # Prices (in rubles)
     PRICE_40_PHOTOS: int = int(os.getenv("PRICE_40_PHOTOS", "1099"))
@@ -2,9 +2,11 @@
 Message handlers for Telegram Bot
 """
 
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from aiogram import Dispatcher, F
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+from aiogram import Bot, Dispatcher, F
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, CallbackQuery, ContentType
 from aiogram.fsm.context import FSMContext
@@ -12,7 +14,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from .config import Config
-from .utils import validate_photo, save_photo, create_session_id
+from .utils import validate_photo, save_photo, create_session_id, StreamingReply
+from .quality import get_quality_analyzer, PhotoHashIndex, rank_photos
+from .uploads import get_selfie_uploader
 from .assistant import OpenAIAssistant
 from .states import PhotoSessionStates
 
@@ -438,8 +442,8 @@ async def callback_back_to_start(callback: CallbackQuery, state: FSMContext):
     await cmd_start(callback.message, state, None)
 
 
-async def handle_photo(message: Message, state: FSMContext):
-    """Handle photo upload"""
+async def handle_photo(message: Message, state: FSMContext, bot: Bot, album: Optional[List[Message]] = None):
+    """Handle photo upload (single photo or a whole album)"""
     
     current_state = await state.get_state()
     
@@ -449,11 +453,15 @@ async def handle_photo(message: Message, state: FSMContext):
         )
         return
     
+    messages = album or [message]
     data = await state.get_data()
     photos = data.get("photos", [])
     
-    # Validate photo
-    if not validate_photo(message.photo[-1]):
+    # Validate photos
+    valid = [m.photo[-1] for m in messages if m.photo and validate_photo(m.photo[-1])]
+    rejected = len(messages) - len(valid)
+    
+    if not valid:
         await message.answer(
             "❌ Фото не подходит. Проверь, что:\n"
             "• Лицо четко видно\n"
@@ -462,16 +470,106 @@ async def handle_photo(message: Message, state: FSMContext):
         )
         return
     
-    # Save photo
-    photo_path = await save_photo(message.photo[-1], data["session_id"])
-    photos.append(photo_path)
+    uploader = get_selfie_uploader()
+    analyzer = get_quality_analyzer()
+    
+    if uploader:
+        # Keep photos in memory, they go straight to object storage
+        results = await asyncio.gather(
+            *(uploader.download(bot, photo) for photo in valid),
+            return_exceptions=True
+        )
+        items = [(photo, blob) for photo, blob in zip(valid, results) if isinstance(blob, bytes)]
+        inspections = await asyncio.gather(*(analyzer.inspect_bytes_async(blob) for _, blob in items))
+    else:
+        # Save the whole group concurrently
+        results = await asyncio.gather(
+            *(save_photo(photo, data["session_id"], bot) for photo in valid),
+            return_exceptions=True
+        )
+        items = [(photo, path) for photo, path in zip(valid, results) if isinstance(path, str)]
+        inspections = await asyncio.gather(*(analyzer.inspect_async(path) for _, path in items))
+    
+    rejected += len(results) - len(items)
+    for error in results:
+        if isinstance(error, Exception):
+            logger.error(f"Error fetching photo: {error}")
+    
+    if not items:
+        await message.answer("❌ Не удалось сохранить фото. Попробуй еще раз.")
+        return
+    
+    # Reject near-duplicates of photos already in this session (or in the same album)
+    hash_index = PhotoHashIndex(
+        data.get("photo_hashes", []),
+        phash_distance=config.DUPLICATE_PHASH_DISTANCE,
+        dhash_distance=config.DUPLICATE_DHASH_DISTANCE
+    )
+    photo_scores = data.get("photo_scores", {})
+    duplicates = 0
+    kept = []
+    
+    for (photo, item), inspection in zip(items, inspections):
+        # Photos are identified by URL when they live in object storage
+        photo_id = uploader.object_url(data["session_id"], photo.file_unique_id) if uploader else item
+        
+        if "phash" in inspection:
+            duplicate_of = hash_index.find_duplicate(inspection["phash"], inspection["dhash"])
+            if duplicate_of:
+                logger.info(f"Duplicate photo {photo_id} of {duplicate_of} rejected")
+                if not uploader:
+                    Path(item).unlink(missing_ok=True)
+                duplicates += 1
+                continue
+            hash_index.add(photo_id, inspection["phash"], inspection["dhash"])
+        
+        kept.append((photo, item, photo_id, inspection))
+    
+    if uploader and kept:
+        # Only unique photos are uploaded; the job gets their URLs
+        uploads = await asyncio.gather(
+            *(uploader.upload(blob, data["session_id"], photo.file_unique_id) for photo, blob, _, _ in kept),
+            return_exceptions=True
+        )
+        failed = {photo_id for (_, _, photo_id, _), upload in zip(kept, uploads) if isinstance(upload, Exception)}
+        if failed:
+            logger.error(f"Failed to upload {len(failed)} photos: {[u for u in uploads if isinstance(u, Exception)]}")
+            rejected += len(failed)
+            kept = [entry for entry in kept if entry[2] not in failed]
+            hash_index.entries = [entry for entry in hash_index.entries if entry["path"] not in failed]
+    
+    for _, _, photo_id, inspection in kept:
+        photo_scores[photo_id] = inspection.get("score", 0.0)
+        photos.append(photo_id)
+    
+    # Keep photos ordered by quality so the best ones go to generation first
+    photos = rank_photos(photos, photo_scores)
+    
+    # One FSM write per album
+    await state.update_data(
+        photos=photos,
+        photo_hashes=hash_index.to_list(),
+        photo_scores=photo_scores
+    )
+    
+    if duplicates and len(messages) == 1:
+        await message.answer(
+            "⚠️ Это фото уже загружено (или очень похоже на загруженное).\n"
+            "Пришли, пожалуйста, другое фото с новым ракурсом или эмоцией."
+        )
+        return
     
-    await state.update_data(photos=photos)
+    notes = ""
+    if duplicates:
+        notes += f"⚠️ Пропущено похожих фото: {duplicates}\n"
+    if rejected:
+        notes += f"❌ Не подошло фото: {rejected}\n"
     
     # Check if we have enough photos
     if len(photos) >= 10:
         await message.answer(
-            f"✅ Отлично! Загружено {len(photos)} фото.\n\n"
+            f"✅ Отлично! Загружено {len(photos)} фото.\n"
+            f"{notes}\n"
             "Теперь расскажи мне о своих предпочтениях для фотосессии:",
             reply_markup=get_brief_keyboard()
         )
@@ -480,6 +578,7 @@ async def handle_photo(message: Message, state: FSMContext):
         remaining = 10 - len(photos)
         await message.answer(
             f"📸 Фото {len(photos)}/10 загружено!\n"
+            f"{notes}"
             f"Загрузи еще {remaining} фото для продолжения."
         )
 
@@ -492,14 +591,16 @@ async def handle_text(message: Message, state: FSMContext, openai_assistant: Ope
     if current_state == PhotoSessionStates.collecting_brief:
         # Forward to OpenAI Assistant
         try:
+            reply = StreamingReply(message, edit_interval=config.STREAM_EDIT_INTERVAL_SECONDS)
             response = await openai_assistant.handle_message(
                 user_id=message.from_user.id,
                 message=message.text,
-                state=state
+                state=state,
+                on_text=reply.update
             )
             
             if response:
-                await message.answer(response)
+                await reply.finish(response)
         
         except Exception as e:
             logger.error(f"Error handling message with assistant: {e}")
@@ -13,7 +13,6 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, CallbackQuery, InputFile, FSInputFile
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -21,7 +20,11 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 
 from .handlers import setup_handlers
-from .middleware import OpenAIMiddleware
+from .webhook import run_webhook
+from .storage import create_fsm_storage
+from .middleware import OpenAIMiddleware, AlbumMiddleware
+from .assistant import get_openai_assistant
+from .producer import get_job_producer
 from .utils import setup_logging, create_temp_dir
 from .config import Config
 from .states import PhotoSessionStates
@@ -59,12 +62,13 @@ async def create_bot() -> Bot:
 async def create_dispatcher() -> Dispatcher:
     """Create and configure dispatcher"""
     
-    # Use memory storage for FSM
-    storage = MemoryStorage()
+    # FSM storage from FSM_STORAGE (memory, sqlite, redis)
+    storage = create_fsm_storage()
     dp = Dispatcher(storage=storage)
     
     # Add middleware
     dp.message.middleware(OpenAIMiddleware())
+    dp.message.middleware(AlbumMiddleware(latency=config.MEDIA_GROUP_LATENCY_MS / 1000))
     dp.callback_query.middleware(OpenAIMiddleware())
     
     # Setup handlers
@@ -80,6 +84,9 @@ async def on_startup(bot: Bot):
     # Create temp directory for files
     create_temp_dir()
     
+    # Start sending queued jobs (including ones left from previous run)
+    get_job_producer().start()
+    
     # Get bot info
     bot_info = await bot.get_me()
     logger.info(f"Bot started: @{bot_info.username}")
@@ -95,9 +102,14 @@ async def on_startup(bot: Bot):
     ])
 
 
-async def on_shutdown(bot: Bot):
+async def on_shutdown(bot: Bot, dispatcher: Dispatcher):
     """On shutdown callback"""
     logger.info("Bot shutting down...")
+    
+    # Flush pending FSM writes and assistant threads
+    await dispatcher.storage.close()
+    await get_openai_assistant().close()
+    await get_job_producer().close()
     await bot.session.close()
 
 
@@ -112,9 +124,14 @@ async def main():
         dp.startup.register(on_startup)
         dp.shutdown.register(on_shutdown)
         
-        # Start polling
-        logger.info("Starting bot polling...")
-        await dp.start_polling(bot)
+        if config.WEBHOOK_URL:
+            # Webhook mode: updates are pushed by Telegram through Caddy
+            logger.info("Starting bot in webhook mode...")
+            await run_webhook(bot, dp)
+        else:
+            # Start polling
+            logger.info("Starting bot polling...")
+            await dp.start_polling(bot)
         
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
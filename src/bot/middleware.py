@@ -2,13 +2,13 @@
 Middleware for OpenAI Assistant integration
 """
 
+import asyncio
 import logging
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, List
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Message, CallbackQuery
 
-from .assistant import OpenAIAssistant
-from .config import Config
+from .assistant import get_openai_assistant
 
 logger = logging.getLogger(__name__)
 
@@ -18,11 +18,8 @@ class OpenAIMiddleware(BaseMiddleware):
     
     def __init__(self):
         super().__init__()
-        self.config = Config()
-        self.assistant = OpenAIAssistant(
-            api_key=self.config.OPENAI_API_KEY,
-            assistant_id=self.config.ASSISTANT_ID
-        )
+        # Shared by message and callback middlewares
+        self.assistant = get_openai_assistant()
     
     async def __call__(
         self,
@@ -48,4 +45,60 @@ class OpenAIMiddleware(BaseMiddleware):
                 logger.info(f"User {user_id} (@{username}) pressed button: {callback_data}")
         
         # Continue with handler
-        return await handler(event, data) 
\ No newline at end of file
+        return await handler(event, data)
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Collects messages of one media group (album) into a single handler call
+    The first message of a group waits until no new parts arrive for
+    `latency` seconds, then the handler gets all of them as data["album"];
+    the other messages of the group are swallowed
+    """
+    
+    def __init__(self, latency: float = 0.6):
+        super().__init__()
+        self.latency = latency
+        self._albums: Dict[str, List[Message]] = {}
+        self._last_seen: Dict[str, float] = {}
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Handle middleware call"""
+        
+        if not isinstance(event, Message) or not event.media_group_id:
+            return await handler(event, data)
+        
+        loop = asyncio.get_event_loop()
+        key = f"{event.chat.id}:{event.media_group_id}"
+        
+        if key in self._albums:
+            # Part of an album that is already being collected
+            self._albums[key].append(event)
+            self._last_seen[key] = loop.time()
+            return None
+        
+        self._albums[key] = [event]
+        self._last_seen[key] = loop.time()
+        
+        try:
+            # Debounce: wait until the group stops growing
+            while True:
+                delay = self._last_seen[key] + self.latency - loop.time()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            album = self._albums.pop(key)
+        finally:
+            self._albums.pop(key, None)
+            self._last_seen.pop(key, None)
+        
+        album.sort(key=lambda m: m.message_id)
+        logger.info(f"Collected album {event.media_group_id} of {len(album)} messages")
+        
+        data["album"] = album
+        return await handler(album[0], data)
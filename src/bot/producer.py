@@ -0,0 +1,349 @@
+"""
+Job producer: bot -> Yandex Message Queue
+Jobs are written to a local outbox first and sent in the background in
+SendMessageBatch calls, so handlers never wait for the queue
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import boto3
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+config = Config()
+
+# SendMessageBatch limit of SQS / YC MQ
+MAX_BATCH_SIZE = 10
+
+
+class AsyncYandexMessageQueue:
+    """
+    Async YC MQ client of the bot
+    Same interface as worker.mq_client.AsyncYandexMessageQueue (the bot
+    image does not ship the worker package) plus batch sending
+    """
+    
+    def __init__(self, queue_url: str, access_key: str, secret_key: str, region: str = "ru-central1",
+                 endpoint_url: str = "https://message-queue.api.cloud.yandex.net"):
+        self.queue_url = queue_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.endpoint_url = endpoint_url
+        self.is_fifo = queue_url.endswith(".fifo")
+        
+        self._sync_client = None
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mq-producer")
+    
+    def _get_client(self):
+        """Получение синхронного клиента (lazy initialization)"""
+        if self._sync_client is None:
+            self._sync_client = boto3.client(
+                'sqs',
+                region_name=self.region,
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+                endpoint_url=self.endpoint_url
+            )
+        return self._sync_client
+    
+    async def send_message_batch(self, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Send up to 10 messages in one request
+        
+        Args:
+            entries: dicts with Id, MessageBody and optional FIFO attributes
+        
+        Returns:
+            SQS response with Successful and Failed lists
+        """
+        
+        def _send():
+            return self._get_client().send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, _send)
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class JobOutbox:
+    """Durable local outbox of jobs not yet accepted by the queue (SQLite)"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-outbox")
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " key TEXT PRIMARY KEY,"
+                " body TEXT NOT NULL,"
+                " group_id TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt REAL NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+    
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    def _add_sync(self, key: str, body: str, group_id: Optional[str]) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO outbox (key, body, group_id, next_attempt, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, body, group_id, now, now)
+            )
+        return cursor.rowcount > 0
+    
+    def _due_sync(self, limit: int) -> List[Tuple[str, str, Optional[str], int]]:
+        return self._connect().execute(
+            "SELECT key, body, group_id, attempts FROM outbox WHERE next_attempt <= ? ORDER BY created_at LIMIT ?",
+            (time.time(), limit)
+        ).fetchall()
+    
+    def _complete_sync(self, sent: List[str], failed: List[Tuple[str, float]]):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM outbox WHERE key = ?", [(key,) for key in sent])
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt = ? WHERE key = ?",
+                [(next_attempt, key) for key, next_attempt in failed]
+            )
+    
+    def _stats_sync(self) -> Tuple[int, Optional[float]]:
+        return self._connect().execute("SELECT COUNT(*), MIN(created_at) FROM outbox").fetchone()
+    
+    async def add(self, key: str, body: str, group_id: Optional[str] = None) -> bool:
+        """Add job, False if a job with the same key is already waiting"""
+        return await self._run(self._add_sync, key, body, group_id)
+    
+    async def due(self, limit: int) -> List[Tuple[str, str, Optional[str], int]]:
+        return await self._run(self._due_sync, limit)
+    
+    async def complete(self, sent: List[str], failed: List[Tuple[str, float]]):
+        await self._run(self._complete_sync, sent, failed)
+    
+    async def stats(self) -> Tuple[int, Optional[float]]:
+        return await self._run(self._stats_sync)
+    
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+def make_idempotency_key(task_type: str, session_id: str) -> str:
+    """Stable key of a job: one generation per session"""
+    
+    return hashlib.sha256(f"{task_type}:{session_id}".encode("utf-8")).hexdigest()[:64]
+
+
+class JobProducer:
+    """
+    Background sender of outbox jobs
+    Bursts are collected for `linger` seconds and sent in batches of up to
+    10 messages; failed entries are retried with exponential backoff
+    """
+    
+    def __init__(self, client: AsyncYandexMessageQueue, outbox: JobOutbox, linger: float = 0.05,
+                 retry_base_delay: float = 1.0, retry_max_delay: float = 300.0, poll_interval: float = 5.0):
+        self.client = client
+        self.outbox = outbox
+        self.linger = linger
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.poll_interval = poll_interval
+        
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+        self.enqueued_count = 0
+        self.duplicate_count = 0
+        self.sent_count = 0
+        self.failed_count = 0
+        self.batch_count = 0
+    
+    async def enqueue(self, task_type: str, data: Dict[str, Any], idempotency_key: str,
+                      group_id: Optional[str] = None) -> bool:
+        """
+        Put job into outbox (returns as soon as it is stored locally)
+        
+        Returns:
+            False if the same job is already waiting to be sent
+        """
+        
+        body = json.dumps({
+            "task_type": task_type,
+            "data": data,
+            "idempotency_key": idempotency_key
+        }, ensure_ascii=False)
+        
+        added = await self.outbox.add(idempotency_key, body, group_id)
+        if added:
+            self.enqueued_count += 1
+            self._wakeup.set()
+        else:
+            self.duplicate_count += 1
+            logger.info(f"Job {idempotency_key[:12]} is already in outbox")
+        return added
+    
+    async def enqueue_generation(self, task_data: Dict[str, Any]) -> bool:
+        """Enqueue image generation job of a session"""
+        
+        return await self.enqueue(
+            "generate_images",
+            task_data,
+            idempotency_key=make_idempotency_key("generate_images", task_data["session_id"]),
+            group_id=str(task_data["user_id"])
+        )
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+            # Send whatever survived a restart
+            self._wakeup.set()
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            
+            # Let a burst accumulate into full batches
+            await asyncio.sleep(self.linger)
+            
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Job producer error: {e}")
+    
+    async def flush(self) -> int:
+        """Send all due outbox jobs, returns number of accepted messages"""
+        
+        sent_total = 0
+        while True:
+            rows = await self.outbox.due(MAX_BATCH_SIZE)
+            if not rows:
+                return sent_total
+            
+            sent, failed = await self._send_batch(rows)
+            await self.outbox.complete(sent, failed)
+            sent_total += len(sent)
+            
+            if failed:
+                # Retry later with backoff instead of hammering the queue
+                return sent_total
+    
+    async def _send_batch(self, rows) -> Tuple[List[str], List[Tuple[str, float]]]:
+        entries = []
+        for i, (key, body, group_id, _) in enumerate(rows):
+            entry = {"Id": str(i), "MessageBody": body}
+            if self.client.is_fifo:
+                entry["MessageDeduplicationId"] = key
+                entry["MessageGroupId"] = group_id or key
+            entries.append(entry)
+        
+        try:
+            response = await self.client.send_message_batch(entries)
+            failed_ids = {item["Id"] for item in response.get("Failed", [])}
+            for item in response.get("Failed", []):
+                logger.error(f"Queue rejected job: {item.get('Code')} {item.get('Message')}")
+        except Exception as e:
+            logger.error(f"Error sending {len(entries)} jobs to queue: {e}")
+            failed_ids = {entry["Id"] for entry in entries}
+        
+        self.batch_count += 1
+        sent, failed = [], []
+        now = time.time()
+        for i, (key, _, _, attempts) in enumerate(rows):
+            if str(i) in failed_ids:
+                delay = min(self.retry_base_delay * (2 ** attempts), self.retry_max_delay)
+                failed.append((key, now + delay))
+            else:
+                sent.append(key)
+        
+        self.sent_count += len(sent)
+        self.failed_count += len(failed)
+        if sent:
+            logger.info(f"Sent {len(sent)} jobs to queue in one batch")
+        return sent, failed
+    
+    async def close(self):
+        """Stop background sender (jobs stay in outbox until next start)"""
+        
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing job outbox: {e}")
+        await self.outbox.close()
+        self.client.close()
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        pending, oldest = await self.outbox.stats()
+        return {
+            "pending": pending,
+            "oldest_pending_age": round(time.time() - oldest, 1) if oldest else 0,
+            "enqueued": self.enqueued_count,
+            "duplicates": self.duplicate_count,
+            "sent": self.sent_count,
+            "failed_attempts": self.failed_count,
+            "batches": self.batch_count
+        }
+
+
+# Глобальный экземпляр
+job_producer = None
+
+
+def get_job_producer() -> JobProducer:
+    """Получение продюсера задач"""
+    global job_producer
+    
+    if job_producer is None:
+        if not config.YC_MQ_URL:
+            logger.warning("YC_MQ_URL is not set, jobs will wait in outbox")
+        job_producer = JobProducer(
+            client=AsyncYandexMessageQueue(
+                queue_url=config.YC_MQ_URL,
+                access_key=config.YC_ACCESS_KEY,
+                secret_key=config.YC_SECRET_KEY,
+                region=config.YC_REGION
+            ),
+            outbox=JobOutbox(config.JOB_OUTBOX_PATH),
+            linger=config.JOB_PRODUCER_LINGER_MS / 1000
+        )
+    
+    return job_producer
@@ -0,0 +1,274 @@
+"""
+Photo quality analysis service
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+import cv2
+import numpy as np
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+config = Config()
+
+
+def _bits_to_hex(bits: np.ndarray) -> str:
+    """Pack boolean hash bits into hex string"""
+    
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return f"{value:0{len(bits.flatten()) // 4}x}"
+
+
+def compute_phash(gray: np.ndarray) -> str:
+    """64-bit perceptual hash (DCT of 32x32, top-left 8x8 vs median)"""
+    
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    dct = cv2.dct(small)[:8, :8]
+    median = np.median(dct.flatten()[1:])  # DC term excluded
+    return _bits_to_hex(dct > median)
+
+
+def compute_dhash(gray: np.ndarray) -> str:
+    """64-bit difference hash (horizontal gradient of 9x8)"""
+    
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_hex(small[:, 1:] > small[:, :-1])
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """Bit distance between two hex hashes"""
+    
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+class PhotoHashIndex:
+    """
+    Perceptual hash index of one session's uploads
+    Stored in FSM data as a list of {"path", "phash", "dhash"} entries
+    """
+    
+    def __init__(self, entries: Optional[List[Dict[str, str]]] = None,
+                 phash_distance: int = 8, dhash_distance: int = 10):
+        self.entries = list(entries or [])
+        self.phash_distance = phash_distance
+        self.dhash_distance = dhash_distance
+    
+    def find_duplicate(self, phash: str, dhash: str) -> Optional[str]:
+        """Path of an already uploaded near-duplicate, None if unique"""
+        
+        for entry in self.entries:
+            # Both hashes must agree to keep false positives low
+            if (hamming_distance(phash, entry["phash"]) <= self.phash_distance
+                    and hamming_distance(dhash, entry["dhash"]) <= self.dhash_distance):
+                return entry["path"]
+        return None
+    
+    def add(self, path: str, phash: str, dhash: str):
+        self.entries.append({"path": path, "phash": phash, "dhash": dhash})
+    
+    def to_list(self) -> List[Dict[str, str]]:
+        return list(self.entries)
+
+
+def rank_photos(photos: List[str], scores: Dict[str, float]) -> List[str]:
+    """Order photos by quality score, best first (stable for equal scores)"""
+    
+    return sorted(photos, key=lambda path: scores.get(path, 0.0), reverse=True)
+
+
+class PhotoQualityAnalyzer:
+    """
+    Analyzes uploaded photos off the event loop
+    Face detector is loaded once per executor thread (CascadeClassifier
+    is not safe to share between threads) and runs on downscaled frames
+    """
+    
+    def __init__(self, max_side: int = 1024, max_workers: int = 2):
+        """
+        Initialize analyzer
+        
+        Args:
+            max_side: frames are downscaled so the longest side fits this
+            max_workers: executor threads for analysis
+        """
+        
+        self.max_side = max_side
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="photo-quality"
+        )
+        self._local = threading.local()
+        
+        logger.info(f"Photo quality analyzer initialized ({max_workers} workers, max side {max_side}px)")
+    
+    def _get_face_cascade(self) -> cv2.CascadeClassifier:
+        """Face detector of the current thread (lazy initialization)"""
+        
+        cascade = getattr(self._local, "face_cascade", None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            self._local.face_cascade = cascade
+        return cascade
+    
+    def _load_gray(self, image_path: str) -> Optional[np.ndarray]:
+        """Decode straight to grayscale and downscale to max_side"""
+        
+        return self._fit_gray(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE))
+    
+    def _decode_gray(self, data: bytes) -> Optional[np.ndarray]:
+        """Decode encoded image bytes to grayscale and downscale to max_side"""
+        
+        return self._fit_gray(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE))
+    
+    def _fit_gray(self, gray: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        if gray is None:
+            return None
+        
+        h, w = gray.shape[:2]
+        scale = self.max_side / max(h, w)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        
+        return gray
+    
+    def analyze(self, image_path: str) -> Dict[str, Any]:
+        """Analyze photo quality (blocking)"""
+        
+        try:
+            gray = self._load_gray(image_path)
+            if gray is None:
+                return {"quality": "poor", "reason": "Cannot read image", "score": 0.0}
+            
+            return self._analyze_gray(gray)
+            
+        except Exception as e:
+            logger.error(f"Error analyzing photo quality: {e}")
+            return {"quality": "unknown", "reason": str(e), "score": 0.0}
+    
+    def inspect(self, image_path: str) -> Dict[str, Any]:
+        """Quality analysis plus perceptual hashes from a single decode (blocking)"""
+        
+        return self._inspect(self._load_gray, image_path)
+    
+    def inspect_bytes(self, data: bytes) -> Dict[str, Any]:
+        """Same as inspect for an image held in memory (blocking)"""
+        
+        return self._inspect(self._decode_gray, data)
+    
+    def _inspect(self, load, source) -> Dict[str, Any]:
+        try:
+            gray = load(source)
+            if gray is None:
+                return {"quality": "poor", "reason": "Cannot read image", "score": 0.0}
+            
+            result = self._analyze_gray(gray)
+            result["phash"] = compute_phash(gray)
+            result["dhash"] = compute_dhash(gray)
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error inspecting photo: {e}")
+            return {"quality": "unknown", "reason": str(e), "score": 0.0}
+    
+    def _analyze_gray(self, gray: np.ndarray) -> Dict[str, Any]:
+        """Quality metrics of a grayscale frame"""
+        
+        # Calculate blur (Laplacian variance)
+        blur_score = cv2.Laplacian(gray, cv2.CV_64F).var()
+        
+        # Calculate brightness
+        brightness = np.mean(gray)
+        
+        # Face detection
+        faces = self._get_face_cascade().detectMultiScale(gray, 1.3, 5)
+        
+        # Quality assessment
+        quality = "good"
+        issues = []
+        
+        if blur_score < 100:
+            quality = "poor"
+            issues.append("Image is too blurry")
+        
+        if brightness < 50:
+            quality = "poor"
+            issues.append("Image is too dark")
+        elif brightness > 200:
+            quality = "poor"
+            issues.append("Image is too bright")
+        
+        if len(faces) == 0:
+            quality = "poor"
+            issues.append("No face detected")
+        elif len(faces) > 1:
+            quality = "fair"
+            issues.append("Multiple faces detected")
+        
+        return {
+            "quality": quality,
+            "score": self._score(blur_score, brightness, len(faces)),
+            "blur_score": blur_score,
+            "brightness": brightness,
+            "faces_count": len(faces),
+            "issues": issues
+        }
+    
+    def _score(self, blur_score: float, brightness: float, faces_count: int) -> float:
+        """Quality score 0..100 used to rank reference photos"""
+        
+        sharpness = min(blur_score / 300.0, 1.0) * 40
+        exposure = max(0.0, 1.0 - abs(brightness - 128) / 128) * 30
+        face = 30 if faces_count == 1 else (15 if faces_count > 1 else 0)
+        return float(round(sharpness + exposure + face, 2))
+    
+    async def analyze_async(self, image_path: str) -> Dict[str, Any]:
+        """Analyze photo quality in the analyzer executor"""
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self.analyze, image_path)
+    
+    async def inspect_async(self, image_path: str) -> Dict[str, Any]:
+        """Inspect photo (quality + hashes) in the analyzer executor"""
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self.inspect, image_path)
+    
+    async def inspect_bytes_async(self, data: bytes) -> Dict[str, Any]:
+        """Inspect in-memory photo in the analyzer executor"""
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self.inspect_bytes, data)
+    
+    async def analyze_batch(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+        """Analyze several photos concurrently, results in input order"""
+        
+        return list(await asyncio.gather(*(self.analyze_async(path) for path in image_paths)))
+    
+    def shutdown(self):
+        """Stop executor threads"""
+        
+        self._executor.shutdown(wait=False)
+
+
+# Глобальный экземпляр
+quality_analyzer = None
+
+
+def get_quality_analyzer() -> PhotoQualityAnalyzer:
+    """Получение общего анализатора качества фото"""
+    global quality_analyzer
+    
+    if quality_analyzer is None:
+        quality_analyzer = PhotoQualityAnalyzer(
+            max_side=config.QUALITY_ANALYSIS_MAX_SIDE,
+            max_workers=config.QUALITY_ANALYSIS_WORKERS
+        )
+    
+    return quality_analyzer
@@ -0,0 +1,460 @@
+"""
+Persistent FSM storage backends for the bot
+SQLite (WAL) for a single node, Redis protocol for several replicas
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+config = Config()
+
+
+class _Record:
+    """State and data of one FSM key"""
+    
+    __slots__ = ("state", "data", "expires_at")
+    
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                 expires_at: Optional[float] = None):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.expires_at = expires_at
+    
+    def is_expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+    
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class BatchedFSMStorage(BaseStorage):
+    """
+    Base FSM storage with write-behind batching
+    Writes land in a pending map and are flushed in one batch every
+    flush_interval seconds (or as soon as max_pending keys are dirty).
+    Reads see pending writes; optionally recent records are cached too.
+    """
+    
+    def __init__(self, ttl: Optional[float] = None, flush_interval: float = 0.05,
+                 max_pending: int = 500, cache_reads: bool = True, cache_size: int = 10000):
+        """
+        Args:
+            ttl: seconds a key lives after its last write (None = forever)
+            flush_interval: max delay before a write reaches the backend
+            max_pending: dirty keys that trigger an immediate flush
+            cache_reads: serve reads from a local LRU cache (single node only)
+            cache_size: max cached keys
+        """
+        
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.cache_reads = cache_reads
+        self.cache_size = cache_size
+        
+        self._pending: Dict[str, _Record] = {}
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        self.flush_count = 0
+        self.flushed_keys = 0
+    
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        thread_id = getattr(key, "thread_id", None)
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id or ''}:{key.destiny}"
+    
+    # Backend specific part
+    
+    async def _load(self, k: str) -> Optional[_Record]:
+        """Read record from backend, None if missing or expired"""
+        raise NotImplementedError
+    
+    async def _write_batch(self, batch: Dict[str, _Record]):
+        """Persist records (empty records mean delete)"""
+        raise NotImplementedError
+    
+    async def _close_backend(self):
+        pass
+    
+    # Record access
+    
+    def _cache_put(self, k: str, record: _Record):
+        if not self.cache_reads:
+            return
+        self._cache[k] = record
+        self._cache.move_to_end(k)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
+    async def _get_record(self, k: str) -> _Record:
+        now = time.time()
+        
+        record = self._pending.get(k)
+        if record is None and self.cache_reads:
+            record = self._cache.get(k)
+        if record is not None and not record.is_expired(now):
+            return record
+        
+        record = await self._load(k) or _Record()
+        self._cache_put(k, record)
+        return record
+    
+    def _mark_dirty(self, k: str, record: _Record):
+        record.expires_at = time.time() + self.ttl if self.ttl else None
+        self._pending[k] = record
+        self._cache_put(k, record)
+        
+        if len(self._pending) >= self.max_pending:
+            asyncio.ensure_future(self.flush())
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._delayed_flush())
+    
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+    
+    async def flush(self):
+        """Write all pending records to the backend in one batch"""
+        
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            
+            batch, self._pending = self._pending, {}
+            try:
+                await self._write_batch(batch)
+                self.flush_count += 1
+                self.flushed_keys += len(batch)
+            except Exception as e:
+                logger.error(f"FSM storage flush failed ({len(batch)} keys), will retry: {e}")
+                # Keep newer writes made during the failed flush
+                for k, record in batch.items():
+                    self._pending.setdefault(k, record)
+                if self._flush_task is None or self._flush_task.done():
+                    self._flush_task = asyncio.ensure_future(self._delayed_flush())
+    
+    # BaseStorage interface
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self._key(key)
+        record = await self._get_record(k)
+        record = _Record(state.state if isinstance(state, State) else state, record.data)
+        self._mark_dirty(k, record)
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get_record(self._key(key))
+        return record.state
+    
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self._key(key)
+        record = await self._get_record(k)
+        self._mark_dirty(k, _Record(record.state, data.copy()))
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get_record(self._key(key))
+        return record.data.copy()
+    
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await self._close_backend()
+
+
+class SQLiteFSMStorage(BatchedFSMStorage):
+    """FSM storage in a local SQLite database (WAL mode)"""
+    
+    def __init__(self, path: str, ttl: Optional[float] = None, evict_interval: float = 60.0, **kwargs):
+        super().__init__(ttl=ttl, **kwargs)
+        
+        self.path = path
+        self.evict_interval = evict_interval
+        self._last_eviction = 0.0
+        
+        # sqlite3 connection is used from a single dedicated thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        
+        logger.info(f"SQLite FSM storage: {path}")
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                " key TEXT PRIMARY KEY,"
+                " state TEXT,"
+                " data TEXT NOT NULL,"
+                " expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+    
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    def _load_sync(self, k: str) -> Optional[_Record]:
+        row = self._connect().execute(
+            "SELECT state, data, expires_at FROM fsm WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (k, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return _Record(row[0], json.loads(row[1]), row[2])
+    
+    def _write_batch_sync(self, batch: Dict[str, _Record]):
+        conn = self._connect()
+        upserts = [
+            (k, r.state, json.dumps(r.data, ensure_ascii=False), r.expires_at)
+            for k, r in batch.items() if not r.is_empty()
+        ]
+        deletes = [(k,) for k, r in batch.items() if r.is_empty()]
+        
+        with conn:
+            if upserts:
+                conn.executemany(
+                    "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                    "data = excluded.data, expires_at = excluded.expires_at",
+                    upserts
+                )
+            if deletes:
+                conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            
+            now = time.time()
+            if now - self._last_eviction >= self.evict_interval:
+                evicted = conn.execute("DELETE FROM fsm WHERE expires_at <= ?", (now,)).rowcount
+                self._last_eviction = now
+                if evicted:
+                    logger.info(f"Evicted {evicted} expired FSM sessions")
+    
+    async def _load(self, k: str) -> Optional[_Record]:
+        return await self._run(self._load_sync, k)
+    
+    async def _write_batch(self, batch: Dict[str, _Record]):
+        await self._run(self._write_batch_sync, batch)
+    
+    async def _close_backend(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+class RedisFSMStorage(BatchedFSMStorage):
+    """
+    FSM storage over the Redis protocol (Redis, KeyDB, local redis-server)
+    Expiry is delegated to Redis; batches are sent as one pipeline.
+    Reads always go to Redis unless this replica has an unflushed write,
+    so several bot replicas can share sessions.
+    """
+    
+    def __init__(self, url: str, ttl: Optional[float] = None, prefix: str = "fsm", **kwargs):
+        kwargs.setdefault("cache_reads", False)
+        super().__init__(ttl=ttl, **kwargs)
+        
+        from redis.asyncio import Redis
+        
+        self.redis = Redis.from_url(url)
+        self.prefix = prefix
+        
+        logger.info(f"Redis FSM storage: {url}")
+    
+    def _redis_key(self, k: str, part: str) -> str:
+        return f"{self.prefix}:{k}:{part}"
+    
+    async def _load(self, k: str) -> Optional[_Record]:
+        state, data = await self.redis.mget(self._redis_key(k, "state"), self._redis_key(k, "data"))
+        if state is None and data is None:
+            return None
+        if isinstance(state, bytes):
+            state = state.decode("utf-8")
+        return _Record(state, json.loads(data) if data else {})
+    
+    async def _write_batch(self, batch: Dict[str, _Record]):
+        ttl = int(self.ttl) if self.ttl else None
+        pipe = self.redis.pipeline(transaction=False)
+        
+        for k, record in batch.items():
+            state_key, data_key = self._redis_key(k, "state"), self._redis_key(k, "data")
+            
+            if record.state is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, record.state, ex=ttl)
+            
+            if record.data:
+                pipe.set(data_key, json.dumps(record.data, ensure_ascii=False), ex=ttl)
+            else:
+                pipe.delete(data_key)
+        
+        await pipe.execute()
+    
+    async def _close_backend(self):
+        await self.redis.close(close_connection_pool=True)
+
+
+class ThreadStore:
+    """Persistent user_id -> OpenAI thread_id mapping"""
+    
+    async def load(self, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+    
+    async def save_batch(self, batch: Dict[int, Optional[str]]):
+        """Persist mappings (None means delete), writing a mapping again restarts its TTL"""
+        raise NotImplementedError
+    
+    async def close(self):
+        pass
+
+
+class SQLiteThreadStore(ThreadStore):
+    """Thread mapping in the SQLite database shared with FSM storage"""
+    
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        self.path = path
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thread-store")
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS threads ("
+                " user_id INTEGER PRIMARY KEY,"
+                " thread_id TEXT NOT NULL,"
+                " expires_at REAL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+    
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    def _load_sync(self, user_id: int) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT thread_id FROM threads WHERE user_id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (user_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
+    
+    def _save_batch_sync(self, batch: Dict[int, Optional[str]]):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO threads (user_id, thread_id, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET thread_id = excluded.thread_id, "
+                "expires_at = excluded.expires_at",
+                [(user_id, thread_id, expires_at) for user_id, thread_id in batch.items() if thread_id]
+            )
+            conn.executemany(
+                "DELETE FROM threads WHERE user_id = ?",
+                [(user_id,) for user_id, thread_id in batch.items() if not thread_id]
+            )
+            conn.execute("DELETE FROM threads WHERE expires_at <= ?", (time.time(),))
+    
+    async def load(self, user_id: int) -> Optional[str]:
+        return await self._run(self._load_sync, user_id)
+    
+    async def save_batch(self, batch: Dict[int, Optional[str]]):
+        await self._run(self._save_batch_sync, batch)
+    
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+class RedisThreadStore(ThreadStore):
+    """Thread mapping in Redis (shared between bot replicas)"""
+    
+    def __init__(self, url: str, ttl: Optional[float] = None, prefix: str = "thread"):
+        from redis.asyncio import Redis
+        
+        self.redis = Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+    
+    async def load(self, user_id: int) -> Optional[str]:
+        thread_id = await self.redis.get(f"{self.prefix}:{user_id}")
+        if isinstance(thread_id, bytes):
+            thread_id = thread_id.decode("utf-8")
+        return thread_id
+    
+    async def save_batch(self, batch: Dict[int, Optional[str]]):
+        ttl = int(self.ttl) if self.ttl else None
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, thread_id in batch.items():
+            if thread_id:
+                pipe.set(f"{self.prefix}:{user_id}", thread_id, ex=ttl)
+            else:
+                pipe.delete(f"{self.prefix}:{user_id}")
+        await pipe.execute()
+    
+    async def close(self):
+        await self.redis.close(close_connection_pool=True)
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Create FSM storage from FSM_STORAGE setting (memory, sqlite, redis)"""
+    
+    ttl = config.SESSION_TIMEOUT_MINUTES * 60
+    flush_interval = config.FSM_FLUSH_INTERVAL_MS / 1000
+    
+    if config.FSM_STORAGE == "sqlite":
+        return SQLiteFSMStorage(config.FSM_SQLITE_PATH, ttl=ttl, flush_interval=flush_interval)
+    
+    if config.FSM_STORAGE == "redis":
+        return RedisFSMStorage(config.FSM_REDIS_URL, ttl=ttl, flush_interval=flush_interval)
+    
+    return MemoryStorage()
+
+
+def create_thread_store() -> Optional[ThreadStore]:
+    """Backing store for assistant threads, same backend as FSM storage"""
+    
+    ttl = config.THREAD_TTL_HOURS * 3600
+    
+    if config.FSM_STORAGE == "sqlite":
+        return SQLiteThreadStore(config.FSM_SQLITE_PATH, ttl=ttl)
+    
+    if config.FSM_STORAGE == "redis":
+        return RedisThreadStore(config.FSM_REDIS_URL, ttl=ttl)
+    
+    return None
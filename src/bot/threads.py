@@ -0,0 +1,179 @@
+"""
+Bounded registry of OpenAI Assistant threads
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .storage import ThreadStore
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadRegistry:
+    """
+    LRU + TTL map user_id -> thread_id
+    Keeps at most max_size users in memory; misses fall back to the
+    optional persistent store, new mappings are written behind in batches.
+    The TTL counts from the last access in both places: used mappings are
+    written again (restarting the store TTL) once TOUCH_FRACTION of it has
+    passed, and a mapping expired in memory is dropped from the store too
+    """
+    
+    TOUCH_FRACTION = 0.1
+    
+    def __init__(self, store: Optional[ThreadStore] = None, max_size: int = 10000,
+                 ttl: Optional[float] = None, flush_interval: float = 1.0):
+        """
+        Args:
+            store: persistent backing store (None = memory only)
+            max_size: max users kept in memory
+            ttl: seconds of inactivity before a thread is forgotten
+            flush_interval: max delay before a new mapping reaches the store
+        """
+        
+        self.store = store
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        
+        # user_id -> (thread_id, last access, last write to the store)
+        self._entries: "OrderedDict[int, Tuple[str, float, float]]" = OrderedDict()
+        self._dirty: Dict[int, Optional[str]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _put(self, user_id: int, thread_id: str, saved_at: float):
+        self._entries[user_id] = (thread_id, time.time(), saved_at)
+        self._entries.move_to_end(user_id)
+        
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def _touch(self, user_id: int, thread_id: str, saved_at: float):
+        """Record an access, refreshing the store TTL when it has aged"""
+        
+        now = time.time()
+        if self.store is not None and self.ttl and now - saved_at > self.ttl * self.TOUCH_FRACTION:
+            self._mark_dirty(user_id, thread_id)
+            saved_at = now
+        self._put(user_id, thread_id, saved_at)
+    
+    async def get(self, user_id: int) -> Optional[str]:
+        """Thread of the user, None if unknown or expired"""
+        
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            thread_id, last_access, saved_at = entry
+            if self.ttl and time.time() - last_access > self.ttl:
+                # Inactive for the whole TTL: the store copy goes too, instead of being reloaded
+                del self._entries[user_id]
+                self._mark_dirty(user_id, None)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._touch(user_id, thread_id, saved_at)
+            self.hits += 1
+            return thread_id
+        
+        if user_id in self._dirty:
+            # Evicted before it was flushed
+            thread_id = self._dirty[user_id]
+            if thread_id:
+                self._put(user_id, thread_id, time.time())
+                self.hits += 1
+                return thread_id
+                
+        elif self.store is not None:
+            try:
+                thread_id = await self.store.load(user_id)
+            except Exception as e:
+                logger.error(f"Error loading thread of user {user_id}: {e}")
+                thread_id = None
+            
+            if thread_id:
+                # Expiry of the stored copy is unknown, write it again
+                self._touch(user_id, thread_id, 0.0)
+                self.store_hits += 1
+                return thread_id
+        
+        self.misses += 1
+        return None
+    
+    def set(self, user_id: int, thread_id: str):
+        """Remember user's thread"""
+        
+        self._put(user_id, thread_id, time.time())
+        self._mark_dirty(user_id, thread_id)
+    
+    def delete(self, user_id: int):
+        """Forget user's thread"""
+        
+        self._entries.pop(user_id, None)
+        self._mark_dirty(user_id, None)
+    
+    def _mark_dirty(self, user_id: int, thread_id: Optional[str]):
+        if self.store is None:
+            return
+        
+        self._dirty[user_id] = thread_id
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._delayed_flush())
+    
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+    
+    async def flush(self):
+        """Write pending mappings to the store"""
+        
+        async with self._flush_lock:
+            if self.store is None or not self._dirty:
+                return
+            
+            batch, self._dirty = self._dirty, {}
+            try:
+                await self.store.save_batch(batch)
+            except Exception as e:
+                logger.error(f"Error saving {len(batch)} threads, will retry: {e}")
+                for user_id, thread_id in batch.items():
+                    self._dirty.setdefault(user_id, thread_id)
+                if self._flush_task is None or self._flush_task.done():
+                    self._flush_task = asyncio.ensure_future(self._delayed_flush())
+    
+    async def close(self):
+        """Flush pending mappings and close the store"""
+        
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        if self.store is not None:
+            await self.store.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.store_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.store_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "pending_writes": len(self._dirty)
+        }
@@ -0,0 +1,153 @@
+"""
+Direct upload of user photos to Yandex Object Storage
+"""
+
+import asyncio
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+import boto3
+from botocore.config import Config as BotoConfig
+from aiogram import Bot
+from aiogram.types import PhotoSize
+from PIL import Image
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+config = Config()
+
+
+class SelfieUploader:
+    """
+    Streams Telegram photos into object storage without touching local disk
+    Files are downloaded into memory, optionally downscaled and put under
+    sessions/{session_id}/selfies/; the public URL goes to the job instead
+    of a container-local path
+    """
+    
+    def __init__(self, max_concurrency: int = 8, max_side: int = 0, jpeg_quality: int = 90,
+                 endpoint_url: Optional[str] = None, bucket_name: Optional[str] = None):
+        """
+        Args:
+            max_concurrency: simultaneous downloads and uploads
+            max_side: downscale so the longest side fits (0 = keep original)
+            jpeg_quality: quality used when a photo is re-encoded
+        """
+        
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.endpoint_url = (endpoint_url or config.YC_ENDPOINT).rstrip("/")
+        self.bucket_name = bucket_name or config.YC_BUCKET_NAME
+        
+        self.s3_client = boto3.client(
+            's3',
+            endpoint_url=self.endpoint_url,
+            aws_access_key_id=config.YC_ACCESS_KEY,
+            aws_secret_access_key=config.YC_SECRET_KEY,
+            config=BotoConfig(
+                region_name=config.YC_REGION,
+                retries={'max_attempts': 3, 'mode': 'adaptive'},
+                signature_version='s3v4',
+                max_pool_connections=max_concurrency
+            )
+        )
+        
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="selfie-upload")
+        
+        self.uploaded_count = 0
+        self.uploaded_bytes = 0
+        
+        logger.info(f"Selfie uploader initialized for bucket {self.bucket_name} (concurrency {max_concurrency})")
+    
+    async def download(self, bot: Bot, photo: PhotoSize) -> bytes:
+        """Download Telegram photo into memory"""
+        
+        async with self._semaphore:
+            buffer = io.BytesIO()
+            await bot.download(photo, destination=buffer)
+            return buffer.getvalue()
+    
+    def prepare(self, data: bytes) -> bytes:
+        """Downscale photo to max_side (blocking), original bytes if it already fits"""
+        
+        if not self.max_side:
+            return data
+        
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= self.max_side:
+                return data
+            
+            image = image.convert("RGB")
+            image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=self.jpeg_quality)
+            return output.getvalue()
+    
+    def object_key(self, session_id: str, name: str) -> str:
+        return f"sessions/{session_id}/selfies/{name}.jpg"
+    
+    def object_url(self, session_id: str, name: str) -> str:
+        """Public URL the photo gets once uploaded"""
+        
+        return f"{self.endpoint_url}/{self.bucket_name}/{quote(self.object_key(session_id, name))}"
+    
+    def _put_object_sync(self, data: bytes, key: str):
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=data,
+            ContentType='image/jpeg',
+            ACL='public-read'
+        )
+    
+    async def upload(self, data: bytes, session_id: str, name: str) -> Dict[str, Any]:
+        """Upload photo bytes under the session prefix"""
+        
+        key = self.object_key(session_id, name)
+        
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            data = await loop.run_in_executor(self._executor, self.prepare, data)
+            await loop.run_in_executor(self._executor, self._put_object_sync, data, key)
+        
+        self.uploaded_count += 1
+        self.uploaded_bytes += len(data)
+        logger.info(f"Uploaded selfie {key} ({len(data) // 1024} KB)")
+        
+        return {"key": key, "url": self.object_url(session_id, name), "size": len(data)}
+    
+    async def ingest(self, bot: Bot, photo: PhotoSize, session_id: str) -> Dict[str, Any]:
+        """Download Telegram photo and upload it to object storage"""
+        
+        data = await self.download(bot, photo)
+        return await self.upload(data, session_id, photo.file_unique_id)
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# Глобальный экземпляр
+selfie_uploader = None
+
+
+def get_selfie_uploader() -> Optional[SelfieUploader]:
+    """Получение загрузчика фото (None, если фото хранятся локально)"""
+    global selfie_uploader
+    
+    if config.PHOTO_INGESTION == "local":
+        return None
+    if config.PHOTO_INGESTION == "auto" and not config.YC_ACCESS_KEY:
+        return None
+    
+    if selfie_uploader is None:
+        selfie_uploader = SelfieUploader(
+            max_concurrency=config.PHOTO_UPLOAD_CONCURRENCY,
+            max_side=config.PHOTO_UPLOAD_MAX_SIDE
+        )
+    
+    return selfie_uploader
@@ -2,21 +2,23 @@
 Utilities for Telegram Bot
 """
 
+import asyncio
 import os
 import logging
 import hashlib
 import uuid
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from pathlib import Path
 
-from aiogram.types import PhotoSize, File
+from aiogram.types import PhotoSize, File, Message
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from PIL import Image
-import cv2
-import numpy as np
 
 from .config import Config
+from .quality import get_quality_analyzer
 
 logger = logging.getLogger(__name__)
 config = Config()
@@ -119,60 +121,9 @@ async def save_photo(photo: PhotoSize, session_id: str, bot: Bot = None) -> str:
 
 
 def analyze_photo_quality(image_path: str) -> Dict[str, Any]:
-    """Analyze photo quality using OpenCV"""
+    """Analyze photo quality using OpenCV (blocking, see PhotoQualityAnalyzer for async/batch use)"""
     
-    try:
-        # Read image
-        image = cv2.imread(image_path)
-        if image is None:
-            return {"quality": "poor", "reason": "Cannot read image"}
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Calculate blur (Laplacian variance)
-        blur_score = cv2.Laplacian(gray, cv2.CV_64F).var()
-        
-        # Calculate brightness
-        brightness = np.mean(gray)
-        
-        # Face detection
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-        
-        # Quality assessment
-        quality = "good"
-        issues = []
-        
-        if blur_score < 100:
-            quality = "poor"
-            issues.append("Image is too blurry")
-        
-        if brightness < 50:
-            quality = "poor"
-            issues.append("Image is too dark")
-        elif brightness > 200:
-            quality = "poor"
-            issues.append("Image is too bright")
-        
-        if len(faces) == 0:
-            quality = "poor"
-            issues.append("No face detected")
-        elif len(faces) > 1:
-            quality = "fair"
-            issues.append("Multiple faces detected")
-        
-        return {
-            "quality": quality,
-            "blur_score": blur_score,
-            "brightness": brightness,
-            "faces_count": len(faces),
-            "issues": issues
-        }
-        
-    except Exception as e:
-        logger.error(f"Error analyzing photo quality: {e}")
-        return {"quality": "unknown", "reason": str(e)}
+    return get_quality_analyzer().analyze(image_path)
 
 
 def format_file_size(size_bytes: int) -> str:
@@ -283,4 +234,70 @@ def create_photo_preview(image_path: str, max_size: int = 256) -> str:
         
     except Exception as e:
         logger.error(f"Error creating photo preview: {e}")
-        return image_path 
\ No newline at end of file
+        return image_path
+
+
+class StreamingReply:
+    """
+    Telegram reply that grows while the assistant streams text
+    The first chunk is sent as a new message, later ones edit it at most
+    once per edit_interval (edits are rate limited by Telegram)
+    """
+    
+    def __init__(self, message: Message, edit_interval: float = 1.0):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.sent: Optional[Message] = None
+        self._shown = ""
+        self._next_edit = 0.0
+    
+    async def update(self, text: str):
+        """Show partial text (skipped if the last edit was too recent)"""
+        
+        if time.monotonic() < self._next_edit or text == self._shown:
+            return
+        try:
+            # Partial text may contain unbalanced markup, send it plain
+            await self._show(text + " …", partial=True, parse_mode=None)
+        except Exception as e:
+            logger.warning(f"Error updating streamed reply: {e}")
+    
+    async def finish(self, text: str):
+        """Show the final reply"""
+        
+        try:
+            await self._show(text)
+        except TelegramBadRequest as e:
+            # Reply markup Telegram cannot parse, fall back to plain text
+            logger.warning(f"Error sending final reply, retrying as plain text: {e}")
+            try:
+                await self._show(text, parse_mode=None)
+            except Exception as e:
+                logger.error(f"Error sending final reply as plain text: {e}")
+    
+    async def _show(self, text: str, partial: bool = False, **kwargs):
+        self._next_edit = time.monotonic() + self.edit_interval
+        
+        try:
+            if self.sent is None:
+                self.sent = await self.message.answer(text, **kwargs)
+            elif text != self._shown:
+                await self.sent.edit_text(text, **kwargs)
+            self._shown = text
+        
+        except TelegramRetryAfter as e:
+            self._next_edit = time.monotonic() + e.retry_after
+            if partial:
+                # Partial update, the next one will catch up
+                return
+            await asyncio.sleep(e.retry_after)
+            await self._show(text, **kwargs)
+        
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                self._shown = text
+                return
+            if partial:
+                logger.warning(f"Error updating streamed reply: {e}")
+                return
+            raise
@@ -0,0 +1,140 @@
+"""
+Webhook delivery mode for Telegram Bot (aiohttp server)
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from .assistant import get_openai_assistant
+from .producer import get_job_producer
+from .config import Config
+
+logger = logging.getLogger(__name__)
+config = Config()
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook handler that answers Telegram with 200 immediately and feeds
+    updates to the dispatcher in background tasks, at most
+    max_concurrent_updates at a time
+    """
+    
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = None,
+                 max_concurrent_updates: int = 100, **data: Any):
+        super().__init__(
+            dispatcher=dispatcher,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=secret_token,
+            **data
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrent_updates)
+        self.received_count = 0
+        self.handled_count = 0
+        self.error_count = 0
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        self.received_count += 1
+        return await super().handle(request)
+    
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            try:
+                await super()._background_feed_update(bot=bot, update=update)
+                self.handled_count += 1
+            except Exception as e:
+                self.error_count += 1
+                logger.error(f"Error handling webhook update {update.get('update_id')}: {e}")
+    
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "received": self.received_count,
+            "handled": self.handled_count,
+            "errors": self.error_count,
+            "in_flight": len(self._background_feed_update_tasks)
+        }
+
+
+def get_webhook_url() -> str:
+    """Full webhook URL (WEBHOOK_URL may be given with or without the path)"""
+    
+    url = config.WEBHOOK_URL.rstrip("/")
+    if not url.endswith(config.WEBHOOK_PATH):
+        url += config.WEBHOOK_PATH
+    return url
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher, secret_token: Optional[str] = None,
+                       path: str = "/webhook", max_concurrent_updates: int = 100) -> web.Application:
+    """Create aiohttp application serving webhook, /health and /status"""
+    
+    app = web.Application()
+    started_at = time.time()
+    
+    handler = BoundedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+        max_concurrent_updates=max_concurrent_updates
+    )
+    handler.register(app, path=path)
+    app["webhook_handler"] = handler
+    
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+    
+    async def status(request: web.Request) -> web.Response:
+        return web.json_response({
+            "mode": "webhook",
+            "uptime": int(time.time() - started_at),
+            "updates": handler.get_stats(),
+            "assistant": get_openai_assistant().get_stats(),
+            "jobs": await get_job_producer().get_stats()
+        })
+    
+    app.router.add_get("/health", health)
+    app.router.add_get("/status", status)
+    
+    # Emits dispatcher startup/shutdown together with the aiohttp app
+    setup_application(app, dp, bot=bot)
+    
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Register webhook in Telegram and serve updates until cancelled"""
+    
+    app = create_webhook_app(
+        bot,
+        dp,
+        secret_token=config.WEBHOOK_SECRET or None,
+        path=config.WEBHOOK_PATH,
+        max_concurrent_updates=config.WEBHOOK_MAX_CONCURRENT_UPDATES
+    )
+    
+    webhook_url = get_webhook_url()
+    await bot.set_webhook(
+        url=webhook_url,
+        secret_token=config.WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS
+    )
+    logger.info(f"Webhook set: {webhook_url}")
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBAPP_HOST, port=config.WEBAPP_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {config.WEBAPP_HOST}:{config.WEBAPP_PORT}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -28,16 +28,47 @@ class WorkerSettings(BaseSettings):
     
     # Telegram Bot
     BOT_TOKEN: str = Field(..., env="BOT_TOKEN")
+    TELEGRAM_GLOBAL_RATE: float = Field(default=30.0, env="TELEGRAM_GLOBAL_RATE")  # messages/s
+    TELEGRAM_CHAT_RATE: float = Field(default=1.0, env="TELEGRAM_CHAT_RATE")  # messages/s per chat
+    TELEGRAM_OUTBOX_SIZE: int = Field(default=1000, env="TELEGRAM_OUTBOX_SIZE")
+    TELEGRAM_MAX_CONNECTIONS: int = Field(default=10, env="TELEGRAM_MAX_CONNECTIONS")
+    TELEGRAM_MAX_RETRIES: int = Field(default=5, env="TELEGRAM_MAX_RETRIES")
+    TELEGRAM_FILE_ID_CACHE_PATH: str = Field(default="/app/data/file_ids.sqlite3", env="TELEGRAM_FILE_ID_CACHE_PATH")
+    PROGRESS_UPDATES_ENABLED: bool = Field(default=True, env="PROGRESS_UPDATES_ENABLED")
+    PROGRESS_EDIT_INTERVAL_SECONDS: float = Field(default=5.0, env="PROGRESS_EDIT_INTERVAL_SECONDS")
+    INCREMENTAL_DELIVERY: bool = Field(default=True, env="INCREMENTAL_DELIVERY")
+    DELIVERY_BATCH_SIZE: int = Field(default=4, env="DELIVERY_BATCH_SIZE")  # photos per media group, 1-10
     
     # Worker settings
     WORKER_CONCURRENCY: int = Field(default=4, env="WORKER_CONCURRENCY")
     MAX_RETRIES: int = Field(default=3, env="MAX_RETRIES")
     RETRY_DELAY: int = Field(default=60, env="RETRY_DELAY")  # seconds
+    JOB_STATE_PATH: str = Field(default="/app/data/jobs.sqlite3", env="JOB_STATE_PATH")
+    JOB_LEASE_SECONDS: int = Field(default=900, env="JOB_LEASE_SECONDS")
+    JOB_STATE_RETENTION_HOURS: int = Field(default=72, env="JOB_STATE_RETENTION_HOURS")
     
     # Image generation settings
     DEFAULT_IMAGE_SIZE: int = Field(default=1024, env="DEFAULT_IMAGE_SIZE")
+    GENERATION_CONCURRENCY: int = Field(default=4, env="GENERATION_CONCURRENCY")  # PiAPI calls per session
+    RESULT_CACHE_ENABLED: bool = Field(default=True, env="RESULT_CACHE_ENABLED")
+    RESULT_CACHE_PACKAGES: str = Field(default="trial", env="RESULT_CACHE_PACKAGES")  # comma separated
+    RESULT_CACHE_SIZE: int = Field(default=2048, env="RESULT_CACHE_SIZE")
+    RESULT_CACHE_TTL_HOURS: int = Field(default=720, env="RESULT_CACHE_TTL_HOURS")
+    RESULT_CACHE_SEED: int = Field(default=0, env="RESULT_CACHE_SEED")
     MAX_IMAGES_PER_SESSION: int = Field(default=100, env="MAX_IMAGES_PER_SESSION")
     
+    # Cost control (USD)
+    COST_BUDGETS_ENABLED: bool = Field(default=True, env="COST_BUDGETS_ENABLED")
+    COST_LEDGER_PATH: str = Field(default="/app/data/costs.sqlite3", env="COST_LEDGER_PATH")
+    COST_FLUX_SCHNELL: float = Field(default=0.002, env="COST_FLUX_SCHNELL")  # per image
+    COST_GPT_IMAGE: float = Field(default=0.04, env="COST_GPT_IMAGE")  # per image
+    SESSION_BUDGET_TRIAL: float = Field(default=0.4, env="SESSION_BUDGET_TRIAL")
+    SESSION_BUDGET_BASIC: float = Field(default=1.0, env="SESSION_BUDGET_BASIC")
+    SESSION_BUDGET_STANDARD: float = Field(default=2.5, env="SESSION_BUDGET_STANDARD")
+    SESSION_BUDGET_PREMIUM: float = Field(default=6.0, env="SESSION_BUDGET_PREMIUM")
+    GLOBAL_BUDGET_DAILY: float = Field(default=200.0, env="GLOBAL_BUDGET_DAILY")  # rolling 24 hours
+    COST_LOW_BUDGET_RATIO: float = Field(default=0.1, env="COST_LOW_BUDGET_RATIO")  # of the global budget
+    
     # Video generation settings
     VIDEO_ENABLED: bool = Field(default=True, env="VIDEO_ENABLED")
     VIDEO_DEFAULT_FPS: int = Field(default=20, env="VIDEO_DEFAULT_FPS")
@@ -49,9 +80,21 @@ class WorkerSettings(BaseSettings):
     POST_PROCESS_BATCH_SIZE: int = Field(default=5, env="POST_PROCESS_BATCH_SIZE")
     POST_PROCESS_TIMEOUT: int = Field(default=300, env="POST_PROCESS_TIMEOUT")  # seconds
     NSFW_THRESHOLD: float = Field(default=0.7, env="NSFW_THRESHOLD")
+    NSFW_SCREENING_ENABLED: bool = Field(default=True, env="NSFW_SCREENING_ENABLED")
+    NSFW_SCREENING_CONCURRENCY: int = Field(default=8, env="NSFW_SCREENING_CONCURRENCY")
+    NSFW_THUMBNAIL_SIZE: int = Field(default=512, env="NSFW_THUMBNAIL_SIZE")
     UPSCALE_TARGET_HEIGHT: int = Field(default=2160, env="UPSCALE_TARGET_HEIGHT")  # 4K
     UPSCALE_TARGET_WIDTH: int = Field(default=3840, env="UPSCALE_TARGET_WIDTH")
     
+    # Local enhancement backend ("placeholder" or "onnx")
+    POST_PROCESS_BACKEND: str = Field(default="placeholder", env="POST_PROCESS_BACKEND")
+    FACE_RESTORE_MODEL_PATH: str = Field(default="", env="FACE_RESTORE_MODEL_PATH")  # CodeFormer-class .onnx
+    UPSCALE_MODEL_PATH: str = Field(default="", env="UPSCALE_MODEL_PATH")  # Real-ESRGAN-class .onnx
+    ONNX_INTRA_OP_THREADS: int = Field(default=0, env="ONNX_INTRA_OP_THREADS")  # 0 = all cores
+    ONNX_TILE_SIZE: int = Field(default=256, env="ONNX_TILE_SIZE")
+    ONNX_TILE_OVERLAP: int = Field(default=16, env="ONNX_TILE_OVERLAP")
+    ONNX_BATCH_SIZE: int = Field(default=4, env="ONNX_BATCH_SIZE")
+    
     # Package settings
     PACKAGE_TRIAL_PHOTOS: int = Field(default=2, env="PACKAGE_TRIAL_PHOTOS")
     PACKAGE_BASIC_PHOTOS: int = Field(default=10, env="PACKAGE_BASIC_PHOTOS")
@@ -0,0 +1,162 @@
+"""
+Content policy matching for prompts and brief text
+All forbidden terms are compiled into one regex (factored through a trie,
+so its cost depends on text length rather than the number of terms)
+"""
+
+import bisect
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# A trailing * matches any word ending: "porn*" also catches "pornographic"
+DEFAULT_FORBIDDEN_TERMS = (
+    "nude*", "naked*", "nsfw*", "sexual*", "explicit",
+    "inappropriate", "adult", "xxx", "porn*",
+    "обнаж*", "голый", "голая", "голые", "порн*", "эротик*", "секс*"
+)
+
+
+@dataclass(frozen=True)
+class PolicyHit:
+    """Forbidden term found in a text"""
+    
+    term: str
+    text: str
+    start: int
+    end: int
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Regex alternation of words factored by common prefixes"""
+    
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A word ends here but longer words continue
+        return f"(?:{body})?" if "" in node else body
+    
+    return build(trie)
+
+
+class ContentPolicyMatcher:
+    """
+    Compiled matcher of forbidden terms
+    Terms match whole words, case-insensitively; `term*` matches the term
+    as a word prefix. One regex pass reports every hit.
+    """
+    
+    def __init__(self, terms: Iterable[str]):
+        exact, prefixes = set(), set()
+        for term in terms:
+            term = term.strip().casefold()
+            if not term or term.startswith("#"):
+                continue
+            if term.endswith("*"):
+                prefixes.add(term[:-1])
+            else:
+                exact.add(term)
+        
+        self.terms = frozenset(exact) | frozenset(f"{prefix}*" for prefix in prefixes)
+        self._exact = frozenset(exact)
+        self._prefixes = frozenset(prefixes)
+        self._max_prefix = max((len(prefix) for prefix in prefixes), default=0)
+        
+        parts = []
+        if exact:
+            parts.append(f"{_trie_pattern(exact)}(?!\\w)")
+        if prefixes:
+            parts.append(f"{_trie_pattern(prefixes)}\\w*")
+        if parts:
+            # The first-character class lets the engine skip most positions cheaply
+            first_chars = re.escape("".join(sorted({term[0] for term in exact | prefixes})))
+            pattern = f"(?<!\\w)(?=[{first_chars}])(?:" + "|".join(parts) + ")"
+        else:
+            pattern = "(?!x)x"
+        self._regex = re.compile(pattern, re.IGNORECASE)
+    
+    @classmethod
+    def from_file(cls, path: str, include_defaults: bool = True) -> "ContentPolicyMatcher":
+        """Terms file: one term per line, # comments"""
+        
+        with open(path, encoding="utf-8") as f:
+            terms = [line for line in f]
+        if include_defaults:
+            terms.extend(DEFAULT_FORBIDDEN_TERMS)
+        return cls(terms)
+    
+    def _term_of(self, matched: str) -> str:
+        matched = matched.casefold()
+        if matched in self._exact:
+            return matched
+        # Longest prefix term that produced the match
+        for length in range(min(len(matched), self._max_prefix), 0, -1):
+            if matched[:length] in self._prefixes:
+                return f"{matched[:length]}*"
+        return matched
+    
+    def find_all(self, text: str) -> List[PolicyHit]:
+        """Every forbidden term in text, in order"""
+        
+        return [
+            PolicyHit(self._term_of(match.group()), match.group(), match.start(), match.end())
+            for match in self._regex.finditer(text)
+        ]
+    
+    def is_allowed(self, text: str) -> bool:
+        return self._regex.search(text) is None
+    
+    def find_all_many(self, texts: List[str]) -> List[List[PolicyHit]]:
+        """
+        Hits of every text in a single pass over all of them
+        Offsets in the returned hits are relative to their own text
+        """
+        
+        # Newline is a non-word character, so word boundaries hold at the joins
+        starts, offset = [], 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + 1
+        
+        results: List[List[PolicyHit]] = [[] for _ in texts]
+        for match in self._regex.finditer("\n".join(texts)):
+            index = bisect.bisect_right(starts, match.start()) - 1
+            base = starts[index]
+            results[index].append(
+                PolicyHit(self._term_of(match.group()), match.group(), match.start() - base, match.end() - base)
+            )
+        return results
+
+
+# Глобальный экземпляр
+content_policy = None
+
+
+def get_content_policy() -> ContentPolicyMatcher:
+    """Получение матчера контент-политики (CONTENT_POLICY_TERMS_PATH дополняет список по умолчанию)"""
+    global content_policy
+    
+    if content_policy is None:
+        # Read from the environment directly: the bot imports prompts without worker settings
+        path = os.getenv("CONTENT_POLICY_TERMS_PATH", "")
+        if path:
+            content_policy = ContentPolicyMatcher.from_file(path)
+            logger.info(f"Loaded {len(content_policy.terms)} content policy terms from {path}")
+        else:
+            content_policy = ContentPolicyMatcher(DEFAULT_FORBIDDEN_TERMS)
+    
+    return content_policy
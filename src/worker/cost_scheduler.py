@@ -0,0 +1,314 @@
+"""
+Cost-aware admission of paid PiAPI calls
+Every generation, video and post-processing call is charged against the
+session budget of its package and a global rolling 24 hour budget before it
+is made, so retries and fallbacks cannot spend without limit. Calls that
+fail or return nothing are refunded. When a session runs low, generation
+switches to cheaper models.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+FLUX_SCHNELL = "flux-schnell"
+GPT_IMAGE = "gpt-4o-image"
+
+# Cheaper models that can take over a call of the key model, cheapest last
+MODEL_FALLBACKS = {
+    GPT_IMAGE: (FLUX_SCHNELL,)
+}
+
+# Upper bounds (USD) of the cost-per-session histogram buckets
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+GLOBAL_WINDOW = 24 * 3600
+
+
+class BudgetExceeded(Exception):
+    """Call does not fit the session ("session") or the global ("global") budget"""
+    
+    def __init__(self, scope: str, message: str):
+        super().__init__(message)
+        self.scope = scope
+
+
+class SessionBudget:
+    """Budget of one session, bound to its package"""
+    
+    def __init__(self, scheduler: "CostScheduler", session_id: str, package_type: str):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.package_type = package_type
+    
+    @property
+    def limit(self) -> float:
+        return self.scheduler.session_limit(self.package_type)
+    
+    @property
+    def spent(self) -> float:
+        return self.scheduler.session_spent(self.session_id)
+    
+    @property
+    def remaining(self) -> float:
+        return max(self.limit - self.spent, 0.0)
+    
+    def choose_model(self, preferred: str, remaining_calls: int, images_per_call: int = 1) -> str:
+        """
+        Model for the next call
+        The preferred model is kept while the budget left after this call
+        still covers the other remaining calls with the cheapest model, so
+        the package is always filled; otherwise the first cheaper model that
+        fits, or the cheapest one. A nearly spent global budget rules out
+        the preferred model.
+        """
+        
+        fallbacks = MODEL_FALLBACKS.get(preferred, ())
+        if not fallbacks:
+            return preferred
+        
+        global_low = self.scheduler.global_remaining() < self.scheduler.global_budget * self.scheduler.low_budget_ratio
+        remaining = self.remaining
+        rest = self.scheduler.cost_of(fallbacks[-1], images_per_call) * (remaining_calls - 1)
+        for model in (fallbacks if global_low else (preferred, *fallbacks)):
+            if self.scheduler.cost_of(model, images_per_call) + rest <= remaining:
+                break
+        else:
+            model = fallbacks[-1]
+        
+        if model != preferred:
+            logger.info(f"💸 Budget of session {self.session_id} is low, using {model} instead of {preferred}")
+        return model
+    
+    def charge(self, kind: str, images: int = 1, cost: Optional[float] = None) -> float:
+        """Admit a call: record its cost or raise BudgetExceeded"""
+        
+        if cost is None:
+            cost = self.scheduler.cost_of(kind, images)
+        return self.scheduler.charge(self.session_id, self.package_type, kind, cost)
+    
+    def refund(self, kind: str, images: int = 1, cost: Optional[float] = None):
+        """Give back a charge whose call failed or returned nothing"""
+        
+        if cost is None:
+            cost = self.scheduler.cost_of(kind, images)
+        self.scheduler.refund(self.session_id, self.package_type, kind, cost)
+
+
+class CostScheduler:
+    """
+    Ledger of charges in SQLite (WAL), shared by worker processes on one host
+    Budget checks and charges happen in one transaction, so concurrent
+    workers cannot overspend together
+    """
+    
+    def __init__(self, path: str, model_costs: Dict[str, float], session_budgets: Dict[str, float],
+                 global_budget: float, low_budget_ratio: float = 0.1, retention_hours: float = 72):
+        self.path = path
+        self.model_costs = model_costs
+        self.session_budgets = session_budgets
+        self.global_budget = global_budget
+        self.low_budget_ratio = low_budget_ratio
+        self.retention_hours = retention_hours
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        
+        self.admitted = 0
+        self.refunded = 0
+        self.rejected = defaultdict(int)
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS charges ("
+                " id INTEGER PRIMARY KEY,"
+                " session_id TEXT NOT NULL,"
+                " package_type TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " cost REAL NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS charges_session ON charges (session_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS charges_created ON charges (created_at)")
+            self._conn = conn
+        return self._conn
+    
+    def cost_of(self, kind: str, images: int = 1) -> float:
+        return self.model_costs.get(kind, 0.0) * images
+    
+    def session_limit(self, package_type: str) -> float:
+        return self.session_budgets.get(package_type, self.session_budgets.get("basic", 0.0))
+    
+    def session(self, session_id: str, package_type: Optional[str]) -> SessionBudget:
+        return SessionBudget(self, session_id, package_type or "basic")
+    
+    def session_spent(self, session_id: str) -> float:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM charges WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+    
+    def global_spent(self) -> float:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM charges WHERE created_at > ?", (time.time() - GLOBAL_WINDOW,)
+            ).fetchone()[0]
+    
+    def global_remaining(self) -> float:
+        return max(self.global_budget - self.global_spent(), 0.0)
+    
+    def charge(self, session_id: str, package_type: str, kind: str, cost: float) -> float:
+        """
+        Record a charge if it fits both budgets
+        
+        Returns:
+            Session spend including this charge
+        
+        Raises:
+            BudgetExceeded: the call must not be made
+        """
+        
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                session_spent, = conn.execute(
+                    "SELECT COALESCE(SUM(cost), 0) FROM charges WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                global_spent, = conn.execute(
+                    "SELECT COALESCE(SUM(cost), 0) FROM charges WHERE created_at > ?", (now - GLOBAL_WINDOW,)
+                ).fetchone()
+                
+                limit = self.session_limit(package_type)
+                if session_spent + cost > limit + 1e-9:
+                    raise BudgetExceeded(
+                        "session", f"Session {session_id} budget ${limit:.2f} exceeded "
+                                   f"(spent ${session_spent:.3f}, {kind} costs ${cost:.3f})"
+                    )
+                if global_spent + cost > self.global_budget + 1e-9:
+                    raise BudgetExceeded(
+                        "global", f"Global budget ${self.global_budget:.2f}/24h exceeded (spent ${global_spent:.2f})"
+                    )
+                
+                conn.execute(
+                    "INSERT INTO charges (session_id, package_type, kind, cost, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, package_type, kind, cost, now)
+                )
+                conn.execute("COMMIT")
+            except BudgetExceeded as e:
+                conn.execute("ROLLBACK")
+                self.rejected[e.scope] += 1
+                logger.warning(f"💸 {e}")
+                raise
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        
+        self.admitted += 1
+        return session_spent + cost
+    
+    def refund(self, session_id: str, package_type: str, kind: str, cost: float):
+        """Record a compensating entry (negative cost) for a charged call that failed"""
+        
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO charges (session_id, package_type, kind, cost, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, package_type, f"refund:{kind}", -cost, time.time())
+            )
+        
+        self.refunded += 1
+        logger.info(f"💸 Refunded ${cost:.3f} of {kind} to session {session_id}")
+    
+    def histogram(self, window_hours: float = 24) -> Dict[str, Dict[str, Any]]:
+        """
+        Cost-per-session histogram of every package for sessions charged in the window
+        Prometheus style: cumulative counts per bucket upper bound, plus count and sum
+        """
+        
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT package_type, SUM(cost) FROM charges WHERE session_id IN "
+                "(SELECT DISTINCT session_id FROM charges WHERE created_at > ?) "
+                "GROUP BY session_id, package_type",
+                (time.time() - window_hours * 3600,)
+            ).fetchall()
+        
+        totals: Dict[str, List[float]] = defaultdict(list)
+        for package_type, total in rows:
+            totals[package_type].append(total)
+        
+        histograms = {}
+        for package_type, values in sorted(totals.items()):
+            buckets = {str(bound): sum(1 for value in values if value <= bound) for bound in HISTOGRAM_BUCKETS}
+            buckets["+Inf"] = len(values)
+            histograms[package_type] = {"buckets": buckets, "count": len(values), "sum": round(sum(values), 4)}
+        return histograms
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "global_spent_24h": round(self.global_spent(), 4),
+            "global_budget": self.global_budget,
+            "admitted": self.admitted,
+            "refunded": self.refunded,
+            "rejected": dict(self.rejected),
+            "cost_per_session": self.histogram()
+        }
+    
+    def cleanup(self) -> int:
+        """Delete charges older than retention_hours"""
+        
+        cutoff = time.time() - self.retention_hours * 3600
+        with self._lock:
+            deleted = self._connect().execute("DELETE FROM charges WHERE created_at < ?", (cutoff,)).rowcount
+        
+        if deleted:
+            logger.info(f"🧹 Removed {deleted} old charges from cost ledger")
+        return deleted
+
+
+# Глобальный экземпляр
+cost_scheduler = None
+
+
+def get_cost_scheduler() -> Optional[CostScheduler]:
+    """Получение планировщика расходов (None, если бюджеты выключены)"""
+    global cost_scheduler
+    
+    if not settings.COST_BUDGETS_ENABLED:
+        return None
+    
+    if cost_scheduler is None:
+        cost_scheduler = CostScheduler(
+            settings.COST_LEDGER_PATH,
+            model_costs={
+                FLUX_SCHNELL: settings.COST_FLUX_SCHNELL,
+                GPT_IMAGE: settings.COST_GPT_IMAGE
+            },
+            session_budgets={
+                "trial": settings.SESSION_BUDGET_TRIAL,
+                "basic": settings.SESSION_BUDGET_BASIC,
+                "standard": settings.SESSION_BUDGET_STANDARD,
+                "premium": settings.SESSION_BUDGET_PREMIUM
+            },
+            global_budget=settings.GLOBAL_BUDGET_DAILY,
+            low_budget_ratio=settings.COST_LOW_BUDGET_RATIO,
+            retention_hours=settings.JOB_STATE_RETENTION_HOURS
+        )
+    
+    return cost_scheduler
@@ -0,0 +1,133 @@
+"""
+Incremental delivery of a session
+Images are uploaded and sent to the user as soon as their prompt finishes
+instead of after the whole session
+"""
+
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from .job_state import JobClaim, JobStateStore
+from .notifications import BackgroundTelegramNotifier
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalDelivery:
+    """
+    Ordered, deduplicated delivery of generated images
+    
+    prompt_done() hands finished prompts to one background thread that
+    uploads their images (through `upload`) and sends every complete run of
+    prompts, in prompt order, as media groups of `batch_size`. Storage keys
+    already sent are kept in claim.data['delivered'], so a redelivered job
+    never sends a photo twice. Batches whose send may or may not have
+    arrived (timeout, lost response) go to claim.data['delivery_unknown']
+    and are never resent either. Sends go through the shared rate-limited
+    notifier; the summary is the caller's job once finish() returns.
+    """
+    
+    def __init__(self, claim: JobClaim, job_store: JobStateStore, notifier: BackgroundTelegramNotifier,
+                 user_id: int, upload: Callable[[int, List[str]], List[Dict[str, str]]], batch_size: int = 10):
+        """
+        Args:
+            upload: uploads images of one prompt, returns their {key, url} in order
+        """
+        
+        self.claim = claim
+        self.job_store = job_store
+        self.notifier = notifier
+        self.user_id = user_id
+        self.upload = upload
+        self.batch_size = min(max(batch_size, 1), 10)
+        
+        self.total_prompts = len(claim.data.get('prompts', []))
+        self._delivered = set(claim.data.setdefault('delivered', []))
+        self._unknown = set(claim.data.setdefault('delivery_unknown', []))
+        self._ready: Dict[int, List[Dict[str, str]]] = {}
+        self._next_prompt = 0
+        self._queue: List[Dict[str, str]] = []
+        
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="delivery")
+        self._futures: List[Future] = []
+        
+        self.sent_count = 0
+    
+    def prompt_done(self, index: int, image_urls: List[str]):
+        """Prompt finished (empty list if it failed), returns right away"""
+        
+        self._futures.append(self._executor.submit(self._process, index, image_urls))
+    
+    def _process(self, index: int, image_urls: List[str]):
+        try:
+            items = self.upload(index, image_urls) if image_urls else []
+        except Exception as e:
+            logger.error(f"❌ Error uploading images of prompt {index + 1}: {e}")
+            items = []
+        
+        self._ready[index] = items
+        
+        # Only a complete prefix of prompts can go out, to keep the order
+        while self._next_prompt in self._ready:
+            self._queue.extend(self._ready.pop(self._next_prompt))
+            self._next_prompt += 1
+        
+        while len(self._queue) >= self.batch_size:
+            self._send(self._queue[:self.batch_size])
+            del self._queue[:self.batch_size]
+    
+    def _send(self, items: List[Dict[str, str]]):
+        items = [item for item in items if not self._settled(item['key'])]
+        if not items:
+            return
+        
+        sent = self.notifier.send_media_group(
+            self.user_id,
+            [item['url'] for item in items],
+            storage_keys=[item['key'] for item in items],
+            caption=None
+        )
+        if sent is None:
+            # The user may already have them, a resend would show duplicates
+            logger.warning(f"⚠️ Delivery of {len(items)} images to user {self.user_id} is unknown, not resending")
+            self._unknown.update(item['key'] for item in items)
+            self.job_store.checkpoint(self.claim, delivery_unknown=sorted(self._unknown))
+            return
+        if not sent:
+            # Left undelivered, finish() or the next attempt retries them
+            logger.warning(f"⚠️ Could not deliver {len(items)} images to user {self.user_id}")
+            return
+        
+        self._delivered.update(item['key'] for item in items)
+        self.sent_count += len(items)
+        self.job_store.checkpoint(self.claim, delivered=sorted(self._delivered))
+        logger.info(f"📤 Delivered {len(items)} images to user {self.user_id}")
+    
+    def _settled(self, key: str) -> bool:
+        return key in self._delivered or key in self._unknown
+    
+    def wait(self):
+        """Wait for uploads and sends queued so far"""
+        
+        for future in self._futures:
+            future.result()
+        self._futures.clear()
+    
+    def finish(self, items: List[Dict[str, str]]):
+        """
+        Send everything from the final, ordered image list not delivered yet
+        (prompts that failed, ran late or were uploaded by the final upload step)
+        """
+        
+        self.wait()
+        self._executor.shutdown(wait=True)
+        
+        pending = [item for item in items if not self._settled(item['key'])]
+        for start in range(0, len(pending), 10):
+            self._send(pending[start:start + 10])
+    
+    def close(self):
+        """Stop without sending the rest (job failed or will be retried)"""
+        
+        self._executor.shutdown(wait=True)
@@ -121,12 +121,12 @@ class FluxImageGenerator:
                                     "image_url": image_url
                                 }
                             else:
-                                return {"success": False, "error": "No image URL in response"}
+                                return {"success": False, "error": "No image URL in response", "failed": True}
                         elif status in ["pending", "processing"]:
                             return {"success": True, "completed": False, "status": status}
                         elif status == "failed":
                             error_msg = data.get("error", {}).get("message", "Generation failed")
-                            return {"success": False, "error": error_msg}
+                            return {"success": False, "error": error_msg, "failed": True}
                         else:
                             return {"success": True, "completed": False, "status": status}
                     else:
@@ -155,8 +155,11 @@ class FluxImageGenerator:
         while time.time() - start_time < max_wait:
             result = await self.get_task_result(task_id)
             
-            if not result["success"]:
+            # HTTP and network errors are transient, only a failed task is final
+            if not result["success"] and result.get("failed"):
                 return result
+            if not result["success"]:
+                logger.warning(f"⚠️ Polling task {task_id}: {result.get('error')}, retrying")
             
             if result.get("completed"):
                 return result
@@ -164,7 +167,7 @@ class FluxImageGenerator:
             # Ждем перед следующей проверкой
             await asyncio.sleep(5)
         
-        return {"success": False, "error": "Timeout waiting for completion"}
+        return {"success": False, "error": "Timeout waiting for completion", "timeout": True}
 
 
 class GPTImageGenerator:
@@ -536,9 +539,10 @@ class AsyncImageGenerator:
         prompt: str,
         reference_images: List[str] = None,
         lora_type: str = "realism",
-        num_images: int = 4
+        num_images: int = 4,
+        seed: Optional[int] = None
     ) -> List[str]:
-        """Generate images using Flux model (async)"""
+        """Generate images using Flux model (async), a fixed seed makes results repeatable"""
         
         try:
             # Prepare request data
@@ -556,6 +560,9 @@ class AsyncImageGenerator:
             if reference_images:
                 data["reference_images"] = reference_images[:5]
             
+            if seed is not None:
+                data["seed"] = seed
+            
             # Make API request
             async with httpx.AsyncClient(timeout=self.timeout) as client:
                 response = await client.post(
@@ -0,0 +1,251 @@
+"""
+Durable job state for idempotent task execution
+Один и тот же generate_images может прийти несколько раз (redelivery,
+двойное нажатие) - состояние задачи позволяет продолжить с места
+остановки вместо повторной генерации и загрузки
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Job stages in execution order
+CLAIMED = "claimed"
+GENERATING = "generating"
+GENERATED = "generated"
+UPLOADED = "uploaded"
+NOTIFIED = "notified"
+
+STAGES = (CLAIMED, GENERATING, GENERATED, UPLOADED, NOTIFIED)
+
+
+def stage_reached(state: str, stage: str) -> bool:
+    """True if job in `state` has already completed `stage`"""
+    return STAGES.index(state) >= STAGES.index(stage)
+
+
+class JobInProgress(Exception):
+    """Job is leased by another worker"""
+
+
+class JobNotReady(Exception):
+    """Job waits for external work (e.g. running PiAPI tasks), retry on next delivery"""
+
+
+@dataclass
+class JobClaim:
+    """
+    Lease on a job held by this worker
+    data is shared with the delivery thread and the notifier loop,
+    change it under `lock`
+    """
+    
+    job_key: str
+    owner: str
+    state: str
+    attempts: int
+    data: Dict[str, Any] = field(default_factory=dict)
+    lock: threading.RLock = field(default_factory=threading.RLock, repr=False, compare=False)
+    
+    def reached(self, stage: str) -> bool:
+        return stage_reached(self.state, stage)
+
+
+class JobStateStore:
+    """
+    Job states in SQLite (WAL), shared by worker processes on one host
+    Claims are leases: a worker that dies loses the job once lease_seconds
+    pass and the next delivery of the message resumes it
+    """
+    
+    def __init__(self, path: str, lease_seconds: float = 900, retention_hours: float = 72):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.retention_hours = retention_hours
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_key TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " owner TEXT,"
+                " lease_until REAL NOT NULL DEFAULT 0,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " data TEXT NOT NULL DEFAULT '{}',"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+    
+    @staticmethod
+    def new_owner() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    
+    def claim(self, job_key: str, owner: Optional[str] = None) -> Optional[JobClaim]:
+        """
+        Take the lease on a job
+        
+        Returns:
+            JobClaim with the stage reached so far, None if the job is finished
+        
+        Raises:
+            JobInProgress: another worker holds a live lease
+        """
+        
+        owner = owner or self.new_owner()
+        now = time.time()
+        
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT state, owner, lease_until, attempts, data FROM jobs WHERE job_key = ?",
+                    (job_key,)
+                ).fetchone()
+                
+                if row is None:
+                    state, attempts, data = CLAIMED, 0, {}
+                    conn.execute(
+                        "INSERT INTO jobs (job_key, state, owner, lease_until, attempts, updated_at) "
+                        "VALUES (?, ?, ?, ?, 1, ?)",
+                        (job_key, state, owner, now + self.lease_seconds, now)
+                    )
+                else:
+                    state, current_owner, lease_until, attempts, data = row
+                    data = json.loads(data)
+                    
+                    if state == NOTIFIED:
+                        conn.execute("COMMIT")
+                        logger.info(f"⏭️ Job {job_key[:12]} already finished, skipping")
+                        return None
+                    
+                    if lease_until > now and current_owner != owner:
+                        raise JobInProgress(f"Job {job_key[:12]} is leased by {current_owner}")
+                    
+                    conn.execute(
+                        "UPDATE jobs SET owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? "
+                        "WHERE job_key = ?",
+                        (owner, now + self.lease_seconds, now, job_key)
+                    )
+                    logger.info(f"🔁 Resuming job {job_key[:12]} from stage '{state}' (attempt {attempts + 1})")
+                
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        
+        return JobClaim(job_key=job_key, owner=owner, state=state, attempts=attempts + 1, data=data)
+    
+    def advance(self, claim: JobClaim, state: str, **data: Any):
+        """Record reached stage (and its results), renewing the lease"""
+        
+        with claim.lock:
+            claim.state = state
+            claim.data.update(data)
+        self._save(claim)
+        logger.info(f"📌 Job {claim.job_key[:12]} -> {state}")
+    
+    def checkpoint(self, claim: JobClaim, **data: Any):
+        """Save intermediate results without changing the stage"""
+        
+        with claim.lock:
+            claim.data.update(data)
+        self._save(claim)
+    
+    def _save(self, claim: JobClaim):
+        # Snapshot under the claim lock, the write itself does not hold it
+        with claim.lock:
+            state = claim.state
+            data = json.dumps(claim.data, ensure_ascii=False)
+        
+        now = time.time()
+        with self._lock:
+            updated = self._connect().execute(
+                "UPDATE jobs SET state = ?, data = ?, lease_until = ?, updated_at = ? "
+                "WHERE job_key = ? AND owner = ?",
+                (state, data, now + self.lease_seconds, now, claim.job_key, claim.owner)
+            ).rowcount
+        
+        if not updated:
+            raise JobInProgress(f"Lease on job {claim.job_key[:12]} was taken over")
+    
+    def release(self, claim: JobClaim):
+        """Drop the lease so the next delivery can resume right away"""
+        
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET lease_until = 0, updated_at = ? WHERE job_key = ? AND owner = ?",
+                (time.time(), claim.job_key, claim.owner)
+            )
+    
+    def get(self, job_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT state, owner, lease_until, attempts, data, updated_at FROM jobs WHERE job_key = ?",
+                (job_key,)
+            ).fetchone()
+        
+        if row is None:
+            return None
+        return {
+            "state": row[0],
+            "owner": row[1],
+            "lease_until": row[2],
+            "attempts": row[3],
+            "data": json.loads(row[4]),
+            "updated_at": row[5]
+        }
+    
+    def cleanup(self) -> int:
+        """Delete finished jobs older than retention_hours"""
+        
+        cutoff = time.time() - self.retention_hours * 3600
+        with self._lock:
+            deleted = self._connect().execute(
+                "DELETE FROM jobs WHERE state = ? AND updated_at < ?",
+                (NOTIFIED, cutoff)
+            ).rowcount
+        
+        if deleted:
+            logger.info(f"🧹 Removed {deleted} finished jobs from job state store")
+        return deleted
+
+
+# Глобальный экземпляр
+job_state_store = None
+
+
+def get_job_state_store() -> JobStateStore:
+    """Получение хранилища состояний задач"""
+    global job_state_store
+    
+    if job_state_store is None:
+        job_state_store = JobStateStore(
+            settings.JOB_STATE_PATH,
+            lease_seconds=settings.JOB_LEASE_SECONDS,
+            retention_hours=settings.JOB_STATE_RETENTION_HOURS
+        )
+    
+    return job_state_store
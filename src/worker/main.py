@@ -16,6 +16,9 @@ from .config import settings
 from .mq_client import get_mq_client
 from .tasks import process_image_generation_task
 from .health import check_health
+from .job_state import get_job_state_store
+from .result_cache import get_prompt_result_cache
+from .cost_scheduler import get_cost_scheduler
 
 # Configure logging
 logging.basicConfig(
@@ -48,6 +51,11 @@ class MessageQueueWorker:
         """Запуск worker'а"""
         logger.info("🔄 Starting YC Message Queue Worker...")
         
+        # Забываем давно завершённые задачи и старые расходы
+        get_job_state_store().cleanup()
+        if get_cost_scheduler():
+            get_cost_scheduler().cleanup()
+        
         while self.running:
             try:
                 # Получаем сообщения из очереди
@@ -75,6 +83,10 @@ class MessageQueueWorker:
                 # Логируем статистику
                 if self.processed_count % 10 == 0:
                     logger.info(f"📊 Processed: {self.processed_count}, Errors: {self.error_count}")
+                    if get_prompt_result_cache():
+                        logger.info(f"📊 Result cache: {get_prompt_result_cache().get_stats()}")
+                    if get_cost_scheduler():
+                        logger.info(f"📊 Costs: {get_cost_scheduler().get_stats()}")
                 
             except Exception as e:
                 logger.error(f"❌ Worker error: {e}")
@@ -94,7 +106,7 @@ class MessageQueueWorker:
             
             # Обрабатываем задачу по типу
             if task_type == 'generate_images':
-                result = process_image_generation_task(task_data)
+                result = process_image_generation_task(task_data, idempotency_key=body.get('idempotency_key'))
                 
                 if result.get('success'):
                     logger.info(f"✅ Task completed successfully: {task_type}")
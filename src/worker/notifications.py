@@ -2,13 +2,24 @@
 Telegram notifications module
 """
 
+import asyncio
+import concurrent.futures
 import logging
-from typing import List
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
 import httpx
 from urllib.parse import urljoin
+from .config import settings
 
 logger = logging.getLogger(__name__)
 
+# Result of a send that may or may not have reached the chat
+SEND_UNKNOWN = object()
+
 
 class TelegramNotifier:
     """Send notifications via Telegram Bot API"""
@@ -112,4 +123,467 @@ class TelegramNotifier:
             return False
         except Exception as e:
             logger.error(f"Error sending document: {e}")
-            return False 
\ No newline at end of file
+            return False 
+
+
+class TokenBucket:
+    """Token bucket: `rate` tokens per second, up to `capacity` at once"""
+    
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)"""
+        
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+    
+    def take(self):
+        self.tokens -= 1
+    
+    def block(self, now: float, seconds: float):
+        """Hold the bucket after a 429 with retry_after"""
+        
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+
+class TelegramRateLimiter:
+    """Global and per-chat token buckets (Telegram: ~30 msg/s overall, ~1 msg/s per chat)"""
+    
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 1.0,
+                 max_chats: int = 10000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+    
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            # Idle chats have full buckets again, forgetting them is free
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+    
+    async def acquire(self, chat_id: int):
+        """Wait until both the chat and the global bucket allow one message"""
+        
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            now = time.monotonic()
+            wait = max(chat_bucket.delay(now), self.global_bucket.delay(now))
+            if wait <= 0:
+                chat_bucket.take()
+                self.global_bucket.take()
+                return
+            await asyncio.sleep(wait)
+    
+    def block(self, chat_id: int, seconds: float):
+        self._chat_bucket(chat_id).block(time.monotonic(), seconds)
+
+
+class FileIdCache:
+    """
+    Storage key -> Telegram file_id of a photo already sent once (SQLite)
+    Re-sending by file_id saves Telegram from fetching the URL again
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                " storage_key TEXT PRIMARY KEY,"
+                " file_id TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+    
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connect().execute(
+            f"SELECT storage_key, file_id FROM file_ids WHERE storage_key IN ({placeholders})",
+            list(keys)
+        ).fetchall()
+        return dict(rows)
+    
+    def put_many(self, file_ids: Dict[str, str]):
+        now = time.time()
+        self._connect().executemany(
+            "INSERT OR REPLACE INTO file_ids (storage_key, file_id, updated_at) VALUES (?, ?, ?)",
+            [(key, file_id, now) for key, file_id in file_ids.items()]
+        )
+    
+    def delete_many(self, keys: List[str]):
+        self._connect().executemany("DELETE FROM file_ids WHERE storage_key = ?", [(key,) for key in keys])
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class AsyncTelegramNotifier:
+    """
+    Async Bot API client for worker notifications
+    One pooled httpx.AsyncClient, requests go through a bounded outbox and
+    are paced by TelegramRateLimiter. Messages of one chat are sent in order,
+    429 responses pause that chat for retry_after and the request is retried.
+    Photo sends are not repeated after the request may have reached Telegram
+    (lost response, 5xx): they return SEND_UNKNOWN instead of risking duplicates
+    """
+    
+    NOT_RETRIED_METHODS = ("sendMediaGroup", "sendPhoto")
+    
+    def __init__(self, bot_token: str, global_rate: float = 30.0, chat_rate: float = 1.0,
+                 outbox_size: int = 1000, max_connections: int = 10, max_retries: int = 5,
+                 file_id_cache: Optional[FileIdCache] = None, base_url: str = "https://api.telegram.org"):
+        self.base_url = f"{base_url}/bot{bot_token}"
+        self.max_retries = max_retries
+        self.file_id_cache = file_id_cache
+        self.limiter = TelegramRateLimiter(global_rate, chat_rate)
+        
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._connections = asyncio.Semaphore(max_connections)
+        self._outbox = asyncio.Semaphore(outbox_size)
+        self._chat_locks: Dict[int, list] = {}
+        
+        self.sent_count = 0
+        self.failed_count = 0
+        self.throttled_count = 0
+        self.unknown_count = 0
+        self.pending_count = 0
+        self.file_id_hits = 0
+        self.file_id_misses = 0
+    
+    async def request(self, method: str, chat_id: int, payload: Dict[str, Any]) -> Optional[Any]:
+        """
+        Call Bot API method for a chat through the outbox
+        
+        Returns:
+            Bot API result or None if the request failed
+        """
+        
+        return (await self.request_many(method, chat_id, [payload]))[0]
+    
+    async def request_many(self, method: str, chat_id: int, payloads: List[Dict[str, Any]]) -> List[Optional[Any]]:
+        """
+        Pipeline several calls to one chat
+        Requests start in order as the rate limiter admits them, without
+        waiting for the previous response
+        """
+        
+        # Bounded outbox: callers wait here when too much is queued
+        async with self._outbox:
+            self.pending_count += len(payloads)
+            # Lock per chat keeps its messages in order, dropped when nobody uses it
+            entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    tasks = []
+                    for payload in payloads:
+                        await self.limiter.acquire(chat_id)
+                        tasks.append(asyncio.ensure_future(self._send(method, chat_id, payload, admitted=True)))
+                    return list(await asyncio.gather(*tasks))
+            finally:
+                self.pending_count -= len(payloads)
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._chat_locks[chat_id]
+    
+    async def _send(self, method: str, chat_id: int, payload: Dict[str, Any], admitted: bool = False) -> Optional[Any]:
+        for attempt in range(self.max_retries + 1):
+            if attempt or not admitted:
+                await self.limiter.acquire(chat_id)
+            
+            try:
+                async with self._connections:
+                    response = await self._client.post(f"{self.base_url}/{method}", json=payload)
+                result = response.json()
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # Request never left, safe to repeat
+                logger.error(f"Error connecting for {method} to chat {chat_id}: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            except Exception as e:
+                logger.error(f"Error calling {method} for chat {chat_id}: {e}")
+                if method in self.NOT_RETRIED_METHODS:
+                    self.unknown_count += 1
+                    return SEND_UNKNOWN
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            
+            if result.get("ok"):
+                self.sent_count += 1
+                return result.get("result")
+            
+            retry_after = (result.get("parameters") or {}).get("retry_after")
+            if response.status_code == 429 and retry_after:
+                self.throttled_count += 1
+                logger.warning(f"Telegram flood control for chat {chat_id}, retry after {retry_after}s")
+                self.limiter.block(chat_id, retry_after)
+                continue
+            
+            if response.status_code >= 500:
+                if method in self.NOT_RETRIED_METHODS:
+                    logger.error(f"{method} to chat {chat_id} got {response.status_code}, outcome unknown")
+                    self.unknown_count += 1
+                    return SEND_UNKNOWN
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            
+            # 4xx other than 429 will not succeed on retry
+            logger.error(f"{method} to chat {chat_id} failed: {result.get('description')}")
+            break
+        
+        self.failed_count += 1
+        return None
+    
+    async def send_message(self, user_id: int, text: str, parse_mode: str = "HTML") -> bool:
+        """Send text message to user"""
+        
+        result = await self.request("sendMessage", user_id, {
+            "chat_id": user_id,
+            "text": text,
+            "parse_mode": parse_mode
+        })
+        return result is not None
+    
+    async def send_media_group(self, user_id: int, image_urls: List[str],
+                               storage_keys: Optional[List[str]] = None,
+                               caption: Optional[str] = "🎉 Твои фотографии готовы!") -> Optional[bool]:
+        """
+        Send images to user in media groups of up to 10
+        
+        Args:
+            storage_keys: object storage key of each image; photos Telegram
+                has already seen are sent by cached file_id instead of URL
+        
+        Returns:
+            True if all groups were sent, None if some group may or may not
+            have arrived (must not be resent), False otherwise
+        """
+        
+        cached = {}
+        if storage_keys and self.file_id_cache:
+            cached = self.file_id_cache.get_many(storage_keys)
+            self.file_id_hits += len(cached)
+            self.file_id_misses += len(storage_keys) - len(cached)
+        
+        if not image_urls:
+            return True
+        
+        # Media groups take 2-10 items: 11 photos go as 9 + 2, a single photo as sendPhoto
+        bounds = [[start, min(start + 10, len(image_urls))] for start in range(0, len(image_urls), 10)]
+        if len(bounds) > 1 and bounds[-1][1] - bounds[-1][0] == 1:
+            bounds[-2][1] -= 1
+            bounds[-1][0] -= 1
+        method = "sendMediaGroup" if len(image_urls) > 1 else "sendPhoto"
+        
+        def build(start: int, end: int, use_cache: bool) -> Dict[str, Any]:
+            media = []
+            for i in range(start, end):
+                key = storage_keys[i] if storage_keys else None
+                file_id = cached.get(key) if use_cache else None
+                media.append({"type": "photo", "media": file_id or image_urls[i]})
+            if start == 0 and caption:
+                media[0]["caption"] = caption
+            
+            if method == "sendPhoto":
+                return {"chat_id": user_id, "photo": media[0]["media"], "caption": media[0].get("caption", "")}
+            return {"chat_id": user_id, "media": media}
+        
+        results = await self.request_many(method, user_id, [build(start, end, True) for start, end in bounds])
+        
+        success = True
+        unknown = False
+        learned = {}
+        for (start, end), result in zip(bounds, results):
+            chunk_keys = storage_keys[start:end] if storage_keys else []
+            
+            if result is SEND_UNKNOWN:
+                unknown = True
+                continue
+            
+            if result is None and any(key in cached for key in chunk_keys):
+                # A stale file_id fails the whole group, resend it by URL
+                logger.warning(f"Cached file_id rejected for chat {user_id}, resending by URL")
+                if self.file_id_cache:
+                    self.file_id_cache.delete_many([key for key in chunk_keys if key in cached])
+                result = await self.request(method, user_id, build(start, end, False))
+                if result is SEND_UNKNOWN:
+                    unknown = True
+                    continue
+            
+            if result is None:
+                success = False
+                continue
+            if method == "sendPhoto":
+                result = [result]
+            
+            for key, message in zip(chunk_keys, result):
+                if message.get("photo"):
+                    # Largest size comes last
+                    learned[key] = message["photo"][-1]["file_id"]
+        
+        if self.file_id_cache and learned:
+            self.file_id_cache.put_many({key: file_id for key, file_id in learned.items() if cached.get(key) != file_id})
+        
+        return None if unknown else success
+    
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, parse_mode: str = "HTML") -> bool:
+        """Replace text of a message sent earlier"""
+        
+        result = await self.request("editMessageText", chat_id, {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "text": text,
+            "parse_mode": parse_mode
+        })
+        return result is not None
+    
+    async def send_document(self, user_id: int, document_url: str, caption: str = "") -> bool:
+        """Send document to user"""
+        
+        result = await self.request("sendDocument", user_id, {
+            "chat_id": user_id,
+            "document": document_url,
+            "caption": caption
+        })
+        return result is not None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending_count,
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "throttled": self.throttled_count,
+            "unknown": self.unknown_count,
+            "file_id_hits": self.file_id_hits,
+            "file_id_misses": self.file_id_misses
+        }
+    
+    async def close(self):
+        await self._client.aclose()
+        if self.file_id_cache:
+            self.file_id_cache.close()
+
+
+class BackgroundTelegramNotifier:
+    """
+    Sync facade over AsyncTelegramNotifier for the worker
+    The notifier lives on its own event loop thread, so the rate limits and
+    connection pool are shared by every task the worker runs
+    """
+    
+    def __init__(self, timeout: float = 120.0, **kwargs):
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="telegram-notifier", daemon=True)
+        self._thread.start()
+        self.notifier: AsyncTelegramNotifier = self._call(self._create(kwargs))
+    
+    @staticmethod
+    async def _create(kwargs: Dict[str, Any]) -> AsyncTelegramNotifier:
+        # asyncio primitives must be created on the notifier loop
+        return AsyncTelegramNotifier(**kwargs)
+    
+    def _call(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            # Don't leave the request running after the caller gave up on it
+            future.cancel()
+            raise
+    
+    def send_message(self, user_id: int, text: str, parse_mode: str = "HTML") -> bool:
+        try:
+            return self._call(self.notifier.send_message(user_id, text, parse_mode))
+        except Exception as e:
+            logger.error(f"Error sending message to {user_id}: {e}")
+            return False
+    
+    def send_media_group(self, user_id: int, image_urls: List[str], storage_keys: Optional[List[str]] = None,
+                         caption: Optional[str] = "🎉 Твои фотографии готовы!") -> Optional[bool]:
+        """Same as AsyncTelegramNotifier.send_media_group, None also on timeout"""
+        
+        try:
+            return self._call(self.notifier.send_media_group(user_id, image_urls, storage_keys, caption))
+        except concurrent.futures.TimeoutError:
+            logger.warning(f"Timed out sending media group to {user_id}, outcome unknown")
+            return None
+        except Exception as e:
+            logger.error(f"Error sending media group to {user_id}: {e}")
+            return False
+    
+    def send_document(self, user_id: int, document_url: str, caption: str = "") -> bool:
+        try:
+            return self._call(self.notifier.send_document(user_id, document_url, caption))
+        except Exception as e:
+            logger.error(f"Error sending document to {user_id}: {e}")
+            return False
+    
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return self.notifier.get_stats()
+    
+    def close(self):
+        self._call(self.notifier.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+
+# Глобальный экземпляр
+telegram_notifier = None
+
+
+def get_telegram_notifier() -> BackgroundTelegramNotifier:
+    """Получение общего уведомителя Telegram"""
+    global telegram_notifier
+    
+    if telegram_notifier is None:
+        telegram_notifier = BackgroundTelegramNotifier(
+            bot_token=settings.BOT_TOKEN,
+            global_rate=settings.TELEGRAM_GLOBAL_RATE,
+            chat_rate=settings.TELEGRAM_CHAT_RATE,
+            outbox_size=settings.TELEGRAM_OUTBOX_SIZE,
+            max_connections=settings.TELEGRAM_MAX_CONNECTIONS,
+            max_retries=settings.TELEGRAM_MAX_RETRIES,
+            file_id_cache=FileIdCache(settings.TELEGRAM_FILE_ID_CACHE_PATH)
+        )
+    
+    return telegram_notifier
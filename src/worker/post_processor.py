@@ -4,93 +4,964 @@ Automated post-processing for Premium packages
 """
 
 import logging
-from typing import Dict, Any, Optional, List
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable
 import aiohttp
 import asyncio
 import cv2
 import numpy as np
 from pathlib import Path
+from .config import settings
 
 logger = logging.getLogger(__name__)
 
 
+class ImagePayload:
+    """
+    Encoded image shared between post-processing stages
+    Keeps the encoded bytes and memoizes base64 / data-URI forms,
+    so each frame is JPEG-encoded at most once per pipeline run
+    """
+    
+    def __init__(self, data: bytes, mime_type: str = "image/jpeg",
+                 image: Optional[np.ndarray] = None, source_path: Optional[str] = None):
+        self.data = data
+        self.mime_type = mime_type
+        self.source_path = source_path
+        self.url: Optional[str] = None
+        
+        self._image = image
+        self._base64: Optional[str] = None
+        self._digest: Optional[str] = None
+    
+    @classmethod
+    def from_file(cls, image_path: str) -> "ImagePayload":
+        """Create payload from encoded file on disk (no re-encoding)"""
+        
+        with open(image_path, "rb") as f:
+            data = f.read()
+        
+        suffix = Path(image_path).suffix.lower()
+        mime_type = "image/png" if suffix == ".png" else "image/jpeg"
+        return cls(data, mime_type=mime_type, source_path=image_path)
+    
+    @classmethod
+    def from_array(cls, img: np.ndarray, ext: str = ".jpg") -> "ImagePayload":
+        """Create payload from decoded image (encodes once)"""
+        
+        ok, buffer = cv2.imencode(ext, img)
+        if not ok:
+            raise ValueError(f"Failed to encode image as {ext}")
+        
+        mime_type = "image/png" if ext == ".png" else "image/jpeg"
+        return cls(buffer.tobytes(), mime_type=mime_type, image=img)
+    
+    @property
+    def extension(self) -> str:
+        """File extension matching mime_type"""
+        
+        return ".png" if self.mime_type == "image/png" else ".jpg"
+    
+    @property
+    def image(self) -> Optional[np.ndarray]:
+        """Decoded image (decoded lazily from the encoded bytes)"""
+        
+        if self._image is None:
+            buffer = np.frombuffer(self.data, dtype=np.uint8)
+            self._image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        return self._image
+    
+    @property
+    def base64(self) -> str:
+        """Base64 form of the encoded bytes"""
+        
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("utf-8")
+        return self._base64
+    
+    @property
+    def data_uri(self) -> str:
+        """Data URI for APIs accepting inline images"""
+        
+        return f"data:{self.mime_type};base64,{self.base64}"
+    
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the encoded bytes"""
+        
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+    
+    def reference(self) -> str:
+        """Uploaded URL if available, otherwise inline data URI"""
+        
+        return self.url or self.data_uri
+    
+    def thumbnail(self, max_side: int = 512) -> "ImagePayload":
+        """Downscaled JPEG copy for screening stages (returns self if already small)"""
+        
+        img = self.image
+        if img is None:
+            return self
+        
+        h, w = img.shape[:2]
+        scale = max_side / max(h, w)
+        if scale >= 1.0:
+            return self
+        
+        small = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        return ImagePayload.from_array(small)
+
+
+class NSFWScreener:
+    """
+    Session-level NSFW screening via PiAPI hume-nsfw
+    Sends downscaled thumbnails as concurrent requests over one pooled
+    session and caches scores by image digest
+    """
+    
+    def __init__(self, api_key: str, threshold: Optional[float] = None,
+                 max_concurrency: int = 8, thumbnail_size: int = 512,
+                 cache_size: int = 4096):
+        """Initialize NSFW screener"""
+        
+        self.api_key = api_key
+        self.base_url = "https://api.piapi.ai/api/v1"
+        self.threshold = threshold if threshold is not None else settings.NSFW_THRESHOLD
+        self.max_concurrency = max_concurrency
+        self.thumbnail_size = thumbnail_size
+        self.cache_size = cache_size
+        
+        self._scores: "OrderedDict[str, float]" = OrderedDict()
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def __aenter__(self) -> "NSFWScreener":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Pooled HTTP session (lazy initialization)"""
+        
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+        return self._session
+    
+    async def close(self):
+        """Close pooled HTTP session"""
+        
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    def _cache_get(self, digest: str) -> Optional[float]:
+        score = self._scores.get(digest)
+        if score is not None:
+            self._scores.move_to_end(digest)
+        return score
+    
+    def _cache_put(self, digest: str, score: float):
+        self._scores[digest] = score
+        self._scores.move_to_end(digest)
+        while len(self._scores) > self.cache_size:
+            self._scores.popitem(last=False)
+    
+    async def _fetch_score(self, payload: ImagePayload) -> Optional[float]:
+        """Score a single thumbnail, None if the API call failed"""
+        
+        loop = asyncio.get_event_loop()
+        thumb = await loop.run_in_executor(None, payload.thumbnail, self.thumbnail_size)
+        
+        request_payload = {
+            "model": "hume-nsfw",
+            "input": {
+                "image": thumb.data_uri
+            }
+        }
+        
+        try:
+            async with self._get_session().post(
+                f"{self.base_url}/nsfw-check",
+                json=request_payload
+            ) as response:
+                
+                if response.status == 200:
+                    data = await response.json()
+                    return float(data.get("score", 0.0))
+                
+                logger.warning(f"NSFW check failed, assuming safe: {response.status}")
+                return None
+                
+        except Exception as e:
+            logger.error(f"Error in NSFW check: {e}")
+            return None
+    
+    async def screen_payloads(self, payloads: List[ImagePayload]) -> List[bool]:
+        """
+        Screen payloads, returns verdicts in input order (True = safe)
+        Identical images are only sent once
+        """
+        
+        pending: Dict[str, ImagePayload] = {}
+        for payload in payloads:
+            if self._cache_get(payload.digest) is None:
+                pending.setdefault(payload.digest, payload)
+        
+        if pending:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            
+            async def fetch(payload: ImagePayload):
+                async with semaphore:
+                    return await self._fetch_score(payload)
+            
+            digests = list(pending.keys())
+            scores = await asyncio.gather(*(fetch(pending[d]) for d in digests))
+            
+            for digest, score in zip(digests, scores):
+                # Failed calls are not cached, so they get retried next time
+                if score is not None:
+                    self._cache_put(digest, score)
+        
+        verdicts = []
+        for payload in payloads:
+            score = self._scores.get(payload.digest)
+            # If API fails, assume safe
+            verdicts.append(score is None or score < self.threshold)
+        
+        return verdicts
+    
+    async def screen_session(self, image_paths: List[str]) -> Dict[str, bool]:
+        """Screen all images of a session, returns {path: is_safe}"""
+        
+        payloads = []
+        readable_paths = []
+        for path in image_paths:
+            try:
+                payloads.append(ImagePayload.from_file(path))
+                readable_paths.append(path)
+            except OSError as e:
+                logger.error(f"Failed to read image for NSFW screening {path}: {e}")
+        
+        verdicts = await self.screen_payloads(payloads)
+        result = dict(zip(readable_paths, verdicts))
+        
+        rejected = len([v for v in verdicts if not v])
+        logger.info(f"NSFW screening: {rejected}/{len(verdicts)} images rejected")
+        return result
+
+
+# ONNX Runtime sessions shared by all backends: {(model_path, threads): session}
+_onnx_sessions: Dict[Tuple[str, int], Any] = {}
+_onnx_sessions_lock = threading.Lock()
+
+# Haar cascade used to locate faces for restoration (loaded once)
+_face_cascade = None
+_face_cascade_lock = threading.Lock()
+
+
+def get_onnx_session(model_path: str, intra_op_threads: int = 0):
+    """
+    Get cached ONNX Runtime CPU session for model
+    
+    Args:
+        model_path: path to .onnx model
+        intra_op_threads: threads per inference (0 = all CPU cores)
+    """
+    
+    key = (os.path.abspath(model_path), intra_op_threads)
+    
+    with _onnx_sessions_lock:
+        session = _onnx_sessions.get(key)
+        if session is None:
+            import onnxruntime as ort
+            
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.intra_op_num_threads = intra_op_threads or (os.cpu_count() or 1)
+            options.inter_op_num_threads = 1
+            
+            session = ort.InferenceSession(
+                model_path,
+                sess_options=options,
+                providers=["CPUExecutionProvider"]
+            )
+            _onnx_sessions[key] = session
+            logger.info(f"ONNX session loaded: {model_path} ({options.intra_op_num_threads} threads)")
+    
+    return session
+
+
+def _get_face_cascade():
+    """Shared Haar face detector"""
+    
+    global _face_cascade
+    
+    with _face_cascade_lock:
+        if _face_cascade is None:
+            _face_cascade = cv2.CascadeClassifier(
+                cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+            )
+    return _face_cascade
+
+
+class _OnnxBatchRunner:
+    """
+    Coalesces concurrent inference requests on one ONNX session
+    Tiles/crops of equal shape from different images share a single run
+    """
+    
+    def __init__(self, session, batch_size: int = 4, batch_window: float = 0.01,
+                 value_range: Tuple[float, float] = (0.0, 1.0),
+                 extra_feed: Optional[Dict[str, np.ndarray]] = None):
+        self.session = session
+        self.value_range = value_range
+        self.batch_window = batch_window
+        
+        inputs = session.get_inputs()
+        self.input_name = inputs[0].name
+        self.input_shape = inputs[0].shape
+        self.extra_feed = {
+            name: value for name, value in (extra_feed or {}).items()
+            if name in [i.name for i in inputs[1:]]
+        }
+        
+        # Models exported with a fixed batch dimension can only take one item
+        fixed_batch = self.input_shape[0] if self.input_shape else None
+        self.batch_size = 1 if isinstance(fixed_batch, int) and fixed_batch == 1 else max(1, batch_size)
+        
+        self._pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+    
+    @property
+    def fixed_size(self) -> Optional[Tuple[int, int]]:
+        """Static (height, width) of model input, None if dynamic"""
+        
+        if len(self.input_shape) == 4:
+            h, w = self.input_shape[2], self.input_shape[3]
+            if isinstance(h, int) and isinstance(w, int):
+                return h, w
+        return None
+    
+    def to_tensor(self, img: np.ndarray) -> np.ndarray:
+        """BGR uint8 HWC -> RGB float32 CHW in model value range"""
+        
+        low, high = self.value_range
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+        return np.ascontiguousarray((rgb * (high - low) + low).transpose(2, 0, 1))
+    
+    def from_tensor(self, tensor: np.ndarray) -> np.ndarray:
+        """RGB float32 CHW in model value range -> BGR uint8 HWC"""
+        
+        low, high = self.value_range
+        rgb = (tensor.transpose(1, 2, 0) - low) / (high - low)
+        rgb = np.clip(rgb * 255.0 + 0.5, 0, 255).astype(np.uint8)
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    
+    async def run(self, tensor: np.ndarray) -> np.ndarray:
+        """Run model on single CHW tensor (batched with concurrent callers)"""
+        
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((tensor, future))
+        
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_window, self._flush)
+        
+        return await future
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        
+        loop = asyncio.get_event_loop()
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            self._pending = self._pending[self.batch_size:]
+            loop.create_task(self._execute(batch))
+    
+    async def _execute(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        loop = asyncio.get_event_loop()
+        
+        try:
+            inputs = np.stack([tensor for tensor, _ in batch])
+            outputs = await loop.run_in_executor(None, self._run_sync, inputs)
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    def _run_sync(self, inputs: np.ndarray) -> np.ndarray:
+        feed = {self.input_name: inputs}
+        feed.update(self.extra_feed)
+        return self.session.run(None, feed)[0]
+
+
+class EnhancementBackend:
+    """Base class for face restoration / upscaling backends"""
+    
+    name = "base"
+    
+    async def restore_faces(self, img: np.ndarray) -> Optional[np.ndarray]:
+        raise NotImplementedError
+    
+    async def upscale(self, img: np.ndarray, target_width: int, target_height: int) -> np.ndarray:
+        raise NotImplementedError
+
+
+class PlaceholderEnhancementBackend(EnhancementBackend):
+    """Pure OpenCV fallback (slight sharpening blend + LANCZOS resize)"""
+    
+    name = "placeholder"
+    
+    async def restore_faces(self, img: np.ndarray) -> Optional[np.ndarray]:
+        enhanced = cv2.GaussianBlur(img, (1, 1), 0)
+        return cv2.addWeighted(img, 0.8, enhanced, 0.2, 0)
+    
+    async def upscale(self, img: np.ndarray, target_width: int, target_height: int) -> np.ndarray:
+        return cv2.resize(img, (target_width, target_height), interpolation=cv2.INTER_LANCZOS4)
+
+
+class OnnxEnhancementBackend(EnhancementBackend):
+    """
+    Local CPU backend running CodeFormer / Real-ESRGAN class ONNX models
+    Upscaling is tiled; tiles and face crops from concurrently processed
+    images are batched into shared inference runs
+    """
+    
+    name = "onnx"
+    
+    def __init__(self, face_model_path: Optional[str] = None,
+                 upscale_model_path: Optional[str] = None,
+                 intra_op_threads: int = 0, tile_size: int = 256,
+                 tile_overlap: int = 16, batch_size: int = 4,
+                 face_strength: float = 0.7):
+        """
+        Initialize ONNX backend
+        
+        Args:
+            face_model_path: face restoration model (input/output in [-1, 1])
+            upscale_model_path: super-resolution model (input/output in [0, 1])
+            intra_op_threads: ONNX Runtime threads per run (0 = all cores)
+            tile_size: upscale tile size in pixels
+            tile_overlap: overlap between neighbouring tiles
+            batch_size: max tiles/crops per inference run
+            face_strength: blend strength / CodeFormer fidelity weight
+        """
+        
+        if tile_size <= 2 * tile_overlap:
+            raise ValueError("tile_size must be greater than 2 * tile_overlap")
+        
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.face_strength = face_strength
+        self.fallback = PlaceholderEnhancementBackend()
+        
+        self.face_runner = None
+        if face_model_path:
+            self.face_runner = _OnnxBatchRunner(
+                get_onnx_session(face_model_path, intra_op_threads),
+                batch_size=batch_size,
+                value_range=(-1.0, 1.0),
+                extra_feed={"w": np.array(face_strength, dtype=np.float64)}
+            )
+        
+        self.upscale_runner = None
+        if upscale_model_path:
+            self.upscale_runner = _OnnxBatchRunner(
+                get_onnx_session(upscale_model_path, intra_op_threads),
+                batch_size=batch_size
+            )
+    
+    async def restore_faces(self, img: np.ndarray) -> Optional[np.ndarray]:
+        """Restore detected faces and blend them back into the frame"""
+        
+        if self.face_runner is None:
+            return await self.fallback.restore_faces(img)
+        
+        loop = asyncio.get_event_loop()
+        boxes = await loop.run_in_executor(None, self._detect_faces, img)
+        if not boxes:
+            return img
+        
+        model_h, model_w = self.face_runner.fixed_size or (512, 512)
+        crops = [img[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes]
+        tensors = [
+            self.face_runner.to_tensor(cv2.resize(crop, (model_w, model_h), interpolation=cv2.INTER_AREA))
+            for crop in crops
+        ]
+        outputs = await asyncio.gather(*(self.face_runner.run(t) for t in tensors))
+        
+        result = img.copy()
+        for (x0, y0, x1, y1), crop, output in zip(boxes, crops, outputs):
+            restored = cv2.resize(
+                self.face_runner.from_tensor(output),
+                (x1 - x0, y1 - y0),
+                interpolation=cv2.INTER_LANCZOS4
+            )
+            result[y0:y1, x0:x1] = cv2.addWeighted(
+                crop, 1.0 - self.face_strength, restored, self.face_strength, 0
+            )
+        
+        return result
+    
+    def _detect_faces(self, img: np.ndarray, max_side: int = 640) -> List[Tuple[int, int, int, int]]:
+        """Detect faces on downscaled frame, returns padded boxes in full resolution"""
+        
+        h, w = img.shape[:2]
+        scale = min(1.0, max_side / max(h, w))
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        
+        faces = _get_face_cascade().detectMultiScale(gray, 1.3, 5)
+        
+        boxes = []
+        for fx, fy, fw, fh in faces:
+            # Back to full resolution, with 30% margin around the face
+            x, y, bw, bh = [int(v / scale) for v in (fx, fy, fw, fh)]
+            pad_x, pad_y = int(bw * 0.3), int(bh * 0.3)
+            boxes.append((
+                max(0, x - pad_x), max(0, y - pad_y),
+                min(w, x + bw + pad_x), min(h, y + bh + pad_y)
+            ))
+        
+        return boxes
+    
+    async def upscale(self, img: np.ndarray, target_width: int, target_height: int) -> np.ndarray:
+        """Tiled super-resolution, then exact resize to target size"""
+        
+        if self.upscale_runner is None:
+            return await self.fallback.upscale(img, target_width, target_height)
+        
+        h, w = img.shape[:2]
+        tile, overlap = self.tile_size, self.tile_overlap
+        step = tile - 2 * overlap
+        
+        # Symmetric padding so every tile read stays inside the array
+        padded = np.pad(img, ((overlap, overlap + tile), (overlap, overlap + tile), (0, 0)), mode="symmetric")
+        
+        boxes = [
+            (y, x, min(y + step, h), min(x + step, w))
+            for y in range(0, h, step)
+            for x in range(0, w, step)
+        ]
+        tensors = [self.upscale_runner.to_tensor(padded[y:y + tile, x:x + tile]) for y, x, _, _ in boxes]
+        outputs = await asyncio.gather(*(self.upscale_runner.run(t) for t in tensors))
+        
+        scale = outputs[0].shape[-1] // tile
+        result = np.zeros((h * scale, w * scale, 3), dtype=np.uint8)
+        
+        for (y0, x0, y1, x1), output in zip(boxes, outputs):
+            out_tile = self.upscale_runner.from_tensor(output)
+            core = out_tile[
+                overlap * scale:(overlap + y1 - y0) * scale,
+                overlap * scale:(overlap + x1 - x0) * scale
+            ]
+            result[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = core
+        
+        if result.shape[1] != target_width or result.shape[0] != target_height:
+            interpolation = cv2.INTER_AREA if result.shape[0] > target_height else cv2.INTER_LANCZOS4
+            result = cv2.resize(result, (target_width, target_height), interpolation=interpolation)
+        
+        return result
+
+
+def create_enhancement_backend() -> EnhancementBackend:
+    """Create enhancement backend from worker settings"""
+    
+    if settings.POST_PROCESS_BACKEND == "onnx":
+        try:
+            return OnnxEnhancementBackend(
+                face_model_path=settings.FACE_RESTORE_MODEL_PATH or None,
+                upscale_model_path=settings.UPSCALE_MODEL_PATH or None,
+                intra_op_threads=settings.ONNX_INTRA_OP_THREADS,
+                tile_size=settings.ONNX_TILE_SIZE,
+                tile_overlap=settings.ONNX_TILE_OVERLAP,
+                batch_size=settings.ONNX_BATCH_SIZE
+            )
+        except Exception as e:
+            logger.error(f"Failed to initialize ONNX backend, using placeholder: {e}")
+    
+    return PlaceholderEnhancementBackend()
+
+
+@dataclass
+class StageReport:
+    """Execution record of a single pipeline stage"""
+    
+    name: str
+    status: str = "pending"  # ok, disabled, skipped, cancelled, failed
+    wall_time: float = 0.0
+    cpu_time: float = 0.0  # CPU time of work the stage offloaded via run_cpu
+    
+    async def run_cpu(self, func: Callable, *args):
+        """Run blocking function in executor, accounting its thread CPU time"""
+        
+        def _timed():
+            start = time.thread_time()
+            try:
+                return func(*args)
+            finally:
+                self.cpu_time += time.thread_time() - start
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, _timed)
+
+
+@dataclass
+class PipelineReport:
+    """Execution report of one post-processing run"""
+    
+    image_path: str
+    stages: List[StageReport] = field(default_factory=list)
+    rejected_by: Optional[str] = None
+    wall_time: float = 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "image_path": self.image_path,
+            "rejected_by": self.rejected_by,
+            "wall_time": round(self.wall_time, 4),
+            "stages": {
+                stage.name: {
+                    "status": stage.status,
+                    "wall_time": round(stage.wall_time, 4),
+                    "cpu_time": round(stage.cpu_time, 4)
+                }
+                for stage in self.stages
+            }
+        }
+
+
+@dataclass
+class PipelineContext:
+    """State shared by pipeline stages for one image"""
+    
+    image_path: str
+    payload: ImagePayload
+    image: np.ndarray
+    brief: Dict[str, Any] = field(default_factory=dict)
+    has_defects: bool = False
+    rejected: bool = False
+    output_path: Optional[str] = None
+
+
+@dataclass
+class PipelineStage:
+    """
+    Pipeline stage declaration
+    
+    Args:
+        name: unique stage name
+        func: async callable (ctx, stage_report) -> None
+        depends_on: stages that must finish first
+        brief_flag: brief key enabling/disabling the stage
+        enabled_by_default: value used when brief has no flag
+    """
+    
+    name: str
+    func: Callable[[PipelineContext, StageReport], Awaitable[None]]
+    depends_on: Tuple[str, ...] = ()
+    brief_flag: Optional[str] = None
+    enabled_by_default: bool = True
+    
+    def is_enabled(self, brief: Dict[str, Any]) -> bool:
+        if self.brief_flag is None:
+            return True
+        return bool(brief.get(self.brief_flag, self.enabled_by_default))
+
+
+class StageDAG:
+    """
+    Dependency-aware stage executor
+    Independent stages run concurrently; a stage setting ctx.rejected
+    cancels running stages and skips everything not yet started
+    """
+    
+    def __init__(self, stages: List[PipelineStage]):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError("Duplicate stage names in pipeline")
+        
+        for stage in stages:
+            unknown = [d for d in stage.depends_on if d not in names]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages: {unknown}")
+        
+        self.stages = stages
+        self._check_acyclic()
+    
+    def _check_acyclic(self):
+        visiting, visited = set(), set()
+        by_name = {stage.name: stage for stage in self.stages}
+        
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in pipeline at stage {name}")
+            visiting.add(name)
+            for dep in by_name[name].depends_on:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+        
+        for stage in self.stages:
+            visit(stage.name)
+    
+    async def run(self, ctx: PipelineContext) -> PipelineReport:
+        """Execute all stages for context"""
+        
+        report = PipelineReport(image_path=ctx.image_path)
+        records = {stage.name: StageReport(stage.name) for stage in self.stages}
+        report.stages = list(records.values())
+        
+        remaining = {stage.name: stage for stage in self.stages}
+        finished = set()
+        running: Dict[asyncio.Task, str] = {}
+        started_at = time.perf_counter()
+        
+        try:
+            while remaining or running:
+                # Start every stage whose dependencies are satisfied
+                progressed = True
+                while progressed and not ctx.rejected:
+                    progressed = False
+                    for name, stage in list(remaining.items()):
+                        if not all(dep in finished for dep in stage.depends_on):
+                            continue
+                        
+                        del remaining[name]
+                        progressed = True
+                        
+                        if stage.is_enabled(ctx.brief):
+                            task = asyncio.ensure_future(self._run_stage(stage, ctx, records[name]))
+                            running[task] = name
+                        else:
+                            records[name].status = "disabled"
+                            finished.add(name)
+                
+                if ctx.rejected or not running:
+                    break
+                
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    task.result()  # re-raise stage failure
+                    finished.add(name)
+                    if ctx.rejected and report.rejected_by is None:
+                        report.rejected_by = name
+        finally:
+            for task, name in running.items():
+                task.cancel()
+                records[name].status = "cancelled"
+            if running:
+                await asyncio.gather(*running.keys(), return_exceptions=True)
+            
+            for name in remaining:
+                records[name].status = "skipped"
+            
+            report.wall_time = time.perf_counter() - started_at
+        
+        return report
+    
+    async def _run_stage(self, stage: PipelineStage, ctx: PipelineContext, record: StageReport):
+        start = time.perf_counter()
+        
+        try:
+            await stage.func(ctx, record)
+            record.status = "ok"
+        except asyncio.CancelledError:
+            record.status = "cancelled"
+            raise
+        except Exception:
+            record.status = "failed"
+            raise
+        finally:
+            record.wall_time = time.perf_counter() - start
+
+
 class PostProcessor:
     """
     Automated post-processing pipeline for premium packages
     Based on section 20 of the plan
     """
     
-    def __init__(self, api_key: str):
-        """Initialize post processor"""
+    def __init__(self, api_key: str, storage=None, upload_prefix: str = "post_process",
+                 backend: Optional[EnhancementBackend] = None,
+                 stages: Optional[List[PipelineStage]] = None):
+        """
+        Initialize post processor
+        
+        Args:
+            api_key: PiAPI key
+            storage: optional YandexObjectStorage; when set, images are
+                uploaded once and remote stages receive URLs instead of base64
+            upload_prefix: key prefix for uploaded payloads
+            backend: face restoration / upscale backend (default from settings)
+            stages: custom pipeline stages (default: _build_stages)
+        """
         
         self.api_key = api_key
         self.base_url = "https://api.piapi.ai/api/v1"
+        self.storage = storage
+        self.upload_prefix = upload_prefix
+        self.backend = backend or create_enhancement_backend()
+        self.pipeline = StageDAG(stages or self._build_stages())
+        
+        logger.info(f"Post processor initialized ({self.backend.name} backend)")
+    
+    def _build_stages(self) -> List[PipelineStage]:
+        """
+        Default pipeline:
+        nsfw_check ─┬─> face_restore ─┐
+        detect_defects ───────────────┴─> inpaint_defects -> color_enhance -> upscale -> write
+        """
         
-        logger.info("Post processor initialized")
+        return [
+            PipelineStage("nsfw_check", self._stage_nsfw_check, brief_flag="nsfw_filter"),
+            PipelineStage("detect_defects", self._stage_detect_defects, brief_flag="defect_fix"),
+            PipelineStage("face_restore", self._stage_face_restore, ("nsfw_check",),
+                          brief_flag="face_restoration"),
+            PipelineStage("inpaint_defects", self._stage_inpaint_defects, ("face_restore", "detect_defects"),
+                          brief_flag="defect_fix"),
+            PipelineStage("color_enhance", self._stage_color_enhance, ("inpaint_defects",),
+                          brief_flag="color_enhancement"),
+            PipelineStage("upscale", self._stage_upscale, ("color_enhance",), brief_flag="upscale_4k"),
+            PipelineStage("write", self._stage_write, ("upscale",)),
+        ]
     
-    async def process_image(self, image_path: str, package_type: str) -> Optional[str]:
+    async def process_image(self, image_path: str, package_type: str,
+                            brief: Optional[Dict[str, Any]] = None) -> Optional[str]:
         """
         Process single image through post-processing pipeline
         """
         
+        processed_path, _ = await self.process_image_with_report(image_path, package_type, brief)
+        return processed_path
+    
+    async def process_image_with_report(self, image_path: str, package_type: str,
+                                        brief: Optional[Dict[str, Any]] = None
+                                        ) -> Tuple[Optional[str], Optional[PipelineReport]]:
+        """
+        Process single image, returns (processed path, execution report)
+        Processed path is None if the image was rejected
+        """
+        
         try:
             # Only process for premium packages
             if package_type != "premium":
-                return image_path
+                return image_path, None
             
-            # Load image
-            img = cv2.imread(image_path)
+            # Load image (keep original encoded bytes for remote stages)
+            payload = ImagePayload.from_file(image_path)
+            img = payload.image
             if img is None:
                 logger.error(f"Failed to load image: {image_path}")
-                return None
-            
-            # Step 1: NSFW check
-            if not await self._nsfw_check(img):
-                logger.warning(f"Image failed NSFW check: {image_path}")
-                return None
+                return None, None
             
-            # Step 2: Face restoration using CodeFormer
-            restored_img = await self._face_restore(img)
-            if restored_img is None:
-                restored_img = img
-            
-            # Step 3: Detect and fix defects
-            if self._detect_defects(restored_img):
-                restored_img = await self._inpaint_defects(restored_img)
-            
-            # Step 4: Color and contrast enhancement
-            enhanced_img = self._enhance_color_contrast(restored_img)
-            
-            # Step 5: 4K upscale
-            upscaled_img = await self._upscale_4k(enhanced_img)
+            ctx = PipelineContext(
+                image_path=image_path,
+                payload=payload,
+                image=img,
+                brief=brief or {}
+            )
+            report = await self.pipeline.run(ctx)
+            logger.debug(f"Post-processing report: {report.to_dict()}")
             
-            # Save processed image
-            processed_path = self._get_processed_path(image_path)
-            cv2.imwrite(processed_path, upscaled_img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            if ctx.rejected:
+                logger.warning(f"Image rejected by {report.rejected_by}: {image_path}")
+                return None, report
             
-            logger.info(f"Image processed successfully: {processed_path}")
-            return processed_path
+            logger.info(f"Image processed successfully in {report.wall_time:.2f}s: {ctx.output_path}")
+            return ctx.output_path or image_path, report
             
         except Exception as e:
             logger.error(f"Error processing image: {e}")
-            return image_path  # Return original on error
+            return image_path, None  # Return original on error
+    
+    async def _stage_nsfw_check(self, ctx: PipelineContext, report: StageReport):
+        if not await self._nsfw_check(ctx.payload):
+            ctx.rejected = True
+    
+    async def _stage_detect_defects(self, ctx: PipelineContext, report: StageReport):
+        # Runs on the original frame, concurrently with the NSFW check
+        ctx.has_defects = await report.run_cpu(self._detect_defects, ctx.image)
+    
+    async def _stage_face_restore(self, ctx: PipelineContext, report: StageReport):
+        restored_img = await self._face_restore(ctx.image)
+        if restored_img is not None:
+            ctx.image = restored_img
+    
+    async def _stage_inpaint_defects(self, ctx: PipelineContext, report: StageReport):
+        if not ctx.has_defects:
+            return
+        
+        # Reuse original bytes if earlier stages left the frame untouched
+        payload = ctx.payload
+        if ctx.image is not payload.image:
+            payload = await report.run_cpu(ImagePayload.from_array, ctx.image)
+        ctx.image = await self._inpaint_defects(payload)
+    
+    async def _stage_color_enhance(self, ctx: PipelineContext, report: StageReport):
+        ctx.image = await report.run_cpu(self._enhance_color_contrast, ctx.image)
+    
+    async def _stage_upscale(self, ctx: PipelineContext, report: StageReport):
+        ctx.image = await self._upscale_4k(ctx.image)
+    
+    async def _stage_write(self, ctx: PipelineContext, report: StageReport):
+        processed_path = self._get_processed_path(ctx.image_path)
+        await report.run_cpu(cv2.imwrite, processed_path, ctx.image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        ctx.output_path = processed_path
+    
+    async def _payload_reference(self, payload: ImagePayload) -> str:
+        """
+        Reference to pass to PiAPI: URL after a single upload when storage
+        is configured, inline data URI otherwise
+        """
+        
+        if payload.url is None and self.storage is not None:
+            key = f"{self.upload_prefix}/{payload.digest}{payload.extension}"
+            result = await self.storage.upload_image(payload.data, key, payload.mime_type)
+            if result.get("success"):
+                payload.url = result["url"]
+            else:
+                logger.warning(f"Payload upload failed, using inline image: {result.get('error')}")
+        
+        return payload.reference()
     
-    async def _nsfw_check(self, img: np.ndarray) -> bool:
+    async def _nsfw_check(self, payload: ImagePayload) -> bool:
         """
         NSFW filter using PiAPI hume-nsfw
-        Skip if score < 0.7
+        Skip if score >= NSFW_THRESHOLD
         """
         
         try:
-            # Convert image to base64 for API
-            _, buffer = cv2.imencode('.jpg', img)
-            import base64
-            img_base64 = base64.b64encode(buffer).decode('utf-8')
-            
-            payload = {
+            request_payload = {
                 "model": "hume-nsfw",
                 "input": {
-                    "image": f"data:image/jpeg;base64,{img_base64}"
+                    "image": await self._payload_reference(payload)
                 }
             }
             
@@ -102,7 +973,7 @@ class PostProcessor:
             async with aiohttp.ClientSession() as session:
                 async with session.post(
                     f"{self.base_url}/nsfw-check",
-                    json=payload,
+                    json=request_payload,
                     headers=headers
                 ) as response:
                     
@@ -110,8 +981,8 @@ class PostProcessor:
                         data = await response.json()
                         nsfw_score = data.get("score", 0.0)
                         
-                        # Pass if score < 0.7
-                        return nsfw_score < 0.7
+                        # Pass if score < NSFW_THRESHOLD
+                        return nsfw_score < settings.NSFW_THRESHOLD
                     else:
                         # If API fails, assume safe
                         logger.warning(f"NSFW check failed, assuming safe: {response.status}")
@@ -124,17 +995,12 @@ class PostProcessor:
     async def _face_restore(self, img: np.ndarray) -> Optional[np.ndarray]:
         """
         Face restoration using CodeFormer (strength=0.7)
-        Note: This is a placeholder - actual implementation would use local CodeFormer
+        Runs on the configured enhancement backend
         """
         
         try:
-            # Placeholder for CodeFormer restoration
-            # In real implementation, this would call local CodeFormer model
-            logger.info("Face restoration applied (placeholder)")
-            
-            # For now, return slight enhancement
-            enhanced = cv2.GaussianBlur(img, (1, 1), 0)
-            enhanced = cv2.addWeighted(img, 0.8, enhanced, 0.2, 0)
+            enhanced = await self.backend.restore_faces(img)
+            logger.info(f"Face restoration applied ({self.backend.name})")
             
             return enhanced
             
@@ -163,17 +1029,14 @@ class PostProcessor:
             logger.error(f"Error in defect detection: {e}")
             return False
     
-    async def _inpaint_defects(self, img: np.ndarray) -> np.ndarray:
+    async def _inpaint_defects(self, payload: ImagePayload) -> np.ndarray:
         """
         Inpaint defects using PiAPI stable-diffusion-inpaint
         """
         
+        img = payload.image
+        
         try:
-            # Convert image to base64
-            _, buffer = cv2.imencode('.jpg', img)
-            import base64
-            img_base64 = base64.b64encode(buffer).decode('utf-8')
-            
             # Create simple mask for inpainting (placeholder)
             mask = np.zeros(img.shape[:2], dtype=np.uint8)
             # Add some mask areas (this would be more sophisticated in real implementation)
@@ -181,10 +1044,10 @@ class PostProcessor:
             _, mask_buffer = cv2.imencode('.png', mask)
             mask_base64 = base64.b64encode(mask_buffer).decode('utf-8')
             
-            payload = {
+            request_payload = {
                 "model": "stable-diffusion-inpaint",
                 "input": {
-                    "image": f"data:image/jpeg;base64,{img_base64}",
+                    "image": await self._payload_reference(payload),
                     "mask": f"data:image/png;base64,{mask_base64}",
                     "prompt": "perfect skin, no artifacts, clean portrait"
                 }
@@ -198,7 +1061,7 @@ class PostProcessor:
             async with aiohttp.ClientSession() as session:
                 async with session.post(
                     f"{self.base_url}/inpaint",
-                    json=payload,
+                    json=request_payload,
                     headers=headers
                 ) as response:
                     
@@ -259,7 +1122,7 @@ class PostProcessor:
     async def _upscale_4k(self, img: np.ndarray) -> np.ndarray:
         """
         4K upscale using Real-ESRGAN
-        Placeholder implementation - would use actual Real-ESRGAN model
+        Runs on the configured enhancement backend
         """
         
         try:
@@ -267,19 +1130,14 @@ class PostProcessor:
             h, w = img.shape[:2]
             
             # Calculate target size (4K = 3840x2160, but maintain aspect ratio)
-            target_height = 2160
+            target_height = settings.UPSCALE_TARGET_HEIGHT
             target_width = int(w * target_height / h)
             
-            if target_width > 3840:
-                target_width = 3840
+            if target_width > settings.UPSCALE_TARGET_WIDTH:
+                target_width = settings.UPSCALE_TARGET_WIDTH
                 target_height = int(h * target_width / w)
             
-            # Use high-quality interpolation as placeholder
-            upscaled = cv2.resize(
-                img, 
-                (target_width, target_height), 
-                interpolation=cv2.INTER_LANCZOS4
-            )
+            upscaled = await self.backend.upscale(img, target_width, target_height)
             
             logger.info(f"Image upscaled to {target_width}x{target_height}")
             return upscaled
@@ -295,7 +1153,8 @@ class PostProcessor:
         processed_name = f"{path.stem}_processed{path.suffix}"
         return str(path.parent / processed_name)
     
-    async def process_batch(self, image_paths: List[str], package_type: str) -> List[str]:
+    async def process_batch(self, image_paths: List[str], package_type: str,
+                            brief: Optional[Dict[str, Any]] = None) -> List[str]:
         """Process batch of images"""
         
         if package_type != "premium":
@@ -308,7 +1167,7 @@ class PostProcessor:
         
         async def process_single(path):
             async with semaphore:
-                return await self.process_image(path, package_type)
+                return await self.process_image(path, package_type, brief)
         
         tasks = [process_single(path) for path in image_paths]
         results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,157 @@
+"""
+Live progress of a generation session
+One Telegram message per session is edited in place as prompts finish,
+images are uploaded and video is rendered
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .config import settings
+from .notifications import BackgroundTelegramNotifier, get_telegram_notifier
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressReporter:
+    """
+    Coalescing progress message
+    update()/advance() only record the new state and can be called from any
+    thread; the message is edited on the notifier loop at most once per
+    `interval` seconds with whatever the latest state is by then
+    """
+    
+    def __init__(self, notifier: BackgroundTelegramNotifier, chat_id: int, message_id: Optional[int] = None,
+                 interval: float = 5.0, on_message: Optional[Callable[[int], None]] = None):
+        """
+        Args:
+            message_id: progress message of an earlier attempt to keep editing
+            on_message: called with message_id once the message is created,
+                runs on the notifier loop and must not block
+        """
+        
+        self.notifier = notifier
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.on_message = on_message
+        
+        self._state: Dict[str, Any] = {}
+        self._rendered: Optional[str] = None
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        self.edit_count = 0
+        self.update_count = 0
+    
+    def update(self, **values: Any):
+        """Set progress values (prompts_total, prompts_done, uploads_total, uploads_done, video)"""
+        
+        self.notifier.loop.call_soon_threadsafe(self._apply, values, {})
+    
+    def advance(self, name: str, amount: int = 1):
+        """Increment a counter"""
+        
+        self.notifier.loop.call_soon_threadsafe(self._apply, {}, {name: amount})
+    
+    def _apply(self, values: Dict[str, Any], increments: Dict[str, int]):
+        self._state.update(values)
+        for name, amount in increments.items():
+            self._state[name] = self._state.get(name, 0) + amount
+        self.update_count += 1
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+    
+    async def _flush_later(self):
+        delay = self._last_edit + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._flush()
+    
+    async def _flush(self, text: Optional[str] = None):
+        text = text or self.render()
+        if text == self._rendered:
+            return
+        
+        try:
+            if self.message_id is None:
+                message = await self.notifier.notifier.request("sendMessage", self.chat_id, {
+                    "chat_id": self.chat_id,
+                    "text": text,
+                    "parse_mode": "HTML"
+                })
+                if message is None:
+                    return
+                self.message_id = message["message_id"]
+                if self.on_message:
+                    self.on_message(self.message_id)
+            else:
+                if not await self.notifier.notifier.edit_message_text(self.chat_id, self.message_id, text):
+                    return
+            
+            self._rendered = text
+            self.edit_count += 1
+        except Exception as e:
+            logger.error(f"❌ Error updating progress for {self.chat_id}: {e}")
+        finally:
+            self._last_edit = time.monotonic()
+    
+    def render(self) -> str:
+        state = self._state
+        lines = ["⏳ <b>Создаю фотосессию</b>", ""]
+        
+        if state.get("prompts_total"):
+            lines.append(f"🎨 Изображения: {state.get('prompts_done', 0)}/{state['prompts_total']}")
+        if state.get("uploads_total"):
+            lines.append(f"☁️ Загружено: {state.get('uploads_done', 0)}/{state['uploads_total']}")
+        if state.get("video") == "running":
+            lines.append("🎬 Видео: создаётся")
+        elif state.get("video") == "done":
+            lines.append("🎬 Видео: готово")
+        
+        return "\n".join(lines)
+    
+    def finish(self, text: str = "✅ Фотосессия готова"):
+        """Write the final text right away (blocking)"""
+        
+        async def _finish():
+            if self._flush_task is not None and not self._flush_task.done():
+                self._flush_task.cancel()
+            await self._flush(text)
+        
+        try:
+            asyncio.run_coroutine_threadsafe(_finish(), self.notifier.loop).result(self.notifier.timeout)
+        except Exception as e:
+            logger.error(f"❌ Error finishing progress for {self.chat_id}: {e}")
+
+
+class NullProgressReporter:
+    """Progress reporter that does nothing (progress updates disabled)"""
+    
+    def update(self, **values: Any):
+        pass
+    
+    def advance(self, name: str, amount: int = 1):
+        pass
+    
+    def finish(self, text: str = ""):
+        pass
+
+
+def create_progress_reporter(chat_id: int, message_id: Optional[int] = None,
+                             on_message: Optional[Callable[[int], None]] = None):
+    """Создание репортёра прогресса для сессии"""
+    
+    if not settings.PROGRESS_UPDATES_ENABLED:
+        return NullProgressReporter()
+    
+    return ProgressReporter(
+        get_telegram_notifier(),
+        chat_id,
+        message_id=message_id,
+        interval=settings.PROGRESS_EDIT_INTERVAL_SECONDS,
+        on_message=on_message
+    )
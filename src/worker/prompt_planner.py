@@ -0,0 +1,68 @@
+"""
+Diversity-aware prompt planning
+Candidates are compared by token Jaccard distance and picked with a greedy
+farthest-point selection, so a package is filled with prompts that differ
+from each other as much as the catalog allows
+"""
+
+import re
+from functools import lru_cache
+from typing import FrozenSet, List, Sequence
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=4096)
+def prompt_tokens(prompt: str) -> FrozenSet[str]:
+    """Word unigrams and bigrams of a prompt (bigrams keep word order), cached per prompt"""
+    
+    words = _TOKEN_RE.findall(prompt.casefold())
+    return frozenset(words) | frozenset(f"{a} {b}" for a, b in zip(words, words[1:]))
+
+
+def jaccard_distance(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 0.0
+    shared = len(a & b)
+    return 1.0 - shared / (len(a) + len(b) - shared)
+
+
+def select_diverse(candidates: Sequence[str], count: int, selected: Sequence[str] = ()) -> List[str]:
+    """
+    Greedy farthest-point selection
+    
+    Args:
+        candidates: prompts to choose from, in preference order (ties go to the earlier one)
+        count: how many to pick
+        selected: prompts already chosen, new picks keep away from them too
+    
+    Returns:
+        Up to `count` distinct candidates; the first one is candidates[0]
+        unless `selected` is given
+    """
+    
+    taken = set(selected)
+    candidates = list(dict.fromkeys(c for c in candidates if c not in taken))
+    if count <= 0 or not candidates:
+        return []
+    
+    tokens = [prompt_tokens(candidate) for candidate in candidates]
+    # Distance of every candidate to its nearest selected prompt
+    nearest = [1.0] * len(candidates)
+    for prompt in selected:
+        chosen = prompt_tokens(prompt)
+        nearest = [min(d, jaccard_distance(t, chosen)) for d, t in zip(nearest, tokens)]
+    
+    picked: List[int] = []
+    while len(picked) < min(count, len(candidates)):
+        if not picked and not selected:
+            best = 0
+        else:
+            # max() keeps the first of equally distant candidates
+            best = max((i for i in range(len(candidates)) if i not in picked), key=lambda i: nearest[i])
+        picked.append(best)
+        for i in range(len(candidates)):
+            if i not in picked:
+                nearest[i] = min(nearest[i], jaccard_distance(tokens[i], tokens[best]))
+    
+    return [candidates[i] for i in picked]
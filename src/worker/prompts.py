@@ -2,128 +2,353 @@
 Prompt generation module
 """
 
+import json
 import logging
-from typing import List, Dict, Any
-import random
+import os
+import threading
+import time
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, Tuple
+from .content_policy import get_content_policy
+from .prompt_planner import select_diverse
 
 logger = logging.getLogger(__name__)
 
+# Built-in catalog, used when STYLE_CATALOG_PATH is not set
+# Style templates with professional prompts (updated 2025)
+BUILTIN_STYLES = {
+    "RL-01": {
+        "name": "Realistic Studio Vogue",
+        "base": "/Imagine a cinematic studio portrait of a young person, softbox key light, pastel seamless background, gentle color grading, shot on Phase One IQ4 150 MP, ultra-realistic skin texture, fashion-editorial mood --ar 3:4",
+        "variations": [
+            "confident gaze, elegant pose",
+            "subtle smile, fashion styling", 
+            "intense lighting, dramatic shadows",
+            "glamour makeup, perfect retouching"
+        ],
+        "lora_type": "realism"
+    },
+    "FN-02": {
+        "name": "Fantasy Ethereal", 
+        "base": "/Imagine a young person as ethereal forest fairy, backlit by golden dust particles, pastel haze, flowing chiffon dress, fantasy artbook quality, volumetric lighting, 8k RAW --ar 2:3",
+        "variations": [
+            "flowing hair, dreamy expression",
+            "delicate flowers, soft textures",
+            "morning light, romantic mood",
+            "vintage aesthetics, warm tones"
+        ],
+        "lora_type": "realism"
+    },
+    "CP-03": {
+        "name": "Cyberpunk Neon City",
+        "base": "/Imagine a cyberpunk portrait of a young person, neon Tokyo alley, rain-soaked jacket, reflective puddles, teal-magenta color scheme, cinematic DOF, 50 mm f/1.2, ultra-realistic --ar 3:4",
+        "variations": [
+            "with neon lights and urban atmosphere",
+            "with futuristic styling and tech elements",
+            "with rain effects and reflections",
+            "with cyberpunk aesthetics and glow"
+        ],
+        "lora_type": "graphic-portrait"
+    },
+    "MJ6-04": {
+        "name": "Midjourney V6 Look",
+        "base": "/Imagine an elegant editorial portrait of a young person, soft rim light, minimal background, Vogue aesthetic, hyper-detail --ar 3:4",
+        "variations": [
+            "with magazine-quality perfection",
+            "with editorial styling and composition",
+            "with hyper-realistic details",
+            "with premium fashion aesthetics"
+        ],
+        "lora_type": "mjv6",
+        "lora_strength": 0.8
+    },
+    "CEO-05": {
+        "name": "Corporate Headshot",
+        "base": "/Imagine a professional corporate headshot of a young person, charcoal blazer, subtle rim light, dark grey backdrop, Leica SL2-S 90 mm Summicron prime lens, impeccable skin retouch, Forbes cover mood --ar 4:5",
+        "variations": [
+            "with professional confidence and direct gaze",
+            "with subtle smile and business attire",
+            "with executive presence and clean styling",
+            "with leadership aura and polished look"
+        ],
+        "lora_type": "realism"
+    },
+    "PST-06": {
+        "name": "Pastel Dream",
+        "base": "/Imagine a young person in pastel dream aesthetic, diffused window light, blooming peonies, mint & blush palette, Fuji Pro400H film simulation, light grain, shallow DOF 1.2, 85 mm lens --ar 2:3",
+        "variations": [
+            "with soft pastel colors and dreamy atmosphere",
+            "with delicate flowers and textures",
+            "with romantic mood and film emulation",
+            "with vintage aesthetics and warm tones"
+        ],
+        "lora_type": "realism"
+    },
+    "CLS-07": {
+        "name": "Classic B&W",
+        "base": "/Imagine a timeless black-and-white portrait of a young person, high-contrast Rembrandt lighting, medium-format Hasselblad, deep shadows, Ilford HP5 film emulation, 6k resolution --ar 1:1",
+        "variations": [
+            "with dramatic lighting and classic elegance",
+            "with timeless beauty and sophisticated styling",
+            "with artistic shadows and monochrome aesthetics",
+            "with vintage Hollywood glamour"
+        ],
+        "lora_type": "realism"
+    },
+    "CSP-08": {
+        "name": "Cosplay Hero",
+        "base": "/Imagine a young person as heroic fantasy warrior, ornate armor with glowing runes, dynamic rim light, dramatic atmosphere, concept-art quality, epic scale --ar 3:4",
+        "variations": [
+            "with fantasy armor and heroic pose",
+            "with magical elements and epic lighting",
+            "with warrior aesthetics and power",
+            "with concept art quality and details"
+        ],
+        "lora_type": "graphic-portrait"
+    }
+}
 
-class PromptGenerator:
-    """Generate prompts based on client brief"""
+BUILTIN_BACKGROUNDS = {
+    "studio": "studio seamless white backdrop",
+    "pastel": "soft pastel seamless background",
+    "urban": "urban brick wall background",
+    "nature": "natural outdoor setting",
+    "minimal": "clean minimal background",
+    "textured": "textured studio backdrop",
+    "gradient": "gradient colored background"
+}
+
+BUILTIN_MOODS = {
+    "confident": "confident and empowered expression",
+    "soft": "soft and gentle demeanor",
+    "dramatic": "dramatic and intense mood",
+    "playful": "playful and vibrant energy",
+    "elegant": "elegant and sophisticated presence",
+    "natural": "natural and relaxed atmosphere"
+}
+
+BUILTIN_PURPOSES = {
+    "insta": "instagram-ready, social media optimized",
+    "avatar": "profile picture perfect, clean and professional",
+    "career": "professional and polished, LinkedIn ready",
+    "dating": "attractive and approachable, confident smile"
+}
+
+
+def _freeze(value: Any) -> Any:
+    """Read-only deep copy: dicts become mappingproxy, lists become tuples"""
     
-    def __init__(self):
-        # Style templates with professional prompts (updated 2025)
-        self.style_templates = {
-            "RL-01": {
-                "name": "Realistic Studio Vogue",
-                "base": "/Imagine a cinematic studio portrait of a young person, softbox key light, pastel seamless background, gentle color grading, shot on Phase One IQ4 150 MP, ultra-realistic skin texture, fashion-editorial mood --ar 3:4",
-                "variations": [
-                    "confident gaze, elegant pose",
-                    "subtle smile, fashion styling", 
-                    "intense lighting, dramatic shadows",
-                    "glamour makeup, perfect retouching"
-                ],
-                "lora_type": "realism"
-            },
-            "FN-02": {
-                "name": "Fantasy Ethereal", 
-                "base": "/Imagine a young person as ethereal forest fairy, backlit by golden dust particles, pastel haze, flowing chiffon dress, fantasy artbook quality, volumetric lighting, 8k RAW --ar 2:3",
-                "variations": [
-                    "flowing hair, dreamy expression",
-                    "delicate flowers, soft textures",
-                    "morning light, romantic mood",
-                    "vintage aesthetics, warm tones"
-                ],
-                "lora_type": "realism"
-            },
-            "CP-03": {
-                "name": "Cyberpunk Neon City",
-                "base": "/Imagine a cyberpunk portrait of a young person, neon Tokyo alley, rain-soaked jacket, reflective puddles, teal-magenta color scheme, cinematic DOF, 50 mm f/1.2, ultra-realistic --ar 3:4",
-                "variations": [
-                    "with neon lights and urban atmosphere",
-                    "with futuristic styling and tech elements",
-                    "with rain effects and reflections",
-                    "with cyberpunk aesthetics and glow"
-                ],
-                "lora_type": "graphic-portrait"
-            },
-            "MJ6-04": {
-                "name": "Midjourney V6 Look",
-                "base": "/Imagine an elegant editorial portrait of a young person, soft rim light, minimal background, Vogue aesthetic, hyper-detail --ar 3:4",
-                "variations": [
-                    "with magazine-quality perfection",
-                    "with editorial styling and composition",
-                    "with hyper-realistic details",
-                    "with premium fashion aesthetics"
-                ],
-                "lora_type": "mjv6",
-                "lora_strength": 0.8
-            },
-            "CEO-05": {
-                "name": "Corporate Headshot",
-                "base": "/Imagine a professional corporate headshot of a young person, charcoal blazer, subtle rim light, dark grey backdrop, Leica SL2-S 90 mm Summicron prime lens, impeccable skin retouch, Forbes cover mood --ar 4:5",
-                "variations": [
-                    "with professional confidence and direct gaze",
-                    "with subtle smile and business attire",
-                    "with executive presence and clean styling",
-                    "with leadership aura and polished look"
-                ],
-                "lora_type": "realism"
-            },
-            "PST-06": {
-                "name": "Pastel Dream",
-                "base": "/Imagine a young person in pastel dream aesthetic, diffused window light, blooming peonies, mint & blush palette, Fuji Pro400H film simulation, light grain, shallow DOF 1.2, 85 mm lens --ar 2:3",
-                "variations": [
-                    "with soft pastel colors and dreamy atmosphere",
-                    "with delicate flowers and textures",
-                    "with romantic mood and film emulation",
-                    "with vintage aesthetics and warm tones"
-                ],
-                "lora_type": "realism"
-            },
-            "CLS-07": {
-                "name": "Classic B&W",
-                "base": "/Imagine a timeless black-and-white portrait of a young person, high-contrast Rembrandt lighting, medium-format Hasselblad, deep shadows, Ilford HP5 film emulation, 6k resolution --ar 1:1",
-                "variations": [
-                    "with dramatic lighting and classic elegance",
-                    "with timeless beauty and sophisticated styling",
-                    "with artistic shadows and monochrome aesthetics",
-                    "with vintage Hollywood glamour"
-                ],
-                "lora_type": "realism"
-            },
-            "CSP-08": {
-                "name": "Cosplay Hero",
-                "base": "/Imagine a young person as heroic fantasy warrior, ornate armor with glowing runes, dynamic rim light, dramatic atmosphere, concept-art quality, epic scale --ar 3:4",
-                "variations": [
-                    "with fantasy armor and heroic pose",
-                    "with magical elements and epic lighting",
-                    "with warrior aesthetics and power",
-                    "with concept art quality and details"
-                ],
-                "lora_type": "graphic-portrait"
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class StyleCatalog:
+    """
+    Immutable style catalog shared by all PromptGenerator instances
+    Prompt lists are built once per (style, background, purpose, count,
+    cross_styles) and then served from an LRU cache. Packages larger than
+    the template covers without repeats are planned for diversity
+    """
+    
+    DEFAULT_STYLE = "RL-01"
+    CROSS_STYLE_PROMPTS = 2  # per mixed-in style
+    
+    def __init__(self, styles: Dict[str, Any], backgrounds: Dict[str, str], moods: Dict[str, str],
+                 purposes: Dict[str, str], source: str = "builtin"):
+        self.styles: Mapping[str, Mapping[str, Any]] = _freeze(styles)
+        self.backgrounds: Mapping[str, str] = _freeze(backgrounds)
+        self.moods: Mapping[str, str] = _freeze(moods)
+        self.purposes: Mapping[str, str] = _freeze(purposes)
+        self.source = source
+        
+        if self.DEFAULT_STYLE not in self.styles:
+            raise ValueError(f"Style catalog {source} has no {self.DEFAULT_STYLE} style")
+        
+        self._mood_list = tuple(self.moods.values())
+        self.prompts = lru_cache(maxsize=1024)(self._build_prompts)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], source: str) -> "StyleCatalog":
+        return cls(
+            styles=data["styles"],
+            backgrounds=data.get("backgrounds", BUILTIN_BACKGROUNDS),
+            moods=data.get("moods", BUILTIN_MOODS),
+            purposes=data.get("purposes", BUILTIN_PURPOSES),
+            source=source
+        )
+    
+    @classmethod
+    def from_file(cls, path: str) -> "StyleCatalog":
+        """Load catalog from JSON or YAML (keys: styles, backgrounds, moods, purposes)"""
+        
+        with open(path, encoding="utf-8") as f:
+            if path.endswith((".yaml", ".yml")):
+                import yaml
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+        
+        return cls.from_dict(data, source=path)
+    
+    def template(self, style: str) -> Mapping[str, Any]:
+        return self.styles.get(style, self.styles[self.DEFAULT_STYLE])
+    
+    def background(self, background: str) -> str:
+        """Background description for the prompt"""
+        
+        # If it's a predefined background type
+        if background.lower() in self.backgrounds:
+            return self.backgrounds[background.lower()]
+        
+        # If it's a custom description
+        if len(background) > 5:
+            return f"background: {background}"
+        
+        # Default background
+        return self.backgrounds["studio"]
+    
+    def _prompt_parts(self, style: str, background: str, purpose: str) -> Tuple[str, str]:
+        """Base prompt and suffix, the same for every prompt of the style"""
+        
+        template = self.template(style)
+        base_prompt = template["base"].format(background=self.background(background))
+        
+        # Purpose and LoRA parts
+        suffix = ""
+        if purpose in self.purposes:
+            suffix += f", {self.purposes[purpose]}"
+        if template.get("lora_type"):
+            lora_strength = template.get("lora_strength", 0.7)
+            suffix += f" <lora_type:\"{template['lora_type']}\", lora_strength:{lora_strength}>"
+        
+        return base_prompt, suffix
+    
+    def _template_prompts(self, style: str, background: str, purpose: str, count: int) -> List[str]:
+        """Template order: variations first, then mood modifiers by index"""
+        
+        template = self.template(style)
+        base_prompt, suffix = self._prompt_parts(style, background, purpose)
+        
+        prompts = []
+        for i in range(count):
+            if i < len(template["variations"]):
+                detail = template["variations"][i]
+            else:
+                detail = self._mood_list[i % len(self._mood_list)]
+            prompts.append(f"{base_prompt}, {detail}{suffix}")
+        return prompts
+    
+    def _style_candidates(self, style: str, background: str, purpose: str) -> List[str]:
+        """Every distinct prompt of a style: variations, moods and their combinations"""
+        
+        template = self.template(style)
+        base_prompt, suffix = self._prompt_parts(style, background, purpose)
+        
+        details = list(template["variations"])
+        details += [f"{variation}, {mood}" for variation in template["variations"] for mood in self._mood_list]
+        details += list(self._mood_list)
+        return [f"{base_prompt}, {detail}{suffix}" for detail in details]
+    
+    def _build_prompts(self, style: str, background: str, purpose: str, count: int,
+                       cross_styles: int = 0) -> Tuple[str, ...]:
+        style = style if style in self.styles else self.DEFAULT_STYLE
+        
+        # Cross-style prompts: CROSS_STYLE_PROMPTS from each of the most distant other styles
+        cross_count = min(cross_styles, count // 4 // self.CROSS_STYLE_PROMPTS) * self.CROSS_STYLE_PROMPTS
+        
+        # Packages the template covers without repeats keep its order (and their result cache keys);
+        # only larger ones are planned
+        if not cross_count:
+            prompts = self._template_prompts(style, background, purpose, count)
+            if len(set(prompts)) == len(prompts):
+                return tuple(prompts)
+        
+        prompts = select_diverse(self._style_candidates(style, background, purpose), count - cross_count)
+        
+        if cross_count:
+            other_bases = {
+                self.template(other)["base"]: other for other in self.styles if other != style
             }
-        }
+            for base in select_diverse(list(other_bases), cross_count // self.CROSS_STYLE_PROMPTS,
+                                       selected=[self.template(style)["base"]]):
+                candidates = self._style_candidates(other_bases[base], background, purpose)
+                prompts += select_diverse(candidates, self.CROSS_STYLE_PROMPTS, selected=prompts)
         
-        self.background_options = {
-            "studio": "studio seamless white backdrop",
-            "pastel": "soft pastel seamless background",
-            "urban": "urban brick wall background",
-            "nature": "natural outdoor setting",
-            "minimal": "clean minimal background",
-            "textured": "textured studio backdrop",
-            "gradient": "gradient colored background"
-        }
+        # A small catalog may run out of distinct prompts, repeat the plan to fill the package
+        distinct = len(prompts)
+        while prompts and len(prompts) < count:
+            prompts.append(prompts[len(prompts) % distinct])
         
-        self.mood_modifiers = {
-            "confident": "confident and empowered expression",
-            "soft": "soft and gentle demeanor",
-            "dramatic": "dramatic and intense mood",
-            "playful": "playful and vibrant energy",
-            "elegant": "elegant and sophisticated presence",
-            "natural": "natural and relaxed atmosphere"
-        }
+        return tuple(prompts)
+
+
+BUILTIN_CATALOG = StyleCatalog(BUILTIN_STYLES, BUILTIN_BACKGROUNDS, BUILTIN_MOODS, BUILTIN_PURPOSES)
+
+# Read from the environment directly: the bot imports this module without worker settings
+STYLE_CATALOG_PATH = os.getenv("STYLE_CATALOG_PATH", "")
+STYLE_CATALOG_RELOAD_SECONDS = float(os.getenv("STYLE_CATALOG_RELOAD_SECONDS", "30"))
+
+_catalog = BUILTIN_CATALOG
+_catalog_mtime = 0.0
+_catalog_checked = 0.0
+_catalog_lock = threading.Lock()
+
+
+def get_style_catalog() -> StyleCatalog:
+    """Текущий каталог стилей (файл перечитывается, если изменился)"""
+    global _catalog, _catalog_mtime, _catalog_checked
+    
+    if not STYLE_CATALOG_PATH:
+        return _catalog
+    
+    now = time.monotonic()
+    if _catalog_checked and now - _catalog_checked < STYLE_CATALOG_RELOAD_SECONDS:
+        return _catalog
+    
+    with _catalog_lock:
+        _catalog_checked = now
+        try:
+            mtime = os.path.getmtime(STYLE_CATALOG_PATH)
+            if mtime != _catalog_mtime:
+                # A broken file is not retried until it changes again
+                _catalog_mtime = mtime
+                # Swap in a complete new catalog, readers never see a partial one
+                _catalog = StyleCatalog.from_file(STYLE_CATALOG_PATH)
+                logger.info(f"Loaded style catalog from {STYLE_CATALOG_PATH} ({len(_catalog.styles)} styles)")
+        except Exception as e:
+            logger.error(f"Error loading style catalog {STYLE_CATALOG_PATH}, keeping {_catalog.source}: {e}")
+    
+    return _catalog
+
+
+class PromptGenerator:
+    """Generate prompts based on client brief"""
+    
+    # Other styles mixed into large packages
+    CROSS_STYLE_PACKAGES = {"premium": 3}
+    
+    # Brief fields written by the user in free text
+    BRIEF_TEXT_FIELDS = ("background", "text_overlay")
+    
+    @property
+    def catalog(self) -> StyleCatalog:
+        return get_style_catalog()
+    
+    @property
+    def style_templates(self) -> Mapping[str, Mapping[str, Any]]:
+        return self.catalog.styles
+    
+    @property
+    def background_options(self) -> Mapping[str, str]:
+        return self.catalog.backgrounds
+    
+    @property
+    def mood_modifiers(self) -> Mapping[str, str]:
+        return self.catalog.moods
     
     def generate_prompts(self, brief: Dict[str, Any]) -> List[str]:
         """Generate prompts based on brief"""
@@ -136,36 +361,10 @@ class PromptGenerator:
         # Determine number of prompts needed
         num_prompts = self._get_prompt_count_by_package(package_type)
         
-        prompts = []
-        template = self.style_templates.get(style, self.style_templates["RL-01"])
-        
-        # Process background
-        background_desc = self._process_background(background)
-        
-        for i in range(num_prompts):
-            base_prompt = template["base"].format(background=background_desc)
-            
-            # Add variation if available
-            if i < len(template["variations"]):
-                variation = template["variations"][i]
-                prompt = f"{base_prompt}, {variation}"
-            else:
-                # Use mood modifiers for extra variations
-                mood = list(self.mood_modifiers.values())[i % len(self.mood_modifiers)]
-                prompt = f"{base_prompt}, {mood}"
-            
-            # Add purpose-specific modifiers
-            purpose = brief.get("purpose", "insta")
-            prompt = self._add_purpose_modifiers(prompt, purpose)
-            
-            # Add LoRA settings if needed
-            if template.get("lora_type"):
-                lora_strength = template.get("lora_strength", 0.7)
-                prompt += f" <lora_type:\"{template['lora_type']}\", lora_strength:{lora_strength}>"
-            
-            prompts.append(prompt)
-        
-        return prompts
+        # Planned once per (style, background, purpose, package), so this is a cached lookup
+        purpose = brief.get("purpose", "insta")
+        cross_styles = self.CROSS_STYLE_PACKAGES.get(package_type, 0)
+        return list(self.catalog.prompts(style, background, purpose, num_prompts, cross_styles))
     
     def _get_prompt_count(self, package: int) -> int:
         """Determine number of prompt variations based on package"""
@@ -182,67 +381,16 @@ class PromptGenerator:
     def _process_background(self, background: str) -> str:
         """Process background description"""
         
-        # If it's a predefined background type
-        if background.lower() in self.background_options:
-            return self.background_options[background.lower()]
-        
-        # If it's a custom description
-        if len(background) > 5:
-            return f"background: {background}"
-        
-        # Default background
-        return self.background_options["studio"]
+        return self.catalog.background(background)
     
     def _add_purpose_modifiers(self, prompt: str, purpose: str) -> str:
         """Add purpose-specific modifiers to prompt"""
         
-        modifiers = {
-            "insta": "instagram-ready, social media optimized",
-            "avatar": "profile picture perfect, clean and professional",
-            "career": "professional and polished, LinkedIn ready",
-            "dating": "attractive and approachable, confident smile"
-        }
-        
-        if purpose in modifiers:
-            prompt += f", {modifiers[purpose]}"
+        if purpose in self.catalog.purposes:
+            prompt += f", {self.catalog.purposes[purpose]}"
         
         return prompt
     
-    def _generate_cross_style_prompts(self, brief: Dict[str, Any]) -> List[str]:
-        """Generate cross-style prompts for premium packages"""
-        
-        try:
-            current_style = brief.get("style", "Studio Vogue")
-            background = brief.get("background", "studio backdrop")
-            
-            # Get 2-3 different styles
-            other_styles = [style for style in self.style_templates.keys() if style != current_style]
-            selected_styles = random.sample(other_styles, min(3, len(other_styles)))
-            
-            cross_prompts = []
-            for style in selected_styles:
-                template = self.style_templates[style]
-                background_desc = self._process_background(background)
-                
-                # Generate 2-3 prompts per style
-                for i in range(2):
-                    base_prompt = template["base"].format(background=background_desc)
-                    if i < len(template["variations"]):
-                        variation = template["variations"][i]
-                        prompt = f"{base_prompt} {variation}"
-                    else:
-                        mood = random.choice(list(self.mood_modifiers.values()))
-                        prompt = f"{base_prompt} {mood}"
-                    
-                    cross_prompts.append(prompt)
-            
-            logger.info(f"Generated {len(cross_prompts)} cross-style prompts")
-            return cross_prompts
-            
-        except Exception as e:
-            logger.error(f"Error generating cross-style prompts: {e}")
-            return []
-    
     def _get_fallback_prompts(self, brief: Dict[str, Any]) -> List[str]:
         """Get fallback prompts in case of error"""
         
@@ -269,17 +417,11 @@ class PromptGenerator:
     def validate_prompt(self, prompt: str) -> bool:
         """Validate prompt for content policy"""
         
-        # Check for forbidden words/phrases
-        forbidden_words = [
-            "nude", "naked", "nsfw", "sexual", "explicit",
-            "inappropriate", "adult", "xxx", "porn"
-        ]
-        
-        prompt_lower = prompt.lower()
-        for word in forbidden_words:
-            if word in prompt_lower:
-                logger.warning(f"Prompt contains forbidden word: {word}")
-                return False
+        # Check for forbidden words/phrases (one pass over the compiled policy)
+        hits = get_content_policy().find_all(prompt)
+        if hits:
+            logger.warning(f"Prompt contains forbidden words: {', '.join(hit.term for hit in hits)}")
+            return False
         
         # Check minimum length
         if len(prompt) < 10:
@@ -293,6 +435,27 @@ class PromptGenerator:
         
         return True
     
+    def validate_brief(self, brief: Dict[str, Any]) -> bool:
+        """Validate user-written brief text for content policy (one pass over all fields)"""
+        
+        texts = [str(brief.get(field) or "") for field in self.BRIEF_TEXT_FIELDS]
+        hits = [hit for field_hits in get_content_policy().find_all_many(texts) for hit in field_hits]
+        if hits:
+            logger.warning(f"Brief contains forbidden words: {', '.join(hit.term for hit in hits)}")
+            return False
+        
+        return True
+    
+    def validate_prompts(self, prompts: List[str]) -> List[bool]:
+        """Validate a prompt list in bulk (one policy pass for all prompts)"""
+        
+        results = []
+        for prompt, hits in zip(prompts, get_content_policy().find_all_many(prompts)):
+            if hits:
+                logger.warning(f"Prompt contains forbidden words: {', '.join(hit.term for hit in hits)}")
+            results.append(not hits and 10 <= len(prompt) <= 1000)
+        return results
+    
     def get_style_preview(self, style: str) -> str:
         """Get style preview description"""
         
@@ -0,0 +1,192 @@
+"""
+Content-addressed cache of generation results
+Non-personalized generations (trial sessions, style previews) give the same
+result for the same request, so they are served from object storage instead
+of PiAPI
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from botocore.exceptions import ClientError
+
+from .config import settings
+from .storage import YandexObjectStorage
+
+logger = logging.getLogger(__name__)
+
+
+def reference_digest(reference_images: Optional[List[str]]) -> str:
+    """Digest of the reference set (order does not matter), empty set for text-only generation"""
+    
+    return hashlib.sha256("\n".join(sorted(reference_images or [])).encode("utf-8")).hexdigest()
+
+
+def result_cache_key(model: str, prompt: str, lora: Dict[str, Any], size: str, seed: int,
+                     references: str) -> str:
+    """
+    Cache key of one generation
+    
+    Args:
+        lora: LoRA settings as sent to the model
+        references: reference_digest() of the reference images
+    """
+    
+    payload = json.dumps({
+        "model": model,
+        "prompt": prompt,
+        "lora": lora,
+        "size": size,
+        "seed": seed,
+        "references": references
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PromptResultCache:
+    """
+    LRU of cache key -> image URLs in front of object storage
+    Results are copied into the bucket under cache/results/ (PiAPI URLs
+    expire) next to a JSON manifest with the creation time used for TTL
+    """
+    
+    def __init__(self, storage: YandexObjectStorage, max_size: int = 2048, ttl: float = 30 * 24 * 3600,
+                 prefix: str = "cache/results"):
+        self.storage = storage
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prefix = prefix.rstrip("/")
+        
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stored = 0
+    
+    def _manifest_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json"
+    
+    def _remember(self, key: str, urls: List[str], created_at: float):
+        with self._lock:
+            self._entries[key] = (urls, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def get(self, key: str) -> Optional[List[str]]:
+        """Cached image URLs or None (blocking: may read object storage)"""
+        
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.expirations += 1
+        
+        try:
+            response = self.storage.s3_client.get_object(Bucket=self.storage.bucket_name, Key=self._manifest_key(key))
+            manifest = json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                logger.error(f"❌ Error reading result cache {key[:12]}: {e}")
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.error(f"❌ Error reading result cache {key[:12]}: {e}")
+            self.misses += 1
+            return None
+        
+        if now - manifest["created_at"] >= self.ttl:
+            self.expirations += 1
+            self.misses += 1
+            return None
+        
+        self._remember(key, manifest["urls"], manifest["created_at"])
+        self.store_hits += 1
+        return manifest["urls"]
+    
+    def put(self, key: str, image_urls: List[str], **metadata: Any) -> List[str]:
+        """
+        Copy generated images into the cache (blocking)
+        
+        Returns:
+            Permanent cache URLs of the images
+        """
+        
+        cached_urls = []
+        with httpx.Client(timeout=60.0) as client:
+            for n, url in enumerate(image_urls):
+                response = client.get(url)
+                response.raise_for_status()
+                
+                object_key = f"{self.prefix}/{key}/{n}.jpg"
+                self.storage.s3_client.put_object(
+                    Bucket=self.storage.bucket_name,
+                    Key=object_key,
+                    Body=response.content,
+                    ContentType="image/jpeg",
+                    ACL="public-read"
+                )
+                cached_urls.append(self.storage.public_url(object_key))
+        
+        created_at = time.time()
+        self.storage.s3_client.put_object(
+            Bucket=self.storage.bucket_name,
+            Key=self._manifest_key(key),
+            Body=json.dumps({"urls": cached_urls, "created_at": created_at, **metadata}, ensure_ascii=False),
+            ContentType="application/json"
+        )
+        
+        self._remember(key, cached_urls, created_at)
+        self.stored += 1
+        return cached_urls
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.store_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.store_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stored": self.stored
+        }
+
+
+# Глобальный экземпляр
+prompt_result_cache = None
+
+
+def get_prompt_result_cache() -> Optional[PromptResultCache]:
+    """Получение кэша результатов генерации (None, если кэш выключен)"""
+    global prompt_result_cache
+    
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    
+    if prompt_result_cache is None:
+        prompt_result_cache = PromptResultCache(
+            YandexObjectStorage(),
+            max_size=settings.RESULT_CACHE_SIZE,
+            ttl=settings.RESULT_CACHE_TTL_HOURS * 3600
+        )
+    
+    return prompt_result_cache
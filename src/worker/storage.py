@@ -43,6 +43,10 @@ class YandexObjectStorage:
         
         logger.info(f"🪣 Yandex Object Storage initialized for bucket: {self.bucket_name}")
     
+    def public_url(self, key: str) -> str:
+        """Публичная ссылка на объект"""
+        return f"https://storage.yandexcloud.net/{self.bucket_name}/{quote(key)}"
+    
     async def upload_image(self, image_data: bytes, key: str, 
                           content_type: str = 'image/jpeg') -> Dict[str, Any]:
         """
@@ -108,7 +112,7 @@ class YandexObjectStorage:
             )
             
             # Формируем публичную ссылку
-            public_url = f"https://storage.yandexcloud.net/{self.bucket_name}/{quote(key)}"
+            public_url = self.public_url(key)
             
             logger.info(f"✅ File uploaded: {key}")
             
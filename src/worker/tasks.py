@@ -4,133 +4,447 @@ Image processing tasks for Yandex Message Queue
 
 import os
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Optional
 import httpx
 import asyncio
 
-from .image_generator import ImageGenerator
+from .image_generator import AsyncImageGenerator
 from .storage import YandexObjectStorage
 from .prompts import PromptGenerator
 from .utils import create_image_album, optimize_image
 from .config import settings
-from .notifications import TelegramNotifier
+from .notifications import get_telegram_notifier
+from .progress import ProgressReporter, create_progress_reporter
+from .delivery import IncrementalDelivery
+from .result_cache import PromptResultCache, get_prompt_result_cache, reference_digest, result_cache_key
+from .cost_scheduler import BudgetExceeded, SessionBudget, get_cost_scheduler, FLUX_SCHNELL, GPT_IMAGE
+from .job_state import get_job_state_store, JobClaim, JobStateStore, JobInProgress, JobNotReady, GENERATED, GENERATING, UPLOADED, NOTIFIED
 
 logger = logging.getLogger(__name__)
 
+# Images requested per prompt (num_images of the PiAPI generation calls)
+IMAGES_PER_PROMPT = 4
 
-def process_image_generation_task(task_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Process image generation task from YC Message Queue"""
+
+def process_image_generation_task(task_data: Dict[str, Any], idempotency_key: str = None) -> Dict[str, Any]:
+    """
+    Process image generation task from YC Message Queue
+    
+    Idempotent: stages already done for this job (idempotency_key, or
+    session_id for old messages) are skipped, a finished job is not rerun
+    """
     
     logger.info(f"🎨 Starting image generation task: {task_data}")
     
+    user_id = task_data.get('user_id')
+    job_store = get_job_state_store()
+    job_key = idempotency_key or task_data.get('session_id')
+    
+    try:
+        claim = job_store.claim(job_key)
+    except JobInProgress as e:
+        # Message stays in queue and comes back after visibility timeout
+        logger.warning(f"⏳ {e}, leaving message for redelivery")
+        return {'success': False, 'error': str(e), 'in_progress': True}
+    
+    if claim is None:
+        return {'success': True, 'skipped': True}
+    
+    delivery = None
     try:
         # Extract data
-        user_id = task_data['user_id']
         session_id = task_data['session_id']
         brief = task_data['brief']
         photos = task_data['photos']
         
-        # Initialize components
-        image_generator = ImageGenerator('flux')
-        prompt_generator = PromptGenerator()
+        # Live progress message, kept across redeliveries of the job
+        progress = create_progress_reporter(
+            user_id,
+            message_id=claim.data.get('progress_message_id'),
+            on_message=lambda message_id: remember_progress_message(claim, message_id)
+        )
         
-        # Generate prompts based on brief
-        prompts = prompt_generator.generate_prompts(brief)
-        logger.info(f"📝 Generated {len(prompts)} prompts for user {user_id}")
+        # Paid PiAPI calls of the session are admitted against its budget
+        scheduler = get_cost_scheduler()
+        budget = scheduler.session(session_id, brief.get('package_type')) if scheduler else None
         
-        # Generate images
-        generated_images = []
-        for i, prompt in enumerate(prompts):
-            try:
-                # Choose generator based on brief
-                generator = brief.get('generator', 'flux')
-                
-                if generator == 'flux':
-                    image_urls = image_generator.generate_with_flux(
-                        prompt=prompt,
-                        reference_images=photos,
-                        lora_type=brief.get('lora_type', 'realism')
-                    )
-                else:
-                    image_urls = image_generator.generate_with_gpt(
-                        prompt=prompt,
-                        reference_images=photos
-                    )
-                
-                generated_images.extend(image_urls)
-                
-                logger.info(f"✨ Generated {len(image_urls)} images for prompt {i+1}")
-                
-            except Exception as e:
-                logger.error(f"❌ Error generating image {i}: {e}")
-                continue
+        uploads = claim.data.setdefault('uploads', {})
         
-        logger.info(f"🎉 Generated {len(generated_images)} total images for user {user_id}")
+        def uploaded_so_far() -> Dict[str, Dict[str, str]]:
+            # Each upload gets its own copy, claim.data only changes under its lock
+            with claim.lock:
+                return dict(uploads)
         
-        # Upload to storage
-        upload_result = upload_to_storage(
-            user_id=user_id,
-            session_id=session_id,
-            image_urls=generated_images,
-            brief=brief
-        )
+        def on_uploaded(url, item):
+            with claim.lock:
+                uploads[url] = item
+            job_store.checkpoint(claim)
+            progress.advance('uploads_done')
         
-        # Check if video generation is needed
-        if brief.get('package_type') in ['standard', 'premium'] and brief.get('enable_video', False):
-            # Generate video from best image
-            if upload_result.get('uploaded_urls'):
-                video_result = generate_video(
+        # Send images as their prompts finish instead of all at the end
+        if settings.INCREMENTAL_DELIVERY and not claim.reached(NOTIFIED):
+            def upload_prompt(index: int, image_urls: List[str]) -> List[Dict[str, str]]:
+                uploaded = uploaded_so_far()
+                upload_to_storage(
                     user_id=user_id,
                     session_id=session_id,
-                    best_image_url=upload_result['uploaded_urls'][0],
-                    brief=brief
+                    image_urls=image_urls,
+                    brief=brief,
+                    uploaded=uploaded,
+                    on_uploaded=on_uploaded,
+                    names=image_names(claim)
                 )
-                upload_result['video_url'] = video_result.get('video_url')
+                return [uploaded[url] for url in image_urls if url in uploaded]
+            
+            delivery = IncrementalDelivery(
+                claim, job_store, get_telegram_notifier(), user_id, upload_prompt,
+                batch_size=settings.DELIVERY_BATCH_SIZE
+            )
+        
+        if claim.reached(GENERATED):
+            generated_images = claim.data.get('generated_images', [])
+            logger.info(f"⏭️ Reusing {len(generated_images)} generated images of session {session_id}")
+        else:
+            job_store.advance(claim, GENERATING)
+            generated_images = generate_session_images(
+                claim, job_store, brief, photos, progress,
+                on_prompt_done=delivery.prompt_done if delivery else None,
+                budget=budget
+            )
+            
+            logger.info(f"🎉 Generated {len(generated_images)} total images for user {user_id}")
+            job_store.advance(claim, GENERATED, generated_images=generated_images)
         
-        # Post-process for premium package
-        if brief.get('package_type') == 'premium' and brief.get('enable_post_process', False):
-            if upload_result.get('uploaded_urls'):
-                post_process_result = post_process_images(
-                    user_id=user_id,
-                    session_id=session_id,
-                    image_paths=upload_result['uploaded_urls'],
-                    brief=brief
-                )
-                upload_result['post_processed_urls'] = post_process_result.get('processed_urls')
+        if delivery:
+            # Uploads of the incremental path must settle before the final upload step
+            delivery.wait()
+        
+        if claim.reached(UPLOADED):
+            upload_result = claim.data.get('upload_result', {})
+            logger.info(f"⏭️ Images of session {session_id} already uploaded")
+        else:
+            # Upload to storage (images delivered incrementally are already there)
+            progress.update(uploads_total=len(generated_images), uploads_done=len(uploads))
+            upload_result = upload_to_storage(
+                user_id=user_id,
+                session_id=session_id,
+                image_urls=generated_images,
+                brief=brief,
+                uploaded=uploaded_so_far(),
+                on_uploaded=on_uploaded,
+                names=image_names(claim)
+            )
+            if not upload_result.get('success'):
+                raise Exception(f"Upload failed: {upload_result.get('error')}")
+            
+            # Check if video generation is needed
+            if brief.get('package_type') in ['standard', 'premium'] and brief.get('enable_video', False):
+                # Generate video from best image
+                if upload_result.get('uploaded_urls'):
+                    progress.update(video='running')
+                    video_result = generate_video(
+                        user_id=user_id,
+                        session_id=session_id,
+                        best_image_url=upload_result['uploaded_urls'][0],
+                        brief=brief
+                    )
+                    upload_result['video_url'] = video_result.get('video_url')
+                    progress.update(video='done' if video_result.get('video_url') else None)
+            
+            # Post-process for premium package
+            if brief.get('package_type') == 'premium' and brief.get('enable_post_process', False):
+                if upload_result.get('uploaded_urls'):
+                    post_process_result = post_process_images(
+                        user_id=user_id,
+                        session_id=session_id,
+                        image_paths=upload_result['uploaded_urls'],
+                        brief=brief
+                    )
+                    upload_result['post_processed_urls'] = post_process_result.get('processed_urls')
+            
+            job_store.advance(claim, UPLOADED, upload_result=upload_result)
         
         # Notify user about success
-        notify_user_success(user_id, upload_result)
+        if not claim.reached(NOTIFIED):
+            if delivery:
+                # Whatever is still undelivered goes out before the summary
+                delivery.finish([
+                    {'key': key, 'url': url}
+                    for key, url in zip(upload_result.get('uploaded_keys', []), upload_result.get('uploaded_urls', []))
+                ])
+            progress.finish()
+            notify_user_success(user_id, upload_result)
+            job_store.advance(claim, NOTIFIED)
         
         return {
             'success': True,
             'images_generated': len(generated_images),
             'result': upload_result
         }
+    
+    except JobInProgress as e:
+        # Lease expired and another worker took the job over
+        logger.warning(f"⏳ {e}")
+        return {'success': False, 'error': str(e), 'in_progress': True}
+    
+    except JobNotReady as e:
+        # Checkpoints are saved, the next delivery picks the job up from here
+        logger.warning(f"⏳ {e}")
+        if delivery:
+            delivery.close()
+        job_store.release(claim)
+        return {'success': False, 'error': str(e), 'in_progress': True}
         
     except Exception as e:
         logger.error(f"❌ Error in process_image_generation_task: {e}")
-        notify_user_error(user_id, str(e))
+        if delivery:
+            delivery.close()
+        
+        # Tell the user once per job, not on every redelivery
+        if not claim.data.get('error_notified'):
+            notify_user_error(user_id, str(e))
+            try:
+                job_store.checkpoint(claim, error_notified=True)
+            except JobInProgress:
+                pass
+        job_store.release(claim)
+        
         return {
             'success': False,
             'error': str(e)
         }
 
 
-def upload_to_storage(user_id: int, session_id: str, image_urls: List[str], brief: Dict[str, Any]) -> Dict[str, Any]:
-    """Upload images to Yandex Cloud Storage"""
+def generate_session_images(claim: JobClaim, job_store: JobStateStore, brief: Dict[str, Any],
+                            photos: List[str], progress: ProgressReporter,
+                            on_prompt_done: Optional[Callable[[int, List[str]], None]] = None,
+                            budget: Optional[SessionBudget] = None) -> List[str]:
+    """
+    Generate images prompt by prompt with a checkpoint after every step
+    
+    claim.data['prompts'] keeps the prompt list (results are keyed by prompt
+    index and the style catalog may be reloaded between attempts, so a
+    resumed job must reuse it) and claim.data['prompt_results'] maps prompt
+    index -> {image_urls, model}. Finished prompts are skipped.
+    on_prompt_done gets (index, image_urls) of every finished prompt, an
+    empty list if the prompt failed. With a budget, prompts that do not fit
+    the session budget are skipped and a spent global budget postpones the
+    job (JobNotReady).
+    """
+    
+    if 'prompts' not in claim.data:
+        prompt_generator = PromptGenerator()
+        if not prompt_generator.validate_brief(brief):
+            raise Exception("Описание фотосессии нарушает правила контента")
+        prompts = prompt_generator.generate_prompts(brief)
+        
+        # Templates come from a reloadable catalog file, so prompts are checked as well
+        allowed = prompt_generator.validate_prompts(prompts)
+        if not any(allowed):
+            raise Exception("Описание фотосессии нарушает правила контента")
+        prompts = [prompt for prompt, ok in zip(prompts, allowed) if ok]
+        job_store.checkpoint(claim, prompts=prompts, prompt_results={})
+        logger.info(f"📝 Generated {len(prompts)} prompts for job {claim.job_key[:12]}")
+    
+    prompts = claim.data['prompts']
+    results = claim.data.setdefault('prompt_results', {})
+    pending = [i for i in range(len(prompts)) if not results.get(str(i), {}).get('image_urls')]
+    
+    if len(pending) < len(prompts):
+        logger.info(f"⏭️ {len(prompts) - len(pending)}/{len(prompts)} prompts already generated")
+    progress.update(prompts_total=len(prompts), prompts_done=len(prompts) - len(pending))
+    
+    on_prompt_done = on_prompt_done or (lambda index, image_urls: None)
+    for i in range(len(prompts)):
+        if i not in pending:
+            on_prompt_done(i, results[str(i)]['image_urls'])
+    
+    if pending:
+        model = FLUX_SCHNELL if brief.get('generator', 'flux') == 'flux' else GPT_IMAGE
+        # Identical requests (preview or trial prompt with the same photos) are served from the result cache
+        cacheable = brief.get('preview', False) or brief.get('package_type') in [
+            package.strip() for package in settings.RESULT_CACHE_PACKAGES.split(',')
+        ]
+        asyncio.run(_generate_prompts(
+            claim, job_store, pending, photos, model, brief.get('lora_type', 'realism'), progress, on_prompt_done,
+            cache=get_prompt_result_cache() if cacheable else None,
+            seed=brief.get('seed', settings.RESULT_CACHE_SEED),
+            budget=budget
+        ))
+    
+    generated_images = []
+    for i in range(len(prompts)):
+        generated_images.extend(results.get(str(i), {}).get('image_urls', []))
+    
+    return generated_images
+
+
+async def _generate_prompts(claim: JobClaim, job_store: JobStateStore, pending: List[int], photos: List[str],
+                            model: str, lora_type: str, progress: ProgressReporter,
+                            on_prompt_done: Callable[[int, List[str]], None],
+                            cache: Optional[PromptResultCache] = None, seed: int = 0,
+                            budget: Optional[SessionBudget] = None):
+    """
+    Generate pending prompts, GENERATION_CONCURRENCY calls at a time
+    PiAPI returns image URLs right away, so every finished prompt is
+    checkpointed. With a cache, Flux prompts are generated with a fixed seed
+    and looked up first; new results are copied into the cache. When the
+    session budget runs low, GPT prompts go to flux-schnell.
+    """
+    
+    image_generator = AsyncImageGenerator(settings.PIAPI_KEY, None)
+    prompts = claim.data['prompts']
+    results = claim.data['prompt_results']
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(settings.GENERATION_CONCURRENCY)
+    started = 0
+    
+    def _done(i: int, image_urls: List[str], prompt_model: str):
+        with claim.lock:
+            results[str(i)] = {'image_urls': image_urls, 'model': prompt_model}
+        job_store.checkpoint(claim)
+        progress.advance('prompts_done')
+        on_prompt_done(i, image_urls)
+    
+    def _skipped(i: int):
+        # Failed and skipped prompts count towards progress too
+        progress.advance('prompts_done')
+        on_prompt_done(i, [])
+    
+    async def _generate(i: int):
+        nonlocal started
+        async with semaphore:
+            prompt_model = model
+            if budget:
+                prompt_model = budget.choose_model(model, len(pending) - started, IMAGES_PER_PROMPT)
+            started += 1
+            
+            try:
+                cache_key = None
+                if cache and prompt_model == FLUX_SCHNELL:
+                    # Reference photos are part of the key, personalized results are never shared
+                    cache_key = result_cache_key(
+                        FLUX_SCHNELL, prompts[i], {"style": lora_type}, "1024x1024", seed, reference_digest(photos)
+                    )
+                    cached_urls = await loop.run_in_executor(None, cache.get, cache_key)
+                    if cached_urls:
+                        logger.info(f"♻️ Prompt {i + 1} served from result cache")
+                        _done(i, cached_urls, prompt_model)
+                        return
+                
+                if budget:
+                    budget.charge(prompt_model, images=IMAGES_PER_PROMPT)
+                
+                try:
+                    if prompt_model == FLUX_SCHNELL:
+                        image_urls = await image_generator.generate_with_flux(
+                            prompt=prompts[i], reference_images=photos, lora_type=lora_type,
+                            num_images=IMAGES_PER_PROMPT, seed=seed if cache_key else None
+                        )
+                    else:
+                        image_urls = await image_generator.generate_with_gpt(
+                            prompt=prompts[i], reference_images=photos, num_images=IMAGES_PER_PROMPT
+                        )
+                except BaseException:
+                    # Also when cancelled because a sibling prompt postponed the job
+                    if budget:
+                        budget.refund(prompt_model, images=IMAGES_PER_PROMPT)
+                    raise
+                
+                if not image_urls:
+                    logger.error(f"❌ No images returned for prompt {i + 1}")
+                    if budget:
+                        budget.refund(prompt_model, images=IMAGES_PER_PROMPT)
+                    _skipped(i)
+                    return
+                
+                if cache_key:
+                    try:
+                        image_urls = await loop.run_in_executor(
+                            None, lambda: cache.put(cache_key, image_urls, prompt=prompts[i])
+                        )
+                    except Exception as e:
+                        logger.error(f"❌ Error caching result of prompt {i + 1}: {e}")
+                
+                _done(i, image_urls, prompt_model)
+                logger.info(f"✨ Generated {len(image_urls)} images for prompt {i + 1}")
+                
+            except JobInProgress:
+                raise
+            except BudgetExceeded as e:
+                if e.scope == 'global':
+                    # Finished prompts are checkpointed, the job resumes once the budget frees up
+                    raise JobNotReady(str(e)) from e
+                _skipped(i)
+            except Exception as e:
+                logger.error(f"❌ Error generating image {i}: {e}")
+                _skipped(i)
+    
+    await asyncio.gather(*(_generate(i) for i in pending))
+
+
+def image_names(claim: JobClaim) -> Dict[str, str]:
+    """Storage file name of every generated image: image_{prompt}_{n}"""
+    
+    names = {}
+    with claim.lock:
+        for index, entry in claim.data.get('prompt_results', {}).items():
+            for n, url in enumerate(entry.get('image_urls', [])):
+                names[url] = f"image_{index}_{n}"
+    return names
+
+
+def remember_progress_message(claim: JobClaim, message_id: int):
+    """
+    Keep the progress message of the job (called on the notifier loop)
+    No I/O here, the worker's next checkpoint saves it
+    """
+    
+    with claim.lock:
+        claim.data['progress_message_id'] = message_id
+
+
+def upload_to_storage(
+    user_id: int,
+    session_id: str,
+    image_urls: List[str],
+    brief: Dict[str, Any],
+    uploaded: Optional[Dict[str, Dict[str, str]]] = None,
+    on_uploaded: Optional[Callable[[str, Dict[str, str]], None]] = None,
+    names: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """
+    Upload images to Yandex Cloud Storage
+    
+    Args:
+        uploaded: source URL -> {key, url} of images uploaded by an earlier attempt
+        on_uploaded: called with source URL and {key, url} after each upload
+        names: source URL -> file name, image_{i} by default
+    """
     
     logger.info(f"☁️ Starting storage upload for user {user_id}")
     
+    if uploaded is None:
+        uploaded = {}
+    names = names or {}
+    
     try:
         # Initialize storage
         storage = YandexObjectStorage()
         
+        # Large sessions are zipped from local files, so everything is needed then
+        need_album = len(image_urls) > 50
+        
         # Download and optimize images
         local_images = []
+        sources = {}
         for i, url in enumerate(image_urls):
+            if url in uploaded and not need_album:
+                continue
+            
             try:
                 # Download image
-                local_path = f"/tmp/worker/{session_id}/image_{i}.jpg"
+                local_path = f"/tmp/worker/{session_id}/{names.get(url, f'image_{i}')}.jpg"
                 os.makedirs(os.path.dirname(local_path), exist_ok=True)
                 
                 # Download from URL
@@ -143,6 +457,7 @@ def upload_to_storage(user_id: int, session_id: str, image_urls: List[str], brie
                 # Optimize image
                 optimized_path = optimize_image(local_path)
                 local_images.append(optimized_path)
+                sources[optimized_path] = (i, url)
                 
                 logger.info(f"⬇️ Downloaded image {i + 1}/{len(image_urls)}")
                 
@@ -150,21 +465,37 @@ def upload_to_storage(user_id: int, session_id: str, image_urls: List[str], brie
                 logger.error(f"❌ Error downloading image {i}: {e}")
                 continue
         
+        # Screen the whole session for NSFW before anything is uploaded
+        if settings.NSFW_SCREENING_ENABLED and local_images:
+            fresh = [path for path in local_images if sources[path][1] not in uploaded]
+            safe = set(screen_session_images(fresh)) if fresh else set()
+            local_images = [path for path in local_images if sources[path][1] in uploaded or path in safe]
+        
         # Upload to storage
-        uploaded_urls = []
-        for i, local_path in enumerate(local_images):
+        for local_path in local_images:
+            i, source_url = sources[local_path]
+            if source_url in uploaded:
+                continue
+            
             try:
-                # Upload to storage
-                key = f"sessions/{session_id}/images/image_{i}.jpg"
+                # Key follows the generated image, so a retry overwrites instead of duplicating
+                key = f"sessions/{session_id}/images/{names.get(source_url, f'image_{i}')}.jpg"
                 url = storage.upload_file(local_path, key)
-                uploaded_urls.append(url)
+                uploaded[source_url] = {'key': key, 'url': url}
+                if on_uploaded:
+                    on_uploaded(source_url, uploaded[source_url])
                 
-                logger.info(f"⬆️ Uploaded image {i + 1}/{len(local_images)}")
+                logger.info(f"⬆️ Uploaded image {i + 1}/{len(image_urls)}")
                 
+            except JobInProgress:
+                raise
             except Exception as e:
                 logger.error(f"❌ Error uploading image {i}: {e}")
                 continue
         
+        uploaded_urls = [uploaded[url]['url'] for url in image_urls if url in uploaded]
+        uploaded_keys = [uploaded[url]['key'] for url in image_urls if url in uploaded]
+        
         # Create album/zip if needed
         album_url = None
         if len(uploaded_urls) > 50:
@@ -179,10 +510,13 @@ def upload_to_storage(user_id: int, session_id: str, image_urls: List[str], brie
         return {
             'success': True,
             'uploaded_urls': uploaded_urls,
+            'uploaded_keys': uploaded_keys,
             'album_url': album_url,
             'total_images': len(uploaded_urls)
         }
         
+    except JobInProgress:
+        raise
     except Exception as e:
         logger.error(f"❌ Error in upload_to_storage: {e}")
         return {
@@ -191,11 +525,38 @@ def upload_to_storage(user_id: int, session_id: str, image_urls: List[str], brie
         }
 
 
+def screen_session_images(image_paths: List[str]) -> List[str]:
+    """Drop images that fail session-level NSFW screening"""
+    
+    from .post_processor import NSFWScreener
+    
+    async def _screen() -> Dict[str, bool]:
+        async with NSFWScreener(
+            settings.PIAPI_KEY,
+            max_concurrency=settings.NSFW_SCREENING_CONCURRENCY,
+            thumbnail_size=settings.NSFW_THUMBNAIL_SIZE
+        ) as screener:
+            return await screener.screen_session(image_paths)
+    
+    try:
+        verdicts = asyncio.run(_screen())
+    except Exception as e:
+        logger.error(f"❌ Error in NSFW screening, keeping all images: {e}")
+        return image_paths
+    
+    safe_images = [path for path in image_paths if verdicts.get(path, True)]
+    
+    if len(safe_images) < len(image_paths):
+        logger.warning(f"🔞 NSFW screening rejected {len(image_paths) - len(safe_images)} images")
+    
+    return safe_images
+
+
 def notify_user_success(user_id: int, result: Dict[str, Any]) -> bool:
     """Notify user about successful generation"""
     
     try:
-        notifier = TelegramNotifier(settings.BOT_TOKEN)
+        notifier = get_telegram_notifier()
         
         total_images = result.get('total_images', 0)
         album_url = result.get('album_url')
@@ -225,7 +586,7 @@ def notify_user_error(user_id: int, error_message: str) -> bool:
     """Notify user about error"""
     
     try:
-        notifier = TelegramNotifier(settings.BOT_TOKEN)
+        notifier = get_telegram_notifier()
         
         message = f"❌ Произошла ошибка при создании фотосессии:\n\n{error_message}\n\n"
         message += "Попробуйте еще раз или обратитесь в поддержку."
@@ -245,15 +606,22 @@ def generate_video(user_id: int, session_id: str, best_image_url: str, brief: Di
     try:
         # Initialize video generator
         from .video_generator import VideoGenerator
-        video_generator = VideoGenerator()
+        video_generator = VideoGenerator(settings.PIAPI_KEY)
+        
+        # Video is a paid PiAPI call, admit it against the session budget
+        scheduler = get_cost_scheduler()
+        budget = scheduler.session(session_id, brief.get('package_type')) if scheduler else None
+        cost = video_generator.get_video_cost(brief.get('package_type'), 'short')
+        if budget:
+            budget.charge('video', cost=cost)
         
         # Generate video
-        video_url = video_generator.generate_video(
-            image_url=best_image_url,
-            prompt=brief.get('video_prompt', ''),
-            duration=brief.get('video_duration', 6),
-            style=brief.get('style_code', 'RL-01')
-        )
+        try:
+            video_url = asyncio.run(video_generator.make_short_video(best_image_url, brief.get('style', 'RL-01'), brief))
+        except BaseException:
+            if budget:
+                budget.refund('video', cost=cost)
+            raise
         
         if video_url:
             logger.info(f"✅ Video generated successfully for user {user_id}")
@@ -263,6 +631,8 @@ def generate_video(user_id: int, session_id: str, best_image_url: str, brief: Di
             }
         else:
             logger.error(f"❌ Video generation failed for user {user_id}")
+            if budget:
+                budget.refund('video', cost=cost)
             return {
                 'success': False,
                 'error': 'Video generation failed'
@@ -277,38 +647,85 @@ def generate_video(user_id: int, session_id: str, best_image_url: str, brief: Di
 
 
 def post_process_images(user_id: int, session_id: str, image_paths: List[str], brief: Dict[str, Any]) -> Dict[str, Any]:
-    """Post-process images for premium package"""
+    """
+    Post-process images for premium package
+    
+    Args:
+        image_paths: URLs of the uploaded session images
+    """
     
     logger.info(f"✨ Starting post-processing for user {user_id}")
     
     try:
-        # Initialize post-processor
+        # Initialize post-processor; with storage each image is uploaded once
+        # and PiAPI stages get its URL instead of base64
         from .post_processor import PostProcessor
-        post_processor = PostProcessor()
+        storage = YandexObjectStorage()
+        post_processor = PostProcessor(
+            settings.PIAPI_KEY, storage=storage, upload_prefix=f"sessions/{session_id}/post_process"
+        )
         
-        processed_urls = []
+        # The pipeline works on local files
+        local_paths = {}
+        for i, image_url in enumerate(image_paths):
+            try:
+                local_path = f"/tmp/worker/{session_id}/post_process/image_{i}.jpg"
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                with httpx.stream('GET', image_url) as response:
+                    response.raise_for_status()
+                    with open(local_path, 'wb') as f:
+                        for chunk in response.iter_bytes():
+                            f.write(chunk)
+                local_paths[i] = local_path
+            except Exception as e:
+                logger.error(f"❌ Error downloading image {i} for post-processing: {e}")
         
-        for i, image_path in enumerate(image_paths):
+        async def _process_all():
+            semaphore = asyncio.Semaphore(3)
+            
+            async def _process(path: str):
+                async with semaphore:
+                    return await post_processor.process_image_with_report(path, brief.get('package_type'), brief)
+            
+            return await asyncio.gather(*(_process(path) for path in local_paths.values()))
+        
+        if not local_paths:
+            raise Exception("No images to post-process")
+        
+        # Admitted only once there is something to process, refunded if the pipeline fails
+        scheduler = get_cost_scheduler()
+        budget = scheduler.session(session_id, brief.get('package_type')) if scheduler else None
+        cost = post_processor.get_processing_cost()
+        if budget:
+            budget.charge('post_process', cost=cost)
+        
+        try:
+            results = asyncio.run(_process_all())
+        except BaseException:
+            if budget:
+                budget.refund('post_process', cost=cost)
+            raise
+        if budget and not any(report for _, report in results):
+            # Pipeline failed on every image
+            budget.refund('post_process', cost=cost)
+        
+        processed_urls = []
+        for i, (processed_path, report) in zip(local_paths, results):
+            if processed_path is None:
+                logger.warning(f"⚠️ Image {i} rejected by {report.rejected_by if report else 'post-processing'}")
+                continue
+            if report is None:
+                # Pipeline failed and returned the original, nothing to upload
+                logger.error(f"❌ Error processing image {i}")
+                continue
+            
             try:
-                # Process image
-                processed_url = post_processor.process_image(
-                    image_url=image_path,
-                    session_id=session_id,
-                    settings={
-                        'nsfw_filter': True,
-                        'face_restoration': True,
-                        'upscale_4k': True,
-                        'color_enhancement': True
-                    }
+                processed_urls.append(
+                    storage.upload_file(processed_path, f"sessions/{session_id}/processed/image_{i}.jpg")
                 )
-                
-                if processed_url:
-                    processed_urls.append(processed_url)
-                    logger.info(f"✅ Processed image {i + 1}/{len(image_paths)}")
-                
+                logger.info(f"✅ Processed image {i + 1}/{len(image_paths)}")
             except Exception as e:
-                logger.error(f"❌ Error processing image {i}: {e}")
-                continue
+                logger.error(f"❌ Error uploading processed image {i}: {e}")
         
         logger.info(f"✅ Post-processing complete: {len(processed_urls)} images processed")
         
@@ -8,7 +8,7 @@ import logging
 from typing import Dict, Any, Optional
 import aiohttp
 import os
-from .config import Config
+from .config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +21,7 @@ class VideoGenerator:
         
         self.api_key = api_key
         self.base_url = "https://api.piapi.ai/api/v1"
-        self.config = Config()
+        self.config = settings
         
         logger.info("Video generator initialized")
     